@@ -0,0 +1,135 @@
+import mmap
+
+
+class BufferStream:
+    """File-like object over a bytes-like object or an mmap.
+
+    Basic types and structs unpacked from a buffer stream are decoded directly
+    from the buffer with unpack_from, without going through read calls.
+
+    If the buffer is a bytearray, the stream is also writable. Basic types and
+    structs packed to the stream are then encoded directly into the buffer with
+    pack_into, and the buffer grows as needed.
+
+    If copy_arrays is false, NumPy arrays read with read_array are views on
+    the buffer instead of copies. The buffer needs to be writable for the
+    arrays to be writable.
+    """
+
+    def __init__(self, buffer, position=0, copy_arrays=True):
+        self.buffer = buffer
+        self.position = position
+        self.copy_arrays = copy_arrays
+
+    @classmethod
+    def from_file(cls, file_path, use_mmap=False):
+        """Create a buffer stream over the contents of a file.
+
+        If use_mmap is true, the file is memory mapped copy-on-write instead
+        of read into memory, and NumPy arrays read from the stream are views
+        on the mapping. Pages of the file are then only loaded when accessed
+        and only copied when modified. The arrays stay backed by the file for
+        as long as they are in use, and pages that have not been modified
+        reflect any changes to it. The file must therefore not be truncated
+        or written to in place while the arrays are in use. Writing a new
+        file and renaming it over the old one is safe, as the mapping keeps
+        referring to the old file.
+        """
+        with open(file_path, 'rb') as stream:
+            if not use_mmap:
+                return cls(stream.read())
+            buffer = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_COPY)
+        return cls(buffer, copy_arrays=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        pass
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def writable(self):
+        return isinstance(self.buffer, bytearray)
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=0):
+        if whence == 0:
+            position = offset
+        elif whence == 1:
+            position = self.position + offset
+        elif whence == 2:
+            position = len(self.buffer) + offset
+        else:
+            raise ValueError(f'invalid whence: {whence}')
+        if position < 0:
+            raise ValueError(f'negative seek position: {position}')
+        self.position = position
+        return position
+
+    def read(self, size=-1):
+        start = self.position
+        end = len(self.buffer)
+        if size is not None and size >= 0:
+            end = min(start + size, end)
+        if end <= start:
+            return b''
+        self.position = end
+        return bytes(self.buffer[start:end])
+
+    def readinto(self, destination):
+        data = self.read(memoryview(destination).nbytes)
+        memoryview(destination).cast('B')[:len(data)] = data
+        return len(data)
+
+    def write(self, data):
+        data = memoryview(data).cast('B')
+        start = self.allocate(len(data))
+        self.buffer[start:self.position] = data
+        return len(data)
+
+    def skip(self, size):
+        """Advance the position by size bytes and return the old position."""
+        position = self.position
+        self.position += size
+        return position
+
+    def allocate(self, size):
+        """Advance the position by size bytes, growing the buffer with zero
+        bytes if needed, and return the old position."""
+        position = self.skip(size)
+        if self.position > len(self.buffer):
+            self.buffer.extend(bytes(self.position - len(self.buffer)))
+        return position
+
+
+def read_array(stream, dtype, count):
+    """Read an array of count elements of the given NumPy dtype."""
+    import numpy
+    if isinstance(stream, BufferStream) and not stream.copy_arrays:
+        array = numpy.frombuffer(stream.buffer, dtype, count, stream.position)
+        stream.skip(array.nbytes)
+        return array
+    array = numpy.empty(count, dtype)
+    if stream.readinto(memoryview(array).cast('B')) != array.nbytes:
+        raise EOFError('unexpected end of stream')
+    return array
+
+
+def write_array(stream, array):
+    """Write the contents of a NumPy array.
+
+    Unlike numpy.ndarray.tofile, this works with any writable file-like
+    object.
+    """
+    import numpy
+    stream.write(memoryview(numpy.ascontiguousarray(array)).cast('B'))
@@ -1,28 +1,106 @@
 import copy
+import io
 import logging
 from struct import Struct as _Struct
+from btypes.buffer_stream import BufferStream, read_array, write_array
 
 
 logger = logging.getLogger(__name__)
 
 
+BYTE_ORDER_CHARACTERS = '@=<>!'
+
+NUMPY_TYPE_CODES = {
+    'b': 'i1', 'B': 'u1', '?': 'b1',
+    'h': 'i2', 'H': 'u2',
+    'i': 'i4', 'I': 'u4', 'l': 'i4', 'L': 'u4',
+    'q': 'i8', 'Q': 'u8',
+    'e': 'f2', 'f': 'f4', 'd': 'f8'
+}
+
+
+def combine_formats(format_strings):
+    """Combine struct module format strings into a single format string.
+
+    :param format_strings: Format strings, optionally prefixed by a byte order
+        character.
+    :return: The combined format string, or None if any of the format strings
+        is None or if the format strings use different byte orders.
+    """
+    byte_orders = set()
+    fragments = []
+    for format_string in format_strings:
+        if format_string is None:
+            return None
+        if format_string[:1] in BYTE_ORDER_CHARACTERS:
+            byte_orders.add(format_string[0])
+            format_string = format_string[1:]
+        fragments.append(format_string)
+    if len(byte_orders) > 1:
+        return None
+    byte_order = byte_orders.pop() if byte_orders else '>'
+    return byte_order + ''.join(fragments)
+
+
 class BasicType:
 
     def __init__(self, format_string):
         self._struct = _Struct(format_string)
 
+    def struct_format(self):
+        return self._struct.format
+
+    def encode(self, values, value):
+        values.append(value)
+
+    def decode(self, values):
+        return next(values)
+
     def pack(self, stream, value):
+        if isinstance(stream, BufferStream):
+            self._struct.pack_into(stream.buffer, stream.allocate(self._struct.size), value)
+            return
         stream.write(self._struct.pack(value))
 
     def pack_into(self, buffer, offset, value):
         self._struct.pack_into(buffer, offset, value)
 
     def unpack(self, stream):
+        if isinstance(stream, BufferStream):
+            return self._struct.unpack_from(stream.buffer, stream.skip(self._struct.size))[0]
         return self._struct.unpack(stream.read(self.sizeof()))[0]
 
     def unpack_from(self, buffer, offset):
         return self._struct.unpack_from(buffer, offset)[0]
 
+    def pack_array(self, stream, values):
+        values = list(values)
+        array_struct = self.array_struct(len(values))
+        if isinstance(stream, BufferStream):
+            array_struct.pack_into(stream.buffer, stream.allocate(array_struct.size), *values)
+            return
+        stream.write(array_struct.pack(*values))
+
+    def unpack_array(self, stream, count):
+        array_struct = self.array_struct(count)
+        if isinstance(stream, BufferStream):
+            return list(array_struct.unpack_from(stream.buffer, stream.skip(array_struct.size)))
+        return list(array_struct.unpack(stream.read(array_struct.size)))
+
+    def array_struct(self, count):
+        format_string = self._struct.format
+        byte_order = format_string[:1] if format_string[:1] in BYTE_ORDER_CHARACTERS else ''
+        return _Struct(byte_order + str(count) + format_string[len(byte_order):])
+
+    def numpy_dtype(self):
+        import numpy
+        format_string = self._struct.format
+        byte_order = format_string[:1] if format_string[:1] in BYTE_ORDER_CHARACTERS else '='
+        type_code = NUMPY_TYPE_CODES.get(format_string.lstrip(BYTE_ORDER_CHARACTERS))
+        if type_code is None:
+            return None
+        return numpy.dtype(('>' if byte_order == '!' else byte_order) + type_code)
+
     def sizeof(self):
         return self._struct.size
 
@@ -33,12 +111,24 @@ class FixedPointConverter:
         self.integer_type = integer_type
         self.scale = scale
 
+    def struct_format(self):
+        return self.integer_type.struct_format()
+
+    def encode(self, values, value):
+        self.integer_type.encode(values, round(value/self.scale))
+
+    def decode(self, values):
+        return self.integer_type.decode(values)*self.scale
+
     def pack(self, stream, value):
         self.integer_type.pack(stream, round(value/self.scale))
 
     def unpack(self, stream):
         return self.integer_type.unpack(stream)*self.scale
 
+    def numpy_dtype(self):
+        return self.integer_type.numpy_dtype()
+
     def sizeof(self):
         return self.integer_type.sizeof()
 
@@ -52,11 +142,22 @@ class EnumConverter:
         self.enumeration = enumeration
         self.default = default
 
+    def struct_format(self):
+        return self.integer_type.struct_format()
+
+    def encode(self, values, member):
+        self.integer_type.encode(values, member.value)
+
+    def decode(self, values):
+        return self.convert(self.integer_type.decode(values))
+
     def pack(self, stream, member):
         self.integer_type.pack(stream, member.value)
 
     def unpack(self, stream):
-        integer_value = self.integer_type.unpack(stream)
+        return self.convert(self.integer_type.unpack(stream))
+
+    def convert(self, integer_value):
         try:
             value = self.enumeration(integer_value)
         except ValueError:
@@ -66,6 +167,9 @@ class EnumConverter:
             value = self.default
         return value
 
+    def numpy_dtype(self):
+        return self.integer_type.numpy_dtype()
+
     def sizeof(self):
         return self.integer_type.sizeof()
 
@@ -75,6 +179,16 @@ class NoneableConverter:
     def __init__(self, base_type, none_value):
         self.base_type = base_type
         self.none_value = none_value
+
+    def struct_format(self):
+        return self.base_type.struct_format()
+
+    def encode(self, values, value):
+        self.base_type.encode(values, value if value is not None else self.none_value)
+
+    def decode(self, values):
+        value = self.base_type.decode(values)
+        return value if value != self.none_value else None
         
     def pack(self, stream, value):
         self.base_type.pack(stream, value if value is not None else self.none_value)
@@ -83,6 +197,9 @@ class NoneableConverter:
         value = self.base_type.unpack(stream)
         return value if value != self.none_value else None
         
+    def numpy_dtype(self):
+        return self.base_type.numpy_dtype()
+
     def sizeof(self):
         return self.base_type.sizeof()
         
@@ -92,6 +209,17 @@ class ByteString:
     def __init__(self, length):
         self.length = length
 
+    def struct_format(self):
+        return f'{self.length}s'
+
+    def encode(self, values, string):
+        if len(string) != self.length:
+            raise ValueError('Invalid string length')
+        values.append(string)
+
+    def decode(self, values):
+        return next(values)
+
     def pack(self, stream, string):
         if len(string) != self.length:
             raise ValueError('Invalid string length')
@@ -100,6 +228,10 @@ class ByteString:
     def unpack(self, stream):
         return stream.read(self.length)
 
+    def numpy_dtype(self):
+        import numpy
+        return numpy.dtype(f'S{self.length}')
+
     def sizeof(self):
         return self.length
 
@@ -110,6 +242,18 @@ class Array:
         self.element_type = element_type
         self.length = length
 
+    def struct_format(self):
+        return combine_formats([self.element_type.struct_format()]*self.length)
+
+    def encode(self, values, array):
+        if len(array) != self.length:
+            raise ValueError(f'expected array of length {self.length}, got array of length {len(array)}')
+        for value in array:
+            self.element_type.encode(values, value)
+
+    def decode(self, values):
+        return [self.element_type.decode(values) for _ in range(self.length)]
+
     def pack(self, stream, array):
         if len(array) != self.length:
             raise ValueError(f'expected array of length {self.length}, got array of length {len(array)}')
@@ -119,6 +263,13 @@ class Array:
     def unpack(self, stream):
         return [self.element_type.unpack(stream) for _ in range(self.length)]
 
+    def numpy_dtype(self):
+        import numpy
+        element_dtype = self.element_type.numpy_dtype()
+        if element_dtype is None:
+            return None
+        return numpy.dtype((element_dtype, (self.length,)))
+
     def sizeof(self):
         return self.length*self.element_type.sizeof()
 
@@ -128,12 +279,22 @@ class CString:
     def __init__(self, encoding):
         self.encoding = encoding
 
+    def struct_format(self):
+        return None
+
     def pack(self, stream, string):
         stream.write((string + '\0').encode(self.encoding))
 
     def unpack(self, stream):
         #XXX: This might not work for all encodings
         null = '\0'.encode(self.encoding)
+        if isinstance(stream, BufferStream) and len(null) == 1:
+            end = stream.buffer.find(null, stream.position)
+            if end == -1:
+                raise ValueError('unterminated string')
+            string = stream.read(end - stream.position)
+            stream.skip(1)
+            return string.decode(self.encoding)
         string = b''
         while True:
             c = stream.read(len(null))
@@ -141,6 +302,9 @@ class CString:
             string += c
         return string.decode(self.encoding)
 
+    def numpy_dtype(self):
+        return None
+
     def sizeof(self):
         return None
 
@@ -150,6 +314,9 @@ class PString:
     def __init__(self, encoding):
         self.encoding = encoding
 
+    def struct_format(self):
+        return None
+
     def pack(self, stream, string):
         string = string.encode(self.encoding)
         stream.write(bytes(chr(len(string))))
@@ -159,6 +326,9 @@ class PString:
         length = ord(stream.read(1))
         return stream.read(length).decode(self.encoding)
 
+    def numpy_dtype(self):
+        return None
+
     def sizeof(self):
         return None
 
@@ -184,6 +354,14 @@ class TerminatedList:
             elements.append(element)
         return elements
 
+    @staticmethod
+    def struct_format():
+        return None
+
+    @staticmethod
+    def numpy_dtype():
+        return None
+
     @staticmethod
     def sizeof():
         return None
@@ -195,12 +373,24 @@ class Field:
         self.name = name
         self.field_type = field_type
 
+    def struct_format(self):
+        return self.field_type.struct_format()
+
+    def encode(self, values, struct):
+        self.field_type.encode(values, getattr(struct, self.name))
+
+    def decode(self, values, struct):
+        setattr(struct, self.name, self.field_type.decode(values))
+
     def pack(self, stream, struct):
         self.field_type.pack(stream, getattr(struct, self.name))
 
     def unpack(self, stream, struct):
         setattr(struct, self.name, self.field_type.unpack(stream))
 
+    def numpy_dtype(self):
+        return self.field_type.numpy_dtype()
+
     def sizeof(self):
         return self.field_type.sizeof()
 
@@ -214,12 +404,25 @@ class Padding:
         self.length = length
         self.padding = padding
 
+    def struct_format(self):
+        return f'{self.length}s'
+
+    def encode(self, values, struct):
+        values.append(self.padding*self.length)
+
+    def decode(self, values, struct):
+        next(values)
+
     def pack(self, stream, struct):
         stream.write(self.padding*self.length)
 
     def unpack(self, stream, struct):
         stream.read(self.length)
 
+    def numpy_dtype(self):
+        import numpy
+        return numpy.dtype(f'V{self.length}')
+
     def sizeof(self):
         return self.length
 
@@ -252,6 +455,8 @@ class StructMetaClass(type):
         struct_class = super().__new__(metacls, cls, bases, classdict)
 
         if not classdict.struct_fields:
+            if not hasattr(struct_class, '_struct'):
+                struct_class._struct = None
             return struct_class
 
         if not hasattr(struct_class, 'struct_fields'):
@@ -267,6 +472,7 @@ class StructMetaClass(type):
 
         struct_class.struct_fields = struct_fields
         struct_class.struct_size = metacls.calculate_struct_size(struct_fields)
+        struct_class._struct = metacls.compile_struct(struct_fields, struct_class.struct_size)
         struct_class.__eq__ = __eq__
         return struct_class
 
@@ -279,6 +485,24 @@ class StructMetaClass(type):
             return None
         return sum(field.sizeof() for field in struct_fields)
 
+    @staticmethod
+    def compile_struct(struct_fields, struct_size):
+        """Compile the fields of a fixed size struct into a single struct
+        module codec.
+
+        :return: The compiled codec, or None if the fields cannot be expressed
+            as a single struct module format string.
+        """
+        if struct_size is None:
+            return None
+        format_string = combine_formats(field.struct_format() for field in struct_fields)
+        if format_string is None:
+            return None
+        compiled_struct = _Struct(format_string)
+        if compiled_struct.size != struct_size:
+            return None
+        return compiled_struct
+
     @staticmethod
     def replace_fields(fields, replacement_fields):
         for replacement_field in replacement_fields:
@@ -291,18 +515,141 @@ class Struct(metaclass=StructMetaClass):
 
     __slots__ = tuple()
 
+    @classmethod
+    def struct_format(cls):
+        # When embedded in another struct, the embedded struct is decoded
+        # without calling its pack and unpack methods, so structs that
+        # override those cannot be compiled into the outer struct
+        if cls._struct is None or cls.overrides('pack', 'unpack'):
+            return None
+        return cls._struct.format
+
+    @classmethod
+    def overrides(cls, *method_names):
+        for base in cls.__mro__:
+            if base is Struct:
+                return False
+            if any(name in base.__dict__ for name in method_names):
+                return True
+        return False
+
+    @classmethod
+    def encode(cls, values, struct):
+        for field in cls.struct_fields:
+            field.encode(values, struct)
+
+    @classmethod
+    def decode(cls, values):
+        struct = cls.__new__(cls)
+        for field in cls.struct_fields:
+            field.decode(values, struct)
+        return struct
+
     @classmethod
     def pack(cls, stream, struct):
+        if cls._struct is not None and isinstance(stream, BufferStream):
+            cls.pack_into(stream.buffer, stream.allocate(cls._struct.size), struct)
+            return
+        if cls._struct is not None:
+            values = []
+            cls.encode(values, struct)
+            stream.write(cls._struct.pack(*values))
+            return
         for field in cls.struct_fields:
             field.pack(stream, struct)
 
+    @classmethod
+    def pack_into(cls, buffer, offset, struct):
+        values = []
+        cls.encode(values, struct)
+        cls._struct.pack_into(buffer, offset, *values)
+
     @classmethod
     def unpack(cls, stream):
+        if cls._struct is not None and isinstance(stream, BufferStream):
+            return cls.unpack_from(stream.buffer, stream.skip(cls._struct.size))
+        if cls._struct is not None:
+            return cls.decode(iter(cls._struct.unpack(stream.read(cls._struct.size))))
         struct = cls.__new__(cls)
         for field in cls.struct_fields:
             field.unpack(stream, struct)
         return struct
 
+    @classmethod
+    def unpack_from(cls, buffer, offset=0):
+        return cls.decode(iter(cls._struct.unpack_from(buffer, offset)))
+
+    @classmethod
+    def numpy_dtype(cls):
+        """Structured NumPy dtype with the same memory layout as the struct.
+
+        Values are stored as they appear in the binary data, i.e. without
+        applying converters. Padding is stored in void fields.
+        """
+        import numpy
+        if cls._struct is None:
+            return None
+        fields = []
+        for i, field in enumerate(cls.struct_fields):
+            field_dtype = field.numpy_dtype()
+            if field_dtype is None:
+                return None
+            name = field.name if isinstance(field, Field) else f'__padding{i}__'
+            fields.append((name, field_dtype))
+        dtype = numpy.dtype(fields)
+        if dtype.itemsize != cls._struct.size:
+            return None
+        return dtype
+
+    @classmethod
+    def view_array(cls, buffer, offset=0, count=-1):
+        """Zero copy structured array view of a table of structs in a buffer."""
+        import numpy
+        dtype = cls.numpy_dtype()
+        if dtype is None:
+            raise TypeError(f'{cls.__name__} has no NumPy dtype')
+        return numpy.frombuffer(buffer, dtype, count, offset)
+
+    @classmethod
+    def pack_array(cls, stream, structs):
+        if cls._struct is None or (isinstance(stream, BufferStream) and cls.overrides('pack')):
+            for struct in structs:
+                cls.pack(stream, struct)
+            return
+        if cls.overrides('pack'):
+            buffer = io.BytesIO()
+            for struct in structs:
+                cls.pack(buffer, struct)
+            stream.write(buffer.getvalue())
+            return
+        structs = list(structs)
+        size = cls._struct.size
+        if isinstance(stream, BufferStream):
+            offset = stream.allocate(size*len(structs))
+            for i, struct in enumerate(structs):
+                cls.pack_into(stream.buffer, offset + size*i, struct)
+            return
+        buffer = bytearray(size*len(structs))
+        for i, struct in enumerate(structs):
+            cls.pack_into(buffer, size*i, struct)
+        stream.write(buffer)
+
+    @classmethod
+    def unpack_array(cls, stream, count):
+        if cls._struct is None:
+            return [cls.unpack(stream) for _ in range(count)]
+        if isinstance(stream, BufferStream):
+            if cls.overrides('unpack'):
+                return [cls.unpack(stream) for _ in range(count)]
+            size = cls._struct.size
+            offset = stream.skip(size*count)
+            return [cls.unpack_from(stream.buffer, offset + size*i) for i in range(count)]
+        data = stream.read(cls._struct.size*count)
+        if cls.overrides('unpack'):
+            buffer = io.BytesIO(data)
+            return [cls.unpack(buffer) for _ in range(count)]
+        return [cls.decode(iter(values)) for values in cls._struct.iter_unpack(data)]
+
     @classmethod
     def sizeof(cls):
         return cls.struct_size
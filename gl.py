@@ -110,19 +110,66 @@ class Framebuffer(Resource):
         glDeleteFramebuffers(1, self)
 
 
+def get_row_range(key, row_count):
+    """Return the range of rows along the first axis that are selected by an
+    index key, or None if the range can't be determined cheaply."""
+    if isinstance(key, tuple):
+        if not key or key[0] is Ellipsis:
+            return None
+        key = key[0]
+    if isinstance(key, (int, numpy.integer)):
+        row = key + row_count if key < 0 else key
+        return row, row + 1
+    if isinstance(key, slice):
+        rows = range(*key.indices(row_count))
+        if not rows:
+            return 0, 0
+        return min(rows[0], rows[-1]), max(rows[0], rows[-1]) + 1
+    if isinstance(key, list):
+        key = numpy.asarray(key, numpy.intp if not key else None)
+    if isinstance(key, numpy.ndarray) and key.dtype.kind in 'iu':
+        if key.size == 0:
+            return 0, 0
+        rows = numpy.where(key < 0, key + row_count, key)
+        return int(rows.min()), int(rows.max()) + 1
+    return None
+
+
 class ChangeRegisteringArray(numpy.ndarray):
     #XXX Should only be changed using __setitem__
 
     def __array_finalize__(self, obj):
         if obj is None:
             self.changed = True
+            self.changed_range = (0, self.nbytes)
 
-    def __setitem__(self, *args):
+    def __setitem__(self, key, value):
         if self.base is None:
-            self.changed = True
+            self.register_change(key)
         else:
-            self.base.changed = True
-        super().__setitem__(*args)
+            self.base.register_change()
+        super().__setitem__(key, value)
+
+    def register_change(self, key=None):
+        """Add the rows selected by key to the changed byte range.
+
+        If key is None, or the selected rows can't be determined, the whole
+        array is considered changed.
+        """
+        row_range = None
+        if key is not None and self.ndim > 0:
+            row_range = get_row_range(key, len(self))
+        if row_range is None:
+            start, stop = 0, self.nbytes
+        else:
+            start, stop = (row*self.strides[0] for row in row_range)
+            if start == stop:
+                return
+        if getattr(self, 'changed', False):
+            start = min(start, self.changed_range[0])
+            stop = max(stop, self.changed_range[1])
+        self.changed = True
+        self.changed_range = (start, stop)
 
 
 class ManagedBuffer:
@@ -148,11 +195,16 @@ class ManagedBuffer:
     def __iter__(self):
         return iter(self.data)
 
+    def upload_changes(self):
+        """Upload the changed byte range of the data to the bound buffer."""
+        start, stop = self.data.changed_range
+        glBufferSubData(self.target, start, stop - start, numpy.frombuffer(self.data, numpy.uint8, stop - start, start))
+        self.data.changed = False
+
     def sync_data(self):
         if self.data.changed:
             glBindBuffer(self.target, self.buffer)
-            glBufferSubData(self.target, 0, self.data.nbytes, self.data.view(numpy.ndarray))
-            self.data.changed = False
+            self.upload_changes()
 
     def bind(self, binding_point=None):
         if binding_point is None:
@@ -161,8 +213,7 @@ class ManagedBuffer:
             glBindBufferBase(self.target, binding_point, self.buffer)
 
         if self.data.changed:
-            glBufferSubData(self.target, 0, self.data.nbytes, self.data.view(numpy.ndarray))
-            self.data.changed = False
+            self.upload_changes()
 
 
 class TextureBuffer(ManagedBuffer):
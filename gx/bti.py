@@ -90,8 +90,7 @@ def pack_textures(stream, textures):
     end = stream.tell()
 
     stream.seek(base)
-    for texture in textures:
-        Texture.pack(stream, texture)
+    Texture.pack_array(stream, textures)
 
     stream.seek(end)
     return
@@ -100,7 +99,7 @@ def pack_textures(stream, textures):
 def unpack_textures(stream, texture_count):
     base = stream.tell()
 
-    textures = [Texture.unpack(stream) for _ in range(texture_count)]
+    textures = Texture.unpack_array(stream, texture_count)
 
     duplicate_table = {}
     for i, texture in enumerate(textures):
@@ -4,6 +4,7 @@
 
 import numpy
 cimport numpy
+from btypes import read_array, write_array
 import gx
 
 
@@ -369,6 +370,16 @@ class ImageBase(numpy.ndarray):
         self.width = width
         self.height = height
 
+    def __reduce__(self):
+        return self.unpickle, (self.view(numpy.ndarray), self.width, self.height)
+
+    @classmethod
+    def unpickle(cls, array, width, height):
+        image = array.view(cls)
+        image.width = width
+        image.height = height
+        return image
+
 
 class ImageI4(ImageBase):
     image_format = gx.TF_I4
@@ -866,7 +877,7 @@ class ImageCI14(ImageBase):
 
 
 def pack_palette(stream, palette):
-    palette.tofile(stream)
+    write_array(stream, palette)
 
 
 def unpack_palette(stream, palette_format, entry_count):
@@ -879,13 +890,13 @@ def unpack_palette(stream, palette_format, entry_count):
     else:
         raise ValueError('invalid palette format')
 
-    palette = numpy.fromfile(stream, palette_type.entry_type, entry_count)
+    palette = read_array(stream, palette_type.entry_type, entry_count)
     return palette.view(palette_type)
 
 
 def pack_images(stream, images):
     for image in images:
-        image.tofile(stream)
+        write_array(stream, image)
 
 
 def unpack_images(stream, image_format, base_width, base_height, level_count):
@@ -922,7 +933,7 @@ def unpack_images(stream, image_format, base_width, base_height, level_count):
 
         col_count = (width + image_type.tile_width - 1)//image_type.tile_width
         row_count = (height + image_type.tile_height - 1)//image_type.tile_height
-        image = numpy.fromfile(stream, image_type.tile_type, col_count*row_count)
+        image = read_array(stream, image_type.tile_type, col_count*row_count)
         image = image.reshape((row_count, col_count) + image.shape[1:])
         image = image.view(image_type)
         image.width = width
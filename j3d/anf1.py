@@ -0,0 +1,209 @@
+import logging
+import numpy
+from btypes.big_endian import *
+from j3d.animation import Animation,IncompatibleAnimationError
+
+
+logger = logging.getLogger(__name__)
+
+
+ANGLE_SCALE = 180/32767
+
+
+class Header(Struct):
+    magic = ByteString(4)
+    section_size = uint32
+    loop_mode = uint8
+    __padding__ = Padding(1)
+    duration = uint16
+    joint_animation_count = uint16
+    scale_count = uint16
+    rotation_count = uint16
+    translation_count = uint16
+    joint_animation_offset = uint32
+    scale_offset = uint32
+    rotation_offset = uint32
+    translation_offset = uint32
+
+    def __init__(self):
+        self.magic = b'ANF1'
+
+
+class Selection(Struct):
+    count = uint16
+    first = uint16
+
+
+class ComponentAnimation(Struct):
+    scale_selection = Selection
+    rotation_selection = Selection
+    translation_selection = Selection
+
+
+class JointAnimation(Struct):
+    x = ComponentAnimation
+    y = ComponentAnimation
+    z = ComponentAnimation
+
+
+class FullSkeletalAnimation(Animation):
+    """Skeletal animation with a value stored for every frame.
+
+    The counts and firsts arrays have a row each for the scale, rotation and
+    translation tables, and a column for each of the x, y and z components of
+    every joint. A component takes the value at index first + frame in the
+    table, or the last of its count values after those run out. Rotations
+    are stored as fixed point values.
+    """
+
+    def __init__(self,duration,loop_mode,counts,firsts,scales,rotations,translations):
+        super().__init__(duration,loop_mode)
+        self.counts = counts
+        self.firsts = firsts
+        self.scales = scales
+        self.rotations = rotations
+        self.translations = translations
+
+    @property
+    def joint_count(self):
+        return self.counts.shape[1]//3
+
+    def attach(self,model):
+        if self.joint_count != len(model.joints):
+            raise IncompatibleAnimationError()
+        self.time = -1
+        self.model = model
+
+    def update_model(self):
+        positions = self.firsts + numpy.minimum(int(self.time),self.counts - 1)
+        scales = self.scales[positions[0]].reshape(-1,3)
+        rotations = ANGLE_SCALE*self.rotations[positions[1]].reshape(-1,3)
+        translations = self.translations[positions[2]].reshape(-1,3)
+        self.model.gl_set_joint_transforms(scales,rotations,translations)
+        self.model.gl_update_matrix_table()
+
+
+def create_table(values,dtype):
+    """Create a value table for (n,frame_count) component values.
+
+    Components with the same values share their entries in the table, and
+    components that are constant only get a single entry. Returns the counts,
+    the firsts and the table.
+    """
+    if values.shape[1] > 0xFFFF:
+        raise ValueError('too many values for a full frame animation')
+    values = values.astype(dtype)
+    unique_values,inverse = numpy.unique(values,axis=0,return_inverse=True)
+    constant = (unique_values == unique_values[:,:1]).all(axis=1)
+    unique_counts = numpy.where(constant,1,values.shape[1])
+    unique_firsts = numpy.cumsum(unique_counts) - unique_counts
+    table = unique_values[numpy.arange(values.shape[1]) < unique_counts[:,numpy.newaxis]]
+    if len(table) > 0xFFFF:
+        raise ValueError('too many values for a full frame animation')
+    inverse = inverse.reshape(-1)
+    return unique_counts[inverse],unique_firsts[inverse],table
+
+
+def bake(animation):
+    """Convert a keyframe skeletal animation into a full frame animation.
+
+    The keyframe animation is evaluated at every frame from 0 to its
+    duration. Scales and translations are stored with single precision, and
+    rotations are wrapped to [-180,180) degrees and rounded to fixed point.
+    """
+    if animation.baked_values is not None:
+        values = animation.baked_values
+    else:
+        values = animation.bake_frames(numpy.empty((animation.duration + 1,len(animation.tracks))))
+
+    scales,rotations,translations = numpy.asarray(values).T.reshape(3,-1,len(values))
+    rotations = numpy.round(((rotations + 180) % 360 - 180)/ANGLE_SCALE)
+
+    scale_counts,scale_firsts,scales = create_table(scales,float32.numpy_dtype())
+    rotation_counts,rotation_firsts,rotations = create_table(rotations,sint16.numpy_dtype())
+    translation_counts,translation_firsts,translations = create_table(translations,float32.numpy_dtype())
+
+    counts = numpy.stack((scale_counts,rotation_counts,translation_counts))
+    firsts = numpy.stack((scale_firsts,rotation_firsts,translation_firsts))
+    return FullSkeletalAnimation(animation.duration,animation.loop_mode,counts,firsts,scales,rotations,translations)
+
+
+def pack(stream,animation):
+    base = stream.tell()
+    header = Header()
+    header.loop_mode = animation.loop_mode
+    header.duration = animation.duration
+    header.joint_animation_count = animation.joint_count
+    header.scale_count = len(animation.scales)
+    header.rotation_count = len(animation.rotations)
+    header.translation_count = len(animation.translations)
+    stream.write(b'\x00'*Header.sizeof())
+
+    # Selections are stored by joint, then component, then table
+    selections = numpy.empty(animation.counts.shape,Selection.numpy_dtype())
+    selections['count'] = animation.counts
+    selections['first'] = animation.firsts
+
+    align(stream, 0x20)
+    header.joint_animation_offset = stream.tell() - base
+    write_array(stream, selections.reshape(3,-1,3).transpose(1,2,0))
+
+    align(stream, 0x20)
+    header.scale_offset = stream.tell() - base
+    write_array(stream, animation.scales.astype(float32.numpy_dtype()))
+
+    align(stream, 0x20)
+    header.rotation_offset = stream.tell() - base
+    write_array(stream, animation.rotations.astype(sint16.numpy_dtype()))
+
+    align(stream, 0x20)
+    header.translation_offset = stream.tell() - base
+    write_array(stream, animation.translations.astype(float32.numpy_dtype()))
+
+    align(stream, 0x20)
+    header.section_size = stream.tell() - base
+    stream.seek(base)
+    Header.pack(stream, header)
+    stream.seek(base + header.section_size)
+
+
+def unpack(stream):
+    base = stream.tell()
+    header = Header.unpack(stream)
+    if header.magic != b'ANF1':
+        raise FormatError('invalid magic')
+
+    stream.seek(base + header.joint_animation_offset)
+    joint_animations = read_array(stream, JointAnimation.numpy_dtype(), header.joint_animation_count)
+
+    stream.seek(base + header.scale_offset)
+    scales = read_array(stream, float32.numpy_dtype(), header.scale_count)
+
+    stream.seek(base + header.rotation_offset)
+    rotations = read_array(stream, sint16.numpy_dtype(), header.rotation_count)
+
+    stream.seek(base + header.translation_offset)
+    translations = read_array(stream, float32.numpy_dtype(), header.translation_count)
+
+    # Reorder the selections from by joint, then component, then table to by
+    # table, then joint, then component
+    selections = joint_animations.view(Selection.numpy_dtype()).reshape(-1,3,3).transpose(2,0,1).reshape(3,-1)
+    counts = selections['count'].astype(numpy.intp)
+    firsts = selections['first'].astype(numpy.intp)
+    tables = [scales,rotations,translations]
+    for i,default_value in enumerate((1,0,0)):
+        empty = counts[i] == 0
+        if not empty.any():
+            continue
+        # Empty selections take the default value of the component
+        logger.warning('empty selection')
+        counts[i,empty] = 1
+        firsts[i,empty] = len(tables[i])
+        tables[i] = numpy.append(tables[i],numpy.array(default_value,tables[i].dtype))
+    for table_counts,table_firsts,table in zip(counts,firsts,tables):
+        if (table_firsts + table_counts > len(table)).any():
+            raise FormatError('selection out of range')
+    scales,rotations,translations = tables
+
+    stream.seek(base + header.section_size)
+    return FullSkeletalAnimation(header.duration,header.loop_mode,counts,firsts,scales,rotations,translations)
@@ -1,4 +1,8 @@
+import os
+import hashlib
+import numpy
 from btypes.big_endian import *
+from btypes import BufferStream
 
 import logging
 logger = logging.getLogger(__name__)
@@ -15,42 +19,186 @@ class Header(Struct):
     __padding__ = Padding(12)
 
 
-class KeyFrame:
-
-    def __init__(self,time,value,tangent_in,tangent_out=None):
-        self.time = time
-        self.value = value
-        self.tangent_in = tangent_in
-        self.tangent_out = tangent_out if tangent_out is not None else tangent_in
-
-
-class ConstantInterpolater:
-
-    def __init__(self,value):
-        self.value = value
-
-    def interpolate(self,time):
-        return self.value
-
-    
-class CubicSplineInterpolater:
-
-    def __init__(self,keys):
-        self.keys = keys
-
-    def interpolate(self,time):
-        if self.keys[-1].time < time:
-            return self.keys[-1].value
-
-        i = 1
-        while self.keys[i].time < time: i += 1
-
-        t = (time - self.keys[i - 1].time)/(self.keys[i].time - self.keys[i - 1].time)
-        a = 2*(self.keys[i - 1].value - self.keys[i].value) + self.keys[i - 1].tangent_out + self.keys[i].tangent_in
-        b = -3*self.keys[i - 1].value + 3*self.keys[i].value - 2*self.keys[i - 1].tangent_out - self.keys[i].tangent_in
-        c = self.keys[i - 1].tangent_out
-        d = self.keys[i - 1].value
-        return ((a*t + b)*t + c)*t + d
+def search_keys(times,key_offsets,time):
+    """Batched version of numpy.searchsorted(track_times,time) for tracks
+    stored back to back in one array.
+
+    Returns for each track the number of its keys with a time less than the
+    given time. If time is an array, the last axis of the result is the track
+    axis. All tracks are searched at once by bisection, so this takes
+    O(log n) vectorized steps for tracks of at most n keys.
+    """
+    time = numpy.asarray(time)[...,numpy.newaxis]
+    starts = key_offsets[:-1]
+    low = numpy.zeros(time.shape[:-1] + starts.shape,numpy.intp)
+    high = numpy.broadcast_to(numpy.diff(key_offsets),low.shape)
+    time = numpy.broadcast_to(time,low.shape)
+    active = low < high
+    while active.any():
+        middle = (low + high)//2
+        less = numpy.zeros(low.shape,bool)
+        less[active] = times[(starts + middle)[active]] < time[active]
+        low = numpy.where(less,middle + 1,low)
+        high = numpy.where(active & ~less,middle,high)
+        active = low < high
+    return low
+
+
+class Tracks:
+    """Keyframe tracks compiled into flat arrays.
+
+    The keys of all tracks that vary over time are stored back to back in
+    arrays of times, values and tangents, the keys of the i:th of those
+    tracks being in key_offsets[i]:key_offsets[i + 1]. Tracks that don't vary
+    over time are folded out, and only their values are stored.
+
+    Keyed tracks are evaluated as cubic Hermite splines, and hold their last
+    value after the last key.
+    """
+
+    def __init__(self,track_count,constant_tracks,constant_values,keyed_tracks,key_offsets,times,values,tangents_in,tangents_out):
+        self.track_count = track_count
+        self.constant_tracks = constant_tracks
+        self.constant_values = constant_values
+        self.keyed_tracks = keyed_tracks
+        self.key_offsets = key_offsets
+        self.times = times
+        self.values = values
+        self.tangents_in = tangents_in
+        self.tangents_out = tangents_out
+
+    def __len__(self):
+        return self.track_count
+
+    @classmethod
+    def from_selections(cls,selections,array,scale=None,default_value=0):
+        """Compile tracks from selections of keys in a value table.
+
+        The selections are given as a structured array with count, first and
+        unknown0 fields. A selection with a count of 1 selects a single value.
+        Otherwise it selects count keys of either 3 values (time, value and
+        tangent) if unknown0 is 0, or 4 values (time, value, incoming and
+        outgoing tangent) if unknown0 is 1. If scale is given, the values and
+        tangents are multiplied by it. A selection with a count of 0 selects
+        nothing, and the track takes default_value.
+        """
+        array = numpy.asarray(array,numpy.float64)
+        counts = selections['count'].astype(numpy.intp)
+        firsts = selections['first'].astype(numpy.intp)
+        kinds = selections['unknown0'].astype(numpy.intp)
+        if (counts == 0).any():
+            logger.warning('empty selection')
+
+        constant_tracks = numpy.flatnonzero(counts <= 1)
+        constant_values = numpy.full(len(constant_tracks),numpy.nan)
+        selected = counts[constant_tracks] == 1
+        constant_values[selected] = array[firsts[constant_tracks[selected]]]
+
+        keyed_tracks = numpy.flatnonzero(counts > 1)
+        kinds = kinds[keyed_tracks]
+        if not numpy.isin(kinds,(0,1)).all():
+            raise ValueError('invalid selection unknown0')
+        counts = counts[keyed_tracks]
+        key_offsets = numpy.zeros(len(keyed_tracks) + 1,numpy.intp)
+        numpy.cumsum(counts,out=key_offsets[1:])
+
+        # Position of each key in the value table
+        strides = numpy.repeat(kinds + 3,counts)
+        key_indices = numpy.arange(key_offsets[-1]) - numpy.repeat(key_offsets[:-1],counts)
+        positions = numpy.repeat(firsts[keyed_tracks],counts) + strides*key_indices
+
+        times = array[positions]
+        values = array[positions + 1]
+        tangents_in = array[positions + 2]
+        tangents_out = array[positions + strides - 1]
+
+        if scale is not None:
+            constant_values = constant_values*scale
+            values = values*scale
+            tangents_in = tangents_in*scale
+            tangents_out = tangents_out*scale
+
+        constant_values[~selected] = default_value
+
+        tracks = cls(len(selections),constant_tracks,constant_values,keyed_tracks,key_offsets,times,values,tangents_in,tangents_out)
+        tracks.fold_constant_tracks()
+        return tracks
+
+    @classmethod
+    def concatenate(cls,tracks_list):
+        """Combine sets of tracks into one, in order, so that they can be
+        evaluated together."""
+        track_offsets = numpy.cumsum([0] + [tracks.track_count for tracks in tracks_list])
+        key_offsets = numpy.cumsum([0] + [tracks.key_offsets[-1] for tracks in tracks_list])
+        return cls(
+            int(track_offsets[-1]),
+            numpy.concatenate([tracks.constant_tracks + offset for tracks,offset in zip(tracks_list,track_offsets)]).astype(numpy.intp),
+            numpy.concatenate([tracks.constant_values for tracks in tracks_list]).astype(numpy.float64),
+            numpy.concatenate([tracks.keyed_tracks + offset for tracks,offset in zip(tracks_list,track_offsets)]).astype(numpy.intp),
+            numpy.concatenate([[0]] + [tracks.key_offsets[1:] + offset for tracks,offset in zip(tracks_list,key_offsets)]).astype(numpy.intp),
+            numpy.concatenate([tracks.times for tracks in tracks_list]).astype(numpy.float64),
+            numpy.concatenate([tracks.values for tracks in tracks_list]).astype(numpy.float64),
+            numpy.concatenate([tracks.tangents_in for tracks in tracks_list]).astype(numpy.float64),
+            numpy.concatenate([tracks.tangents_out for tracks in tracks_list]).astype(numpy.float64)
+        )
+
+    def fold_constant_tracks(self):
+        """Fold out keyed tracks with all values equal and all tangents zero.
+
+        The splines of such tracks evaluate to the value of the first key
+        everywhere.
+        """
+        if len(self.keyed_tracks) == 0:
+            return
+        starts = self.key_offsets[:-1]
+        counts = numpy.diff(self.key_offsets)
+        varying = numpy.logical_or.reduceat(self.values != numpy.repeat(self.values[starts],counts),starts)
+        varying |= numpy.logical_or.reduceat(self.tangents_in != 0,starts)
+        varying |= numpy.logical_or.reduceat(self.tangents_out != 0,starts)
+        if varying.all():
+            return
+
+        constant = ~varying
+        self.constant_tracks = numpy.concatenate((self.constant_tracks,self.keyed_tracks[constant]))
+        self.constant_values = numpy.concatenate((self.constant_values,self.values[starts[constant]]))
+        keys = numpy.repeat(varying,counts)
+        self.keyed_tracks = self.keyed_tracks[varying]
+        self.key_offsets = numpy.zeros(len(self.keyed_tracks) + 1,numpy.intp)
+        numpy.cumsum(counts[varying],out=self.key_offsets[1:])
+        self.times = self.times[keys]
+        self.values = self.values[keys]
+        self.tangents_in = self.tangents_in[keys]
+        self.tangents_out = self.tangents_out[keys]
+
+    def evaluate(self,time):
+        """Evaluate all tracks at a time, and return their values.
+
+        If time is an array, the tracks are evaluated at each of its elements,
+        and the last axis of the result is the track axis.
+        """
+        result = numpy.empty(numpy.shape(time) + (self.track_count,),numpy.float64)
+        result[...,self.constant_tracks] = self.constant_values
+        if len(self.keyed_tracks) == 0:
+            return result
+
+        # Interpolate between the first key at or after the time and the key
+        # before it. Before the first key, the first segment is extrapolated.
+        time = numpy.asarray(time)[...,numpy.newaxis]
+        starts = self.key_offsets[:-1]
+        ends = self.key_offsets[1:]
+        key_indices = numpy.clip(search_keys(self.times,self.key_offsets,time[...,0]),1,ends - starts - 1)
+        i = starts + key_indices
+        t = (time - self.times[i - 1])/(self.times[i] - self.times[i - 1])
+        a = 2*(self.values[i - 1] - self.values[i]) + self.tangents_out[i - 1] + self.tangents_in[i]
+        b = -3*self.values[i - 1] + 3*self.values[i] - 2*self.tangents_out[i - 1] - self.tangents_in[i]
+        c = self.tangents_out[i - 1]
+        d = self.values[i - 1]
+        values = ((a*t + b)*t + c)*t + d
+
+        # Hold the last value after the last key
+        finished = self.times[ends - 1] < time
+        result[...,self.keyed_tracks] = numpy.where(finished,self.values[ends - 1],values)
+        return result
 
 
 class Animation:
@@ -64,39 +212,92 @@ class Animation:
 
     @property
     def is_finished(self):
-        return self.time == self.duration and self.loop_mode == 0
+        return self.time >= self.duration and self.loop_mode == 0
+
+    def seek(self,time):
+        """Update the model to the state at a time, which need not be a whole
+        frame. The animation is evaluated directly at the time, without
+        stepping through the frames before it."""
+        if self.loop_mode == 2 and self.duration > 0:
+            time %= self.duration
+        self.time = time
+        self.update_model()
 
     def advance_frame(self):
-        self.time += 1
-        if self.time == self.duration and self.loop_mode == 2:
-            self.time = 0
-        self.update_model()
+        self.seek(self.time + 1)
 
 
-def select_interpolater(selection,array,scale=None):
-    if selection.count == 1:
-        interpolater = ConstantInterpolater(array[selection.first])
-    elif selection.unknown0 == 0:
-        interpolater =  CubicSplineInterpolater([KeyFrame(*array[selection.first + 3*i:selection.first + 3*i + 3]) for i in range(selection.count)])
-    elif selection.unknown0 == 1:
-        interpolater = CubicSplineInterpolater([KeyFrame(*array[selection.first + 4*i:selection.first + 4*i + 4]) for i in range(selection.count)])
-    else:
-        raise ValueError('invalid selection unknkown0')
+class TrackAnimation(Animation):
+    """Animation driven by keyframe tracks.
 
-    if scale is not None:
-        if isinstance(interpolater,ConstantInterpolater):
-            interpolater.value *= scale
-        else:
-            for key in interpolater.keys:
-                key.value *= scale
-                key.tangent_in *= scale
-                key.tangent_out *= scale
+    The tracks can be baked, that is evaluated once at every whole frame from
+    0 to the duration. Updates at those frames then only index the baked
+    values, while updates at other times still evaluate the tracks.
+    """
 
-    return interpolater
+    BAKE_CHUNK_SIZE = 256
+
+    def __init__(self,duration,loop_mode,tracks):
+        super().__init__(duration,loop_mode)
+        self.tracks = tracks
+        self.baked_values = None
+
+    @property
+    def baked_size(self):
+        """Size in bytes of the baked track values."""
+        return (self.duration + 1)*len(self.tracks)*numpy.dtype(numpy.float64).itemsize
+
+    def bake(self,cache_path=None):
+        """Bake the tracks.
+
+        If cache_path is given, the baked values are stored in a .npy file at
+        that path, which is memory mapped instead of kept in memory. If the
+        file already exists, the values are loaded from it instead of baked.
+        """
+        shape = (self.duration + 1,len(self.tracks))
+
+        if cache_path is None:
+            self.baked_values = self.bake_frames(numpy.empty(shape,numpy.float64))
+            return
+
+        try:
+            baked_values = numpy.load(cache_path,mmap_mode='r')
+        except FileNotFoundError:
+            pass
+        except ValueError:
+            logger.warning('invalid animation cache file: %s',cache_path)
+        else:
+            if baked_values.shape == shape and baked_values.dtype == numpy.float64:
+                self.baked_values = baked_values
+                return
+            logger.warning('invalid animation cache file: %s',cache_path)
+
+        # Bake to a temporary file first, so that a partially written file is
+        # never picked up as a cache file
+        temporary_path = '{}.{}.tmp'.format(cache_path,os.getpid())
+        baked_values = numpy.lib.format.open_memmap(temporary_path,'w+',numpy.float64,shape)
+        self.bake_frames(baked_values)
+        baked_values.flush()
+        del baked_values
+        os.replace(temporary_path,cache_path)
+        self.baked_values = numpy.load(cache_path,mmap_mode='r')
+
+    def bake_frames(self,baked_values):
+        for start in range(0,len(baked_values),self.BAKE_CHUNK_SIZE):
+            stop = min(start + self.BAKE_CHUNK_SIZE,len(baked_values))
+            baked_values[start:stop] = self.tracks.evaluate(numpy.arange(start,stop,dtype=numpy.float64))
+        return baked_values
+
+    def evaluate_tracks(self):
+        """Return the values of the tracks at the current time."""
+        if self.baked_values is not None and self.time == int(self.time) and 0 <= self.time <= self.duration:
+            return self.baked_values[int(self.time)]
+        return self.tracks.evaluate(self.time)
 
 
 import j3d.vaf1
 import j3d.ank1
+import j3d.anf1
 import j3d.pak1
 import j3d.trk1
 import j3d.tpt1
@@ -116,6 +317,8 @@ def unpack(stream):
         animation = j3d.vaf1.unpack(stream)
     elif header.file_type == b'bck1':
         animation = j3d.ank1.unpack(stream)
+    elif header.file_type == b'bca1':
+        animation = j3d.anf1.unpack(stream)
     elif header.file_type == b'bpk1':
         animation = j3d.pak1.unpack(stream)
     elif header.file_type == b'brk1':
@@ -131,3 +334,70 @@ def unpack(stream):
 
     return animation
 
+
+def pack(stream,animation):
+    """Pack an animation.
+
+    Only full frame skeletal animations (BCA) can be packed.
+    """
+    if not isinstance(animation,j3d.anf1.FullSkeletalAnimation):
+        raise ValueError('unsupported animation type')
+
+    base = stream.tell()
+    header = Header()
+    header.magic = b'J3D1'
+    header.file_type = b'bca1'
+    header.section_count = 1
+    header.unknown0 = getattr(animation,'unknown0',b'\xFF\xFF\xFF\xFF')
+    stream.write(b'\x00'*Header.sizeof())
+
+    j3d.anf1.pack(stream,animation)
+
+    header.file_size = stream.tell() - base
+    stream.seek(base)
+    Header.pack(stream,header)
+    stream.seek(base + header.file_size)
+
+
+# Version of the baked values in cache files. Increment whenever the values
+# baked from the same animation file change, so that stale files are not used.
+CACHE_FORMAT_VERSION = 2
+
+
+def get_cache_name(data,animation):
+    """Name of the cache file for an animation unpacked from data."""
+    key = hashlib.sha1()
+    key.update('{}:{}:{}:{}:'.format(
+        CACHE_FORMAT_VERSION,
+        numpy.dtype(numpy.float64).str,
+        animation.duration + 1,
+        len(animation.tracks)
+    ).encode('ascii'))
+    key.update(data)
+    return '{}.npy'.format(key.hexdigest())
+
+
+def load(file_path,memory_budget=0,cache_directory=None):
+    """Load an animation from a file.
+
+    Keyframe animations whose baked values take at most memory_budget bytes
+    are baked in memory. Larger ones are baked to a memory mapped cache file
+    in cache_directory, named by the hash of the animation file and the cache
+    format, if a cache directory is given, and evaluated live otherwise.
+
+    Cache files are never removed, so the cache directory grows with every
+    distinct animation that is loaded. It is safe to empty it at any time
+    when no animations are loaded.
+    """
+    with open(file_path,'rb') as stream:
+        data = stream.read()
+    animation = unpack(BufferStream(data,copy_arrays=False))
+
+    if isinstance(animation,TrackAnimation):
+        if animation.baked_size <= memory_budget:
+            animation.bake()
+        elif cache_directory is not None:
+            os.makedirs(cache_directory,exist_ok=True)
+            animation.bake(os.path.join(cache_directory,get_cache_name(data,animation)))
+
+    return animation
@@ -1,5 +1,6 @@
+import numpy
 from btypes.big_endian import *
-from j3d.animation import Animation,select_interpolater,IncompatibleAnimationError
+from j3d.animation import TrackAnimation,Tracks,IncompatibleAnimationError
 
 
 class Header(Struct):
@@ -36,30 +37,26 @@ class JointAnimation(Struct):
     z = ComponentAnimation
 
 
-class SkeletalAnimation(Animation):
-    
-    def __init__(self,duration,loop_mode,joint_animations):
-        super().__init__(duration,loop_mode)
-        self.joint_animations = joint_animations
+class SkeletalAnimation(TrackAnimation):
+
+    def __init__(self,duration,loop_mode,tracks):
+        # The tracks are the scale, rotation and translation tracks, in that
+        # order, each with x, y and z tracks for every joint
+        super().__init__(duration,loop_mode,tracks)
+
+    @property
+    def joint_count(self):
+        return len(self.tracks)//9
 
     def attach(self,model):
-        if len(self.joint_animations) != len(model.joints):
+        if self.joint_count != len(model.joints):
             raise IncompatibleAnimationError()
         self.time = -1
         self.model = model
 
     def update_model(self):
-        for joint_animation,joint in zip(self.joint_animations,self.model.gl_joints):
-            joint.scale_x = joint_animation.x.scale.interpolate(self.time)
-            joint.rotation_x = joint_animation.x.rotation.interpolate(self.time)
-            joint.translation_x = joint_animation.x.translation.interpolate(self.time)
-            joint.scale_y = joint_animation.y.scale.interpolate(self.time)
-            joint.rotation_y = joint_animation.y.rotation.interpolate(self.time)
-            joint.translation_y = joint_animation.y.translation.interpolate(self.time)
-            joint.scale_z = joint_animation.z.scale.interpolate(self.time)
-            joint.rotation_z = joint_animation.z.rotation.interpolate(self.time)
-            joint.translation_z = joint_animation.z.translation.interpolate(self.time)
-
+        scales,rotations,translations = self.evaluate_tracks().reshape(3,self.joint_count,3)
+        self.model.gl_set_joint_transforms(scales,rotations,translations)
         self.model.gl_update_matrix_table()
 
 
@@ -70,30 +67,28 @@ def unpack(stream):
         raise FormatError('invalid magic')
 
     stream.seek(base + header.joint_animation_offset)
-    joint_animations = [JointAnimation.unpack(stream) for _ in range(header.joint_animation_count)]
+    joint_animations = read_array(stream, JointAnimation.numpy_dtype(), header.joint_animation_count)
 
     stream.seek(base + header.scale_offset)
-    scales = [float32.unpack(stream) for _ in range(header.scale_count)]
+    scales = read_array(stream, float32.numpy_dtype(), header.scale_count)
 
     stream.seek(base + header.rotation_offset)
-    rotations = [sint16.unpack(stream) for _ in range(header.rotation_count)]
+    rotations = read_array(stream, sint16.numpy_dtype(), header.rotation_count)
 
     stream.seek(base + header.translation_offset)
-    translations = [float32.unpack(stream) for _ in range(header.translation_count)]
+    translations = read_array(stream, float32.numpy_dtype(), header.translation_count)
 
     angle_scale = 180/32767*2**header.angle_scale_exponent
 
-    for joint_animation in joint_animations:
-        joint_animation.x.scale = select_interpolater(joint_animation.x.scale_selection,scales)
-        joint_animation.x.rotation = select_interpolater(joint_animation.x.rotation_selection,rotations,angle_scale)
-        joint_animation.x.translation = select_interpolater(joint_animation.x.translation_selection,translations)
-        joint_animation.y.scale = select_interpolater(joint_animation.y.scale_selection,scales)
-        joint_animation.y.rotation = select_interpolater(joint_animation.y.rotation_selection,rotations,angle_scale)
-        joint_animation.y.translation = select_interpolater(joint_animation.y.translation_selection,translations)
-        joint_animation.z.scale = select_interpolater(joint_animation.z.scale_selection,scales)
-        joint_animation.z.rotation = select_interpolater(joint_animation.z.rotation_selection,rotations,angle_scale)
-        joint_animation.z.translation = select_interpolater(joint_animation.z.translation_selection,translations)
+    def get_selections(name):
+        return numpy.stack([joint_animations[axis][name] for axis in ('x','y','z')],axis=1).ravel()
+
+    tracks = Tracks.concatenate((
+        Tracks.from_selections(get_selections('scale_selection'),scales,default_value=1),
+        Tracks.from_selections(get_selections('rotation_selection'),rotations,angle_scale),
+        Tracks.from_selections(get_selections('translation_selection'),translations)
+    ))
 
     stream.seek(base + header.section_size)
-    return SkeletalAnimation(header.duration,header.loop_mode,joint_animations)
+    return SkeletalAnimation(header.duration,header.loop_mode,tracks)
 
@@ -40,13 +40,11 @@ def pack(stream, matrix_definitions):
     stream.write(b'\x00'*Header.sizeof())
 
     header.matrix_type_offset = stream.tell() - base
-    for matrix_definition in matrix_definitions:
-        uint8.pack(stream, matrix_definition.matrix_type.value)
+    uint8.pack_array(stream, (matrix_definition.matrix_type.value for matrix_definition in matrix_definitions))
 
     align(stream, 2)
     header.index_offset = stream.tell() - base
-    for matrix_definition in matrix_definitions:
-        uint16.pack(stream, matrix_definition.index)
+    uint16.pack_array(stream, (matrix_definition.index for matrix_definition in matrix_definitions))
 
     align(stream, 0x20)
     header.section_size = stream.tell() - base
@@ -59,18 +57,16 @@ def unpack(stream):
     base = stream.tell()
     header = Header.unpack(stream)
 
-    matrix_definitions = [
-        MatrixDefinition(None, None)
-        for _ in range(header.matrix_definition_count)
-    ]
-
     stream.seek(base + header.matrix_type_offset)
-    for matrix_definition in matrix_definitions:
-        matrix_definition.matrix_type = MatrixType(uint8.unpack(stream))
+    matrix_types = uint8.unpack_array(stream, header.matrix_definition_count)
 
     stream.seek(base + header.index_offset)
-    for matrix_definition in matrix_definitions:
-        matrix_definition.index = uint16.unpack(stream)
+    indices = uint16.unpack_array(stream, header.matrix_definition_count)
+
+    matrix_definitions = [
+        MatrixDefinition(MatrixType(matrix_type), index)
+        for matrix_type, index in zip(matrix_types, indices)
+    ]
 
     stream.seek(base + header.section_size)
     return matrix_definitions
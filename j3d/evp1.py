@@ -1,3 +1,5 @@
+import collections.abc
+import operator
 import numpy
 from btypes.big_endian import *
 
@@ -30,6 +32,104 @@ class Influence:
         self.weight = weight
 
 
+class InfluenceView:
+    """Read-only view of an influence in influence groups."""
+
+    __slots__ = ('joint_indices', 'weights', 'position')
+
+    def __init__(self, joint_indices, weights, position):
+        self.joint_indices = joint_indices
+        self.weights = weights
+        self.position = position
+
+    @property
+    def index(self):
+        return int(self.joint_indices[self.position])
+
+    @property
+    def weight(self):
+        return float(self.weights[self.position])
+
+
+class InfluenceGroup(collections.abc.Sequence):
+    """Read-only sequence view of the influences of an influence group."""
+
+    def __init__(self, joint_indices, weights, start, end):
+        self.joint_indices = joint_indices
+        self.weights = weights
+        self.start = start
+        self.end = end
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        index = operator.index(index)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('influence index out of range')
+        return InfluenceView(self.joint_indices, self.weights, self.start + index)
+
+
+class InfluenceGroups:
+    """Influence groups stored in compressed sparse row layout.
+
+    The influences of group i have joint indices
+    joint_indices[group_offsets[i]:group_offsets[i + 1]] and the weights in
+    the same range of weights. Indexing or iterating gives each group as a
+    read-only sequence of influences backed by these arrays. Edits have to
+    be made to the arrays directly.
+    """
+
+    def __init__(self, group_offsets, joint_indices, weights):
+        self.group_offsets = group_offsets
+        self.joint_indices = joint_indices
+        self.weights = weights
+
+    @classmethod
+    def from_groups(cls, influence_groups):
+        """Create influence groups from a sequence of lists of influences."""
+        group_offsets = numpy.zeros(len(influence_groups) + 1, numpy.uint32)
+        group_offsets[1:] = numpy.cumsum([len(influence_group) for influence_group in influence_groups])
+        joint_indices = numpy.array([
+            influence.index
+            for influence_group in influence_groups
+            for influence in influence_group
+        ], numpy.uint16)
+        weights = numpy.array([
+            influence.weight
+            for influence_group in influence_groups
+            for influence in influence_group
+        ], numpy.float32)
+        return cls(group_offsets, joint_indices, weights)
+
+    @property
+    def group_sizes(self):
+        return numpy.diff(self.group_offsets)
+
+    def __len__(self):
+        return len(self.group_offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        index = operator.index(index)
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('influence group index out of range')
+        start = int(self.group_offsets[index])
+        end = int(self.group_offsets[index + 1])
+        return InfluenceGroup(self.joint_indices, self.weights, start, end)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
 class SectionData:
 
     def __init__(self, influence_groups, inverse_bind_matrices):
@@ -47,25 +147,26 @@ def pack(stream, influence_groups, inverse_bind_matrices):
     header.inverse_bind_matrix_offset = 0
     stream.write(b'\x00'*Header.sizeof())
 
-    if influence_groups:
+    if not isinstance(influence_groups, InfluenceGroups):
+        influence_groups = InfluenceGroups.from_groups(influence_groups)
+
+    if len(influence_groups) > 0:
+        group_sizes = influence_groups.group_sizes
+        if group_sizes.max() > 0xFF:
+            raise ValueError('too many influences in influence group')
         header.influence_count_offset = stream.tell() - base
-        for influence_group in influence_groups:
-            uint8.pack(stream, len(influence_group))
+        write_array(stream, group_sizes.astype(numpy.uint8))
 
         header.index_offset = stream.tell() - base
-        for influence_group in influence_groups:
-            for influence in influence_group:
-                uint16.pack(stream, influence.index)
+        write_array(stream, influence_groups.joint_indices.astype('>u2', copy=False))
 
         align(stream, 4)
         header.weight_offset = stream.tell() - base
-        for influence_group in influence_groups:
-            for influence in influence_group:
-                float32.pack(stream, influence.weight)
+        write_array(stream, influence_groups.weights.astype('>f4', copy=False))
 
     if inverse_bind_matrices is not None:
         header.inverse_bind_matrix_offset = stream.tell() - base
-        inverse_bind_matrices.tofile(stream)
+        write_array(stream, inverse_bind_matrices)
 
     align(stream, 0x20)
     header.section_size = stream.tell() - base
@@ -78,23 +179,21 @@ def unpack(stream):
     base = stream.tell()
     header = Header.unpack(stream)
 
-    influence_groups = [None]*header.influence_group_count
     inverse_bind_matrices = None
 
     stream.seek(base + header.influence_count_offset)
-    for i in range(header.influence_group_count):
-        influence_count = uint8.unpack(stream)
-        influence_groups[i] = [Influence(None, None) for _ in range(influence_count)]
+    influence_counts = read_array(stream, numpy.uint8, header.influence_group_count)
+    group_offsets = numpy.zeros(header.influence_group_count + 1, numpy.uint32)
+    numpy.cumsum(influence_counts, out=group_offsets[1:])
+    influence_count = int(group_offsets[-1])
 
     stream.seek(base + header.index_offset)
-    for influence_group in influence_groups:
-        for influence in influence_group:
-            influence.index = uint16.unpack(stream)
+    joint_indices = read_array(stream, numpy.dtype('>u2'), influence_count)
 
     stream.seek(base + header.weight_offset)
-    for influence_group in influence_groups:
-        for influence in influence_group:
-            influence.weight = float32.unpack(stream)
+    weights = read_array(stream, numpy.dtype('>f4'), influence_count)
+
+    influence_groups = InfluenceGroups(group_offsets, joint_indices, weights)
 
     if header.inverse_bind_matrix_offset != 0:
         stream.seek(base + header.inverse_bind_matrix_offset)
@@ -104,7 +203,7 @@ def unpack(stream):
         # JNT1 section. We just assume that the inverse bind matrices continues
         # to the end of the section.
         element_count = (header.section_size - header.inverse_bind_matrix_offset)//element_type.itemsize
-        inverse_bind_matrices = numpy.fromfile(stream, element_type, element_count)
+        inverse_bind_matrices = read_array(stream, element_type, element_count)
 
     stream.seek(base + header.section_size)
     return SectionData(
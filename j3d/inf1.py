@@ -1,4 +1,6 @@
 from enum import Enum
+from operator import attrgetter
+import numpy
 from btypes.big_endian import *
 import logging
 
@@ -36,6 +38,9 @@ class NodeType(Enum):
     SHAPE = 0x12
 
 
+NODE_TYPE_VALUES = [NodeType.JOINT.value, NodeType.MATERIAL.value, NodeType.SHAPE.value]
+
+
 class Node(Struct):
     node_type = EnumConverter(uint16, NodeType)
     index = uint16
@@ -67,25 +72,158 @@ class SectionData:
         self.vertex_position_count = vertex_position_count
 
 
-def pack_nodes(stream, nodes):
-    for node in nodes:
-        Node.pack(stream, node)
-        if node.children:
-            Node.pack(stream, Node(NodeType.BEGIN_CHILDREN, 0))
-            pack_nodes(stream, node.children)
-            Node.pack(stream, Node(NodeType.END_CHILDREN, 0))
+class NodeArrays:
+    """Flattened scene graph.
+
+    The nodes are stored in pre-order as arrays of node types, indices, parent
+    positions and depths. Root nodes have parent -1. If the arrays were created
+    from node objects, the objects are available in the same order as nodes.
+    """
+
+    def __init__(self, node_types, indices, parents, depths, nodes=None):
+        self.node_types = node_types
+        self.indices = indices
+        self.parents = parents
+        self.depths = depths
+        self.nodes = nodes
+        self._levels = None
+
+    def __len__(self):
+        return len(self.node_types)
+
+    @classmethod
+    def from_nodes(cls, nodes, get_index=attrgetter('index')):
+        flat_nodes = []
+        parents = []
+        depths = []
+        stack = [(node, -1, 0) for node in reversed(nodes)]
+        while stack:
+            node, parent, depth = stack.pop()
+            position = len(flat_nodes)
+            flat_nodes.append(node)
+            parents.append(parent)
+            depths.append(depth)
+            stack.extend((child, position, depth + 1) for child in reversed(node.children))
+        return cls(
+            numpy.array([node.node_type.value for node in flat_nodes], numpy.uint16),
+            numpy.array([get_index(node) for node in flat_nodes], numpy.intp),
+            numpy.array(parents, numpy.intp),
+            numpy.array(depths, numpy.intp),
+            flat_nodes
+        )
+
+    @classmethod
+    def from_records(cls, records):
+        """Create the arrays from an (n,2) array of INF1 records.
+
+        Records after the first END_GRAPH record are ignored.
+        """
+        record_types = records[:,0]
+        end = numpy.flatnonzero(record_types == NodeType.END_GRAPH.value)
+        if len(end) == 0:
+            raise FormatError('unexpected end of scene graph')
+        record_types = record_types[:end[0]].astype(numpy.intp)
+        record_indices = records[:end[0],1]
+
+        begin_children = record_types == NodeType.BEGIN_CHILDREN.value
+        end_children = record_types == NodeType.END_CHILDREN.value
+        record_depths = numpy.cumsum(begin_children.astype(numpy.intp) - end_children)
+        if len(record_depths) and (record_depths.min() < 0 or record_depths[-1] != 0):
+            raise FormatError('unbalanced children in scene graph')
+        is_node = ~(begin_children | end_children)
+        begin_positions = numpy.flatnonzero(begin_children)
+        if len(begin_positions) and (begin_positions[0] == 0 or not is_node[begin_positions - 1].all()):
+            raise FormatError('children without a parent node in scene graph')
+
+        node_types = record_types[is_node].astype(numpy.uint16)
+        if not numpy.isin(node_types, NODE_TYPE_VALUES).all():
+            raise FormatError('invalid node type in scene graph')
+        depths = record_depths[is_node]
+
+        parents = numpy.full(len(depths), -1, numpy.intp)
+        levels = get_levels(depths)
+        for parent_positions, positions in zip(levels, levels[1:]):
+            parents[positions] = parent_positions[numpy.searchsorted(parent_positions, positions) - 1]
+
+        return cls(node_types, record_indices[is_node].astype(numpy.intp), parents, depths)
+
+    def pack_records(self):
+        """Return the scene graph as an (n,2) array of INF1 records."""
+        next_depths = numpy.append(self.depths[1:], 0)
+        has_children = next_depths > self.depths
+        end_counts = numpy.maximum(self.depths - next_depths, 0)
+        record_counts = 1 + has_children + end_counts
+        offsets = numpy.cumsum(record_counts) - record_counts
+
+        records = numpy.zeros((record_counts.sum() + 1, 2), numpy.dtype('>u2'))
+        records[:,0] = NodeType.END_CHILDREN.value
+        records[offsets,0] = self.node_types
+        records[offsets,1] = self.indices
+        records[offsets[has_children] + 1,0] = NodeType.BEGIN_CHILDREN.value
+        records[-1,0] = NodeType.END_GRAPH.value
+        return records
+
+    def create_nodes(self):
+        """Create a tree of node objects, and return the root nodes."""
+        node_types = {value : NodeType(value) for value in numpy.unique(self.node_types).tolist()}
+        nodes = [
+            Node(node_types[node_type], index)
+            for node_type, index in zip(self.node_types.tolist(), self.indices.tolist())
+        ]
+        roots = []
+        for node, parent in zip(nodes, self.parents.tolist()):
+            if parent == -1:
+                roots.append(node)
+            else:
+                nodes[parent].children.append(node)
+        return roots
+
+    @property
+    def levels(self):
+        """List of the positions of the nodes at each depth."""
+        if self._levels is None:
+            self._levels = get_levels(self.depths)
+        return self._levels
+
+    def find(self, node_type, index=None):
+        """Return the positions of the nodes of the given type and index."""
+        selection = self.node_types == node_type.value
+        if index is not None:
+            selection &= self.indices == index
+        return numpy.flatnonzero(selection)
+
+    def get_nearest_ancestors(self, node_type):
+        """Return for each node the position of its nearest ancestor of the
+        given type, or -1 if it has none."""
+        ancestors = numpy.full(len(self), -1, numpy.intp)
+        for positions in self.levels[1:]:
+            parents = self.parents[positions]
+            is_ancestor = self.node_types[parents] == node_type.value
+            ancestors[positions] = numpy.where(is_ancestor, parents, ancestors[parents])
+        return ancestors
+
+    def count_ancestors(self, node_type):
+        """Return for each node the number of its ancestors of the given
+        type."""
+        counts = numpy.zeros(len(self), numpy.intp)
+        for positions in self.levels[1:]:
+            parents = self.parents[positions]
+            counts[positions] = counts[parents] + (self.node_types[parents] == node_type.value)
+        return counts
+
+    def get_subtree_ends(self):
+        """Return for each node the position after the last node of its
+        subtree."""
+        sizes = numpy.ones(len(self), numpy.intp)
+        for positions in reversed(self.levels[1:]):
+            numpy.add.at(sizes, self.parents[positions], sizes[positions])
+        return numpy.arange(len(self)) + sizes
 
 
-def unpack_nodes(stream, end_node_type=NodeType.END_CHILDREN):
-    nodes = []
-    while True:
-        node = Node.unpack(stream)
-        if node.node_type == end_node_type:
-            return nodes
-        elif node.node_type == NodeType.BEGIN_CHILDREN:
-            nodes[-1].children = unpack_nodes(stream)
-        else:
-            nodes.append(node)
+def get_levels(depths):
+    order = numpy.argsort(depths, kind='stable')
+    counts = numpy.bincount(depths) if len(depths) else numpy.zeros(0, numpy.intp)
+    return numpy.split(order, numpy.cumsum(counts)[:-1])
 
 
 def pack(stream, scene_graph, shape_batch_count, vertex_position_count):
@@ -97,8 +235,8 @@ def pack(stream, scene_graph, shape_batch_count, vertex_position_count):
     stream.write(b'\x00'*Header.sizeof())
 
     header.scene_graph_offset = stream.tell() - base
-    pack_nodes(stream, scene_graph.children)
-    Node.pack(stream, Node(NodeType.END_GRAPH, 0))
+    node_arrays = NodeArrays.from_nodes(scene_graph.children)
+    write_array(stream, node_arrays.pack_records())
 
     align(stream, 0x20)
     header.section_size = stream.tell() - base
@@ -111,10 +249,14 @@ def unpack(stream):
     base = stream.tell()
     header = Header.unpack(stream)
 
+    # The node count is not stored in the header, so read everything up to
+    # the end of the section and decode nodes until the end of the graph
     stream.seek(base + header.scene_graph_offset)
+    record_count = (header.section_size - header.scene_graph_offset)//Node.sizeof()
+    records = read_array(stream, numpy.dtype('>u2'), 2*record_count).reshape(-1, 2)
     scene_graph = SceneGraph()
     scene_graph.unknown0 = header.unknown0
-    scene_graph.children = unpack_nodes(stream, NodeType.END_GRAPH)
+    scene_graph.children = NodeArrays.from_records(records).create_nodes()
 
     stream.seek(base + header.section_size)
     return SectionData(
@@ -35,6 +35,21 @@ def matrix3x4_multiply(a, b):
     return c
 
 
+def matrix3x4_array_multiply(a, b):
+    """Batched version of matrix3x4_multiply.
+
+    numpy.matmul on contiguous stacks goes through the same BLAS routines as
+    numpy.dot, so the results are identical to those of matrix3x4_multiply,
+    which is not the case for numpy.einsum.
+    """
+    a_rotation = numpy.ascontiguousarray(a[:,:,0:3])
+    c = numpy.empty((len(a), 3, 4), numpy.float32)
+    c[:,:,0:3] = numpy.matmul(a_rotation, numpy.ascontiguousarray(b[:,:,0:3]))
+    c[:,:,3:] = numpy.matmul(a_rotation, numpy.ascontiguousarray(b[:,:,3:]))
+    c[:,:,3] += a[:,:,3]
+    return c
+
+
 class Joint(Struct):
     # 0 -> has direct material/shape descendant
     # 2 -> only referenced by other joints
@@ -118,6 +133,33 @@ class Joint(Struct):
         return matrix3x4_multiply(parent_joint_matrix, local_matrix)
 
 
+def create_local_matrices(scales, rotations, translations, inverse_parent_scales):
+    """Vectorized version of the local matrix calculation in
+    Joint.create_matrix.
+
+    All arguments are (n,3) arrays of x, y and z components, with rotations in
+    degrees. The products are evaluated in the same order and precision as in
+    Joint.create_matrix, so that the results are identical.
+    """
+    cx, cy, cz = numpy.cos(numpy.radians(rotations)).T
+    sx, sy, sz = numpy.sin(numpy.radians(rotations)).T
+    scale_x, scale_y, scale_z = numpy.asarray(scales, numpy.float64).T
+    ips_x, ips_y, ips_z = numpy.asarray(inverse_parent_scales, numpy.float64).T
+
+    local_matrices = numpy.empty((len(scales), 3, 4), numpy.float32)
+    local_matrices[:,0,0] = cy*cz*scale_x*ips_x
+    local_matrices[:,1,0] = cy*sz*scale_x*ips_y
+    local_matrices[:,2,0] = -sy*scale_x*ips_z
+    local_matrices[:,0,1] = (sx*sy*cz - cx*sz)*scale_y*ips_x
+    local_matrices[:,1,1] = (sx*sy*sz + cx*cz)*scale_y*ips_y
+    local_matrices[:,2,1] = sx*cy*scale_y*ips_z
+    local_matrices[:,0,2] = (cx*sy*cz + sx*sz)*scale_z*ips_x
+    local_matrices[:,1,2] = (cx*sy*sz - sx*cz)*scale_z*ips_y
+    local_matrices[:,2,2] = cx*cy*scale_z*ips_z
+    local_matrices[:,:,3] = translations
+    return local_matrices
+
+
 def pack(stream, joints):
     base = stream.tell()
     header = Header()
@@ -125,12 +167,10 @@ def pack(stream, joints):
     stream.write(b'\x00'*Header.sizeof())
 
     header.joint_offset = stream.tell() - base
-    for joint in joints:
-        Joint.pack(stream, joint)
+    Joint.pack_array(stream, joints)
 
     header.index_offset = stream.tell() - base
-    for index in range(len(joints)):
-        uint16.pack(stream, index)
+    uint16.pack_array(stream, range(len(joints)))
 
     align(stream, 4)
     header.name_offset = stream.tell() - base
@@ -148,12 +188,11 @@ def unpack(stream):
     header = Header.unpack(stream)
 
     stream.seek(base + header.joint_offset)
-    joints = [Joint.unpack(stream) for _ in range(header.joint_count)]
+    joints = Joint.unpack_array(stream, header.joint_count)
 
     stream.seek(base + header.index_offset)
-    for index in range(header.joint_count):
-        if index != uint16.unpack(stream):
-            raise FormatError('invalid index')
+    if uint16.unpack_array(stream, header.joint_count) != list(range(header.joint_count)):
+        raise FormatError('invalid index')
 
     stream.seek(base + header.name_offset)
     names = j3d.string_table.unpack(stream)
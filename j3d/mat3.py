@@ -1,3 +1,4 @@
+import bisect
 import logging
 from math import cos, sin, radians
 import numpy
@@ -547,6 +548,9 @@ class Material:
         self.unknown4 = [0xFFFF]*12
         self.unknown5 = UnknownStruct5()
 
+        # Cached MDL3 packet, see j3d.mdl3.PackedPacket
+        self.mdl3_packet = None
+
     @property
     def enabled_channels(self):
         for i in range(self.channel_count):
@@ -669,43 +673,79 @@ class IndirectEntry(Struct):
 
 
 class Indexer:
+    """Assigns indices to distinct values in order of first appearance.
 
-    def __init__(self):
+    Values are identified by the bytes they are packed to with the given
+    element types, so two values share an index exactly when they would be
+    written to the same table entry. The keys are bytes objects, which
+    cache their hash, and lookups are dictionary lookups.
+    """
+
+    def __init__(self, *element_types):
+        self.element_types = element_types
+        self.indices = {}
         self.keys = []
 
-    def __getitem__(self, key):
-        for i, k in enumerate(self.keys):
-            if self.equal_predicate(key, k):
-                return i
-        self.keys.append(key)
-        return len(self.keys) - 1
+    def key(self, value):
+        stream = BufferStream(bytearray())
+        for element_type in self.element_types:
+            element_type.pack(stream, value)
+        return bytes(stream.buffer)
+
+    def __getitem__(self, value):
+        key = self.key(value)
+        index = self.indices.get(key)
+        if index is None:
+            index = self.indices[key] = len(self.keys)
+            self.keys.append(value)
+        return index
 
     def __iter__(self):
         yield from self.keys
 
-    def update(self, keys):
-        for key in keys:
-            self[key]
+    def __len__(self):
+        return len(self.keys)
+
+    def update(self, values):
+        for value in values:
+            self[value]
 
-    @staticmethod
-    def equal_predicate(a, b):
-        return a == b
 
+class Table:
+    """Table of values in a MAT3 section.
 
-class ArrayUnpacker:
+    Each value is decoded the first time it is referenced, and the decoded
+    value is shared by every material that references it. If copy is true,
+    every reference after the first instead gets its own copy, decoded
+    directly from the table data. This is needed for structs that are
+    edited in place, so that editing one material does not change another.
 
-    def __init__(self, stream, offset, element_type):
-        self.stream = stream
-        self.offset = offset
+    The copies are decoded with unpack_from, which skips the unpack method of
+    the element type. The unpack methods of the table structs only check the
+    values and log warnings, and these checks have already been made when the
+    first reference to the same data was decoded, so the warnings are only
+    logged once per table entry.
+    """
+
+    def __init__(self, data, element_type, copy=False):
+        self.data = data
         self.element_type = element_type
+        self.copy = copy
+        self.values = {}
 
     def __getitem__(self, index):
-        self.stream.seek(self.offset + index*self.element_type.sizeof())
-        return self.element_type.unpack(self.stream)
+        offset = index*self.element_type.sizeof()
+        if offset + self.element_type.sizeof() > len(self.data):
+            raise FormatError(f'index out of range: {index}')
+        if index not in self.values:
+            self.values[index] = self.element_type.unpack(BufferStream(self.data, offset))
+        elif self.copy:
+            return self.element_type.unpack_from(self.data, offset)
+        return self.values[index]
 
 
 def load_cull_mode_array(materials, entries):
-    indexer = Indexer()
+    indexer = Indexer(EnumConverter(uint32, gx.CullMode))
     indexer.update([gx.CULL_BACK, gx.CULL_FRONT, gx.CULL_NONE])
     for material, entry in zip(materials, entries):
         entry.cull_mode_index = indexer[material.cull_mode]
@@ -719,7 +759,7 @@ def unload_cull_mode_array(materials, entries, array):
 
 
 def load_channel_count_array(materials, entries):
-    indexer = Indexer()
+    indexer = Indexer(uint8)
     for material, entry in zip(materials, entries):
         entry.channel_count_index = indexer[material.channel_count]
     return indexer
@@ -732,7 +772,7 @@ def unload_channel_count_array(materials, entries, array):
 
 
 def load_material_color_array(materials, entries):
-    indexer = Indexer()
+    indexer = Indexer(Color)
     for material, entry in zip(materials, entries):
         for i, channel in enumerate(material.channels):
             entry.material_color_indices[i] = indexer[channel.material_color]
@@ -747,7 +787,7 @@ def unload_material_color_array(materials, entries, array):
 
 
 def load_ambient_color_array(materials, entries):
-    indexer = Indexer()
+    indexer = Indexer(Color)
     for material, entry in zip(materials, entries):
         for i, channel in enumerate(material.channels):
             entry.ambient_color_indices[i] = indexer[channel.ambient_color]
@@ -762,7 +802,7 @@ def unload_ambient_color_array(materials, entries, array):
 
 
 def load_lighting_mode_array(materials, entries):
-    indexer = Indexer()
+    indexer = Indexer(LightingMode)
     for material, entry in zip(materials, entries):
         for channel, channel_entry in zip(material.channels, entry.channels):
             channel_entry.color_mode_index = indexer[channel.color_mode]
@@ -780,7 +820,7 @@ def unload_lighting_mode_array(materials, entries, array):
 
 
 def load_light_array(materials, entries):
-    indexer = Indexer()
+    indexer = Indexer(Light)
     for material, entry in zip(materials, entries):
         for i, light in enumerate(material.lights):
             if light is not None:
@@ -796,7 +836,7 @@ def unload_light_array(materials, entries, array):
 
 
 def load_texcoord_generator_count_array(materials, entries):
-    indexer = Indexer()
+    indexer = Indexer(uint8)
     for material, entry in zip(materials, entries):
         entry.texcoord_generator_count_index = indexer[material.texcoord_generator_count]
     return indexer
@@ -809,7 +849,7 @@ def unload_texcoord_generator_count_array(materials, entries, array):
 
 
 def load_texcoord_generator_array(materials, entries):
-    indexer = Indexer()
+    indexer = Indexer(TexCoordGenerator)
     for material, entry in zip(materials, entries):
         for i, generator in enumerate(material.enabled_texcoord_generators):
             entry.texcoord_generator_indices[i] = indexer[generator]
@@ -824,7 +864,7 @@ def unload_texcoord_generator_array(materials, entries, array):
 
 
 def load_unknown2_array(materials, entries):
-    indexer = Indexer()
+    indexer = Indexer(UnknownStruct2)
     for material, entry in zip(materials, entries):
         for i, unknown2 in enumerate(material.unknown2):
             if unknown2 is not None:
@@ -840,7 +880,7 @@ def unload_unknown2_array(materials, entries, array):
 
 
 def load_texture_matrix_array(materials, entries):
-    indexer = Indexer()
+    indexer = Indexer(TextureMatrix)
     for material, entry in zip(materials, entries):
         # Nintendo seems to pair up texture matrices with texcoord generators
         # in order, and a matrix is included in the MAT3 section even if it
@@ -865,7 +905,7 @@ def unload_texture_matrix_array(materials, entries, array):
 
 
 def load_texture_index_array(materials, entries):
-    indexer = Indexer()
+    indexer = Indexer(uint16)
     for material, entry in zip(materials, entries):
         for i, index in enumerate(material.texture_indices):
             if index is not None:
@@ -881,7 +921,7 @@ def unload_texture_index_array(materials, entries, array):
 
 
 def load_tev_stage_count_array(materials, entries):
-    indexer = Indexer()
+    indexer = Indexer(uint8)
     for material, entry in zip(materials, entries):
         entry.tev_stage_count_index = indexer[material.tev_stage_count]
     return indexer
@@ -894,8 +934,7 @@ def unload_tev_stage_count_array(materials, entries, array):
 
 
 def load_tev_order_array(materials, entries):
-    indexer = Indexer()
-    indexer.equal_predicate = TevOrder.__eq__
+    indexer = Indexer(TevOrder)
     for material, entry in zip(materials, entries):
         for i, stage in enumerate(material.enabled_tev_stages):
             entry.tev_order_indices[i] = indexer[stage]
@@ -912,14 +951,9 @@ def unload_tev_order_array(materials, entries, array):
                 stage.color = order.color
 
 
-def equal_tev_combiner_and_swap_mode(a, b):
-    return TevCombiner.__eq__(a, b) and SwapMode.__eq__(a, b)
-
-
 def load_tev_combiner_array(materials, entries):
-    indexer = Indexer()
     # It looks like tev combiner and swap mode are indexed together for some reason
-    indexer.equal_predicate = equal_tev_combiner_and_swap_mode
+    indexer = Indexer(TevCombiner, SwapMode)
     for material, entry in zip(materials, entries):
         for i, stage in enumerate(material.enabled_tev_stages):
             entry.tev_combiner_indices[i] = indexer[stage]
@@ -938,9 +972,8 @@ def unload_tev_combiner_array(materials, entries, array):
 
 
 def load_swap_mode_array(materials, entries):
-    indexer = Indexer()
     # It looks like tev combiner and swap mode are indexed together for some reason
-    indexer.equal_predicate = equal_tev_combiner_and_swap_mode
+    indexer = Indexer(TevCombiner, SwapMode)
     for material, entry in zip(materials, entries):
         for i, stage in enumerate(material.enabled_tev_stages):
             entry.swap_mode_indices[i] = indexer[stage]
@@ -957,7 +990,7 @@ def unload_swap_mode_array(materials, entries, array):
 
 
 def load_tev_color_array(materials, entries):
-    indexer = Indexer()
+    indexer = Indexer(ColorS16)
     for material, entry in zip(materials, entries):
         for i, color in enumerate(material.tev_colors):
             entry.tev_color_indices[i] = indexer[color]
@@ -975,7 +1008,7 @@ def unload_tev_color_array(materials, entries, array):
 
 
 def load_kcolor_array(materials, entries):
-    indexer = Indexer()
+    indexer = Indexer(Color)
     for material, entry in zip(materials, entries):
         for i, color in enumerate(material.kcolors):
             entry.kcolor_indices[i] = indexer[color]
@@ -990,7 +1023,7 @@ def unload_kcolor_array(materials, entries, array):
 
 
 def load_swap_table_array(materials, entries):
-    indexer = Indexer()
+    indexer = Indexer(SwapTable)
     for material, entry in zip(materials, entries):
         for i, table in enumerate(material.swap_tables):
             entry.swap_table_indices[i] = indexer[table]
@@ -1005,7 +1038,7 @@ def unload_swap_table_array(materials, entries, array):
 
 
 def load_fog_array(materials, entries):
-    indexer = Indexer()
+    indexer = Indexer(Fog)
     for material, entry in zip(materials, entries):
         entry.fog_index = indexer[material.fog]
     return indexer
@@ -1018,7 +1051,7 @@ def unload_fog_array(materials, entries, array):
 
 
 def load_alpha_test_array(materials, entries):
-    indexer = Indexer()
+    indexer = Indexer(AlphaTest)
     for material, entry in zip(materials, entries):
         entry.alpha_test_index = indexer[material.alpha_test]
     return indexer
@@ -1031,7 +1064,7 @@ def unload_alpha_test_array(materials, entries, array):
 
 
 def load_blend_mode_array(materials, entries):
-    indexer = Indexer()
+    indexer = Indexer(BlendMode)
     for material, entry in zip(materials, entries):
         entry.blend_mode_index = indexer[material.blend_mode]
     return indexer
@@ -1044,7 +1077,7 @@ def unload_blend_mode_array(materials, entries, array):
 
 
 def load_depth_mode_array(materials, entries):
-    indexer = Indexer()
+    indexer = Indexer(DepthMode)
     for material, entry in zip(materials, entries):
         entry.depth_mode_index = indexer[material.depth_mode]
     return indexer
@@ -1057,7 +1090,7 @@ def unload_depth_mode_array(materials, entries, array):
 
 
 def load_depth_test_early_array(materials, entries):
-    indexer = Indexer()
+    indexer = Indexer(bool8)
     indexer.update([False, True])
     for material, entry in zip(materials, entries):
         entry.depth_test_early_index = indexer[material.depth_test_early]
@@ -1071,7 +1104,7 @@ def unload_depth_test_early_array(materials, entries, array):
 
 
 def load_dither_array(materials, entries):
-    indexer = Indexer()
+    indexer = Indexer(bool8)
     indexer.update([False, True])
     for material, entry in zip(materials, entries):
         entry.dither_index = indexer[material.dither]
@@ -1085,7 +1118,7 @@ def unload_dither_array(materials, entries, array):
 
 
 def load_unknown5_array(materials, entries):
-    indexer = Indexer()
+    indexer = Indexer(UnknownStruct5)
     for material, entry in zip(materials, entries):
         entry.unknown5_index = indexer[material.unknown5]
     return indexer
@@ -1192,7 +1225,7 @@ def pack(stream, materials):
     dither_array = _l(load_dither_array)
     unknown5_array = _l(load_unknown5_array)
 
-    entry_indexer = Indexer()
+    entry_indexer = Indexer(Entry)
     entry_indices = [entry_indexer[entry] for entry in entries]
 
     base = stream.tell()
@@ -1201,12 +1234,10 @@ def pack(stream, materials):
     stream.write(b'\x00'*Header.sizeof())
 
     header.entry_offset = stream.tell() - base
-    for entry in entry_indexer:
-        Entry.pack(stream, entry)
+    Entry.pack_array(stream, entry_indexer)
 
     header.entry_index_offset = stream.tell() - base
-    for index in entry_indices:
-        uint16.pack(stream, index)
+    uint16.pack_array(stream, entry_indices)
 
     align(stream, 4)
     header.name_offset = stream.tell() - base
@@ -1214,18 +1245,15 @@ def pack(stream, materials):
 
     align(stream, 4)
     header.indirect_entry_offset = stream.tell() - base
-    for material in materials:
-        indirect_entry = load_indirect_entry(material)
-        IndirectEntry.pack(stream, indirect_entry)
+    IndirectEntry.pack_array(stream, (load_indirect_entry(material) for material in materials))
 
     def _p(array, element_type):
         offset = stream.tell() - base
-        for element in array:
-            element_type.pack(stream, element)
+        element_type.pack_array(stream, array)
         return offset
 
     align(stream, 4)
-    header.cull_mode_offset = _p(cull_mode_array, EnumConverter(uint32, gx.CullMode))
+    header.cull_mode_offset = _p([cull_mode.value for cull_mode in cull_mode_array], uint32)
     header.material_color_offset = _p(material_color_array, Color)
     header.channel_count_offset = _p(channel_count_array, uint8)
     align(stream, 4)
@@ -1271,11 +1299,11 @@ def unpack(stream):
     materials = [Material() for _ in range(header.material_count)]
 
     stream.seek(base + header.entry_index_offset)
-    entry_indices = [uint16.unpack(stream) for _ in range(header.material_count)]
+    entry_indices = uint16.unpack_array(stream, header.material_count)
 
     entry_count = max(entry_indices) + 1
     stream.seek(base + header.entry_offset)
-    entries = [Entry.unpack(stream) for _ in range(entry_count)]
+    entries = Entry.unpack_array(stream, entry_count)
     entries = [entries[i] for i in entry_indices]
 
     for material, entry in zip(materials, entries):
@@ -1293,42 +1321,50 @@ def unpack(stream):
 
     if header.indirect_entry_offset is not None:
         stream.seek(base + header.indirect_entry_offset)
-        for material in materials:
-            indirect_entry = IndirectEntry.unpack(stream)
+        indirect_entries = IndirectEntry.unpack_array(stream, header.material_count)
+        for material, indirect_entry in zip(materials, indirect_entries):
             unload_indirect_entry(material, indirect_entry)
 
-    def _u(offset, unload_function, element_type):
+    # Tables are read in one go, up to the start of the next table
+    table_ends = sorted({
+        getattr(header, field.name) for field in Header.struct_fields
+        if isinstance(field, Field) and field.name.endswith('_offset')
+    } - {None} | {header.section_size})
+
+    def _u(offset, unload_function, element_type, copy=False):
         if offset is None:
             array = None
         else:
-            array = ArrayUnpacker(stream, base + offset, element_type)
+            end = table_ends[bisect.bisect_right(table_ends, offset)]
+            stream.seek(base + offset)
+            array = Table(stream.read(end - offset), element_type, copy)
         unload_function(materials, entries, array)
 
     _u(header.cull_mode_offset, unload_cull_mode_array, EnumConverter(uint32, gx.CullMode))
     _u(header.channel_count_offset, unload_channel_count_array, uint8)
     _u(header.material_color_offset, unload_material_color_array, Color)
     _u(header.ambient_color_offset, unload_ambient_color_array, Color)
-    _u(header.lighting_mode_offset, unload_lighting_mode_array, LightingMode)
-    _u(header.light_offset, unload_light_array, Light)
+    _u(header.lighting_mode_offset, unload_lighting_mode_array, LightingMode, copy=True)
+    _u(header.light_offset, unload_light_array, Light, copy=True)
     _u(header.texcoord_generator_count_offset, unload_texcoord_generator_count_array, uint8)
-    _u(header.texcoord_generator_offset, unload_texcoord_generator_array, TexCoordGenerator)
-    _u(header.unknown2_offset, unload_unknown2_array, UnknownStruct2)
-    _u(header.texture_matrix_offset, unload_texture_matrix_array, TextureMatrix)
+    _u(header.texcoord_generator_offset, unload_texcoord_generator_array, TexCoordGenerator, copy=True)
+    _u(header.unknown2_offset, unload_unknown2_array, UnknownStruct2, copy=True)
+    _u(header.texture_matrix_offset, unload_texture_matrix_array, TextureMatrix, copy=True)
     _u(header.texture_index_offset, unload_texture_index_array, uint16)
     _u(header.tev_stage_count_offset, unload_tev_stage_count_array, uint8)
     _u(header.tev_order_offset, unload_tev_order_array, TevOrder)
-    _u(header.tev_combiner_offset, unload_tev_combiner_array, TevCombiner)
+    _u(header.tev_combiner_offset, unload_tev_combiner_array, TevCombiner, copy=True)
     _u(header.swap_mode_offset, unload_swap_mode_array, SwapMode)
     _u(header.tev_color_offset, unload_tev_color_array, ColorS16)
     _u(header.kcolor_offset, unload_kcolor_array, Color)
-    _u(header.swap_table_offset, unload_swap_table_array, SwapTable)
-    _u(header.fog_offset, unload_fog_array, Fog)
-    _u(header.alpha_test_offset, unload_alpha_test_array, AlphaTest)
-    _u(header.blend_mode_offset, unload_blend_mode_array, BlendMode)
-    _u(header.depth_mode_offset, unload_depth_mode_array, DepthMode)
+    _u(header.swap_table_offset, unload_swap_table_array, SwapTable, copy=True)
+    _u(header.fog_offset, unload_fog_array, Fog, copy=True)
+    _u(header.alpha_test_offset, unload_alpha_test_array, AlphaTest, copy=True)
+    _u(header.blend_mode_offset, unload_blend_mode_array, BlendMode, copy=True)
+    _u(header.depth_mode_offset, unload_depth_mode_array, DepthMode, copy=True)
     _u(header.depth_test_early_offset, unload_depth_test_early_array, bool8)
     _u(header.dither_offset, unload_dither_array, bool8)
-    _u(header.unknown5_offset, unload_unknown5_array, UnknownStruct5)
+    _u(header.unknown5_offset, unload_unknown5_array, UnknownStruct5, copy=True)
 
     stream.seek(base + header.section_size)
     return materials
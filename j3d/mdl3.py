@@ -1,9 +1,13 @@
+import logging
 from math import log, floor, ceil, frexp
 from btypes.big_endian import *
 import gx
 import j3d.string_table
 
 
+logger = logging.getLogger(__name__)
+
+
 class Header(Struct):
     magic = ByteString(4)
     section_size = uint32
@@ -19,6 +23,13 @@ class Header(Struct):
     def __init__(self):
         self.magic = b'MDL3'
 
+    @classmethod
+    def unpack(cls, stream):
+        header = super().unpack(stream)
+        if header.magic != b'MDL3':
+            raise FormatError(f'invalid magic: {header.magic}')
+        return header
+
 
 class PacketLocation(Struct):
     offset = uint32
@@ -100,8 +111,7 @@ class XFCommand(list):
         uint8.pack(stream, 0x10)
         uint16.pack(stream, len(command) - 1)
         uint16.pack(stream, command.register)
-        for value in command:
-            command.element_type.pack(stream, value)
+        command.element_type.pack_array(stream, command)
 
 
 def convert_cull_mode(mode):
@@ -786,13 +796,66 @@ def pack_packet(stream, packet, material, textures):
     align(stream, 0x20, b'\x00')
 
 
+class PackedPacket:
+    """Packet of a material in packed form.
+
+    The packed packet of a material is cached in the mdl3_packet attribute of
+    the material, so that the packet only needs to be generated again when the
+    material has changed. When a model is unpacked, the cache is filled with
+    the packets from the MDL3 section, so these are written back as they were.
+
+    A cached packet is not used if the texture indices of the material have
+    changed since it was packed. Apart from that, code that modifies a
+    material, or any of the textures used by it, has to reset mdl3_packet to
+    None. The material models do this for all edits.
+    """
+
+    def __init__(self, data, subpacket_location, matrix_indices, texture_indices):
+        self.data = data
+        self.subpacket_location = subpacket_location
+        self.matrix_indices = matrix_indices
+        self.texture_indices = texture_indices
+
+
+def get_packed_packet(material, textures):
+    texture_indices = tuple(material.texture_indices)
+    packed_packet = material.mdl3_packet
+    if packed_packet is not None and packed_packet.texture_indices == texture_indices:
+        return packed_packet
+
+    packet = Packet(material, textures)
+    stream = BufferStream(bytearray())
+    pack_packet(stream, packet, material, textures)
+    subpacket_location = SubpacketLocation()
+    subpacket_location.channel_color_offset = packet.channel_color_offset
+    subpacket_location.channel_offset = packet.channel_offset
+    subpacket_location.texcoord_generator_offset = packet.texcoord_generator_offset
+    subpacket_location.texture_offset = packet.texture_offset
+    subpacket_location.tev_offset = packet.tev_offset
+    subpacket_location.fog_offset = packet.fog_offset
+    matrix_indices = [int(value) for value in packet.mtxidx]
+    packed_packet = PackedPacket(bytes(stream.buffer), subpacket_location, matrix_indices, texture_indices)
+    material.mdl3_packet = packed_packet
+    return packed_packet
+
+
+def load_packed_packets(materials, packed_packets):
+    """Cache packets unpacked from a MDL3 section in the materials."""
+    if len(packed_packets) != len(materials):
+        logger.warning('unexpected packet count: %s', len(packed_packets))
+        return
+    for material, packed_packet in zip(materials, packed_packets):
+        packed_packet.texture_indices = tuple(material.texture_indices)
+        material.mdl3_packet = packed_packet
+
+
 def pack(stream, materials, textures):
     base = stream.tell()
     header = Header()
     header.packet_count = len(materials)
     stream.write(b'\x00'*Header.sizeof())
 
-    packets = [Packet(material, textures) for material in materials]
+    packed_packets = [get_packed_packet(material, textures) for material in materials]
     packet_locations = []
 
     align(stream, 0x20)
@@ -800,31 +863,33 @@ def pack(stream, materials, textures):
     stream.write(b'\x00'*header.packet_count*PacketLocation.sizeof())
     align(stream, 0x20)
 
-    for i, (packet, material) in enumerate(zip(packets, materials)):
+    for i, packed_packet in enumerate(packed_packets):
         packet_base = base + header.packet_offset + i*PacketLocation.sizeof()
         packet_location = PacketLocation()
         packet_location.offset = stream.tell() - packet_base
-        pack_packet(stream, packet, material, textures)
-        packet_location.size = stream.tell() - packet_base - packet_location.offset
+        stream.write(packed_packet.data)
+        packet_location.size = len(packed_packet.data)
         packet_locations.append(packet_location)
 
     header.subpacket_location_offset = stream.tell() - base
-    for packet in packets:
-        SubpacketLocation.pack(stream, packet)
+    SubpacketLocation.pack_array(stream, (
+        packed_packet.subpacket_location
+        for packed_packet in packed_packets
+    ))
 
     header.matrix_index_offset = stream.tell() - base
-    for packet in packets:
-        uint32.pack(stream, packet.mtxidx[0])
-        uint32.pack(stream, packet.mtxidx[1])
+    uint32.pack_array(stream, (
+        value
+        for packed_packet in packed_packets
+        for value in packed_packet.matrix_indices
+    ))
 
     header.unknown0_offset = stream.tell() - base
-    for material in materials:
-        uint8.pack(stream, material.unknown0)
+    uint8.pack_array(stream, (material.unknown0 for material in materials))
 
     align(stream, 4)
     header.index_offset = stream.tell() - base
-    for i in range(header.packet_count):
-        uint16.pack(stream, i)
+    uint16.pack_array(stream, range(header.packet_count))
 
     align(stream, 4)
     header.name_offset = stream.tell() - base
@@ -837,8 +902,37 @@ def pack(stream, materials, textures):
     Header.pack(stream, header)
 
     stream.seek(base + header.packet_offset)
-    for packet_location in packet_locations:
-        PacketLocation.pack(stream, packet_location)
+    PacketLocation.pack_array(stream, packet_locations)
 
     stream.seek(base + header.section_size)
 
+
+def unpack(stream):
+    base = stream.tell()
+    header = Header.unpack(stream)
+
+    stream.seek(base + header.packet_offset)
+    packet_locations = PacketLocation.unpack_array(stream, header.packet_count)
+
+    stream.seek(base + header.subpacket_location_offset)
+    subpacket_locations = SubpacketLocation.unpack_array(stream, header.packet_count)
+
+    stream.seek(base + header.matrix_index_offset)
+    matrix_indices = uint32.unpack_array(stream, 2*header.packet_count)
+
+    stream.seek(base + header.index_offset)
+    if uint16.unpack_array(stream, header.packet_count) != list(range(header.packet_count)):
+        # Packets are regenerated from the materials when the model is packed
+        logger.warning('invalid packet index, discarding packets')
+        stream.seek(base + header.section_size)
+        return []
+
+    packed_packets = []
+    for i, (packet_location, subpacket_location) in enumerate(zip(packet_locations, subpacket_locations)):
+        packet_base = base + header.packet_offset + i*PacketLocation.sizeof()
+        stream.seek(packet_base + packet_location.offset)
+        data = stream.read(packet_location.size)
+        packed_packets.append(PackedPacket(data, subpacket_location, matrix_indices[2*i : 2*i + 2], None))
+
+    stream.seek(base + header.section_size)
+    return packed_packets
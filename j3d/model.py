@@ -1,4 +1,6 @@
+import concurrent.futures
 import logging
+import pickle
 from btypes.big_endian import *
 import j3d.inf1
 import j3d.vtx1
@@ -41,6 +43,131 @@ class Model:
     pass
 
 
+class Section:
+
+    def __init__(self, magic, offset, size):
+        self.magic = magic
+        self.offset = offset
+        self.size = size
+
+
+SECTION_UNPACKERS = {
+    b'INF1': j3d.inf1.unpack,
+    b'VTX1': j3d.vtx1.unpack,
+    b'EVP1': j3d.evp1.unpack,
+    b'DRW1': j3d.drw1.unpack,
+    b'JNT1': j3d.jnt1.unpack,
+    b'SHP1': j3d.shp1.unpack,
+    b'MAT3': j3d.mat3.unpack,
+    b'MDL3': j3d.mdl3.unpack,
+    b'TEX1': j3d.tex1.unpack
+}
+
+
+class LazyModel(Model):
+    """Model whose sections are decoded when first accessed.
+
+    The stream the model was unpacked from has to stay open until all
+    sections have been decoded.
+    """
+
+    attribute_sections = {
+        'scene_graph': b'INF1',
+        'position_array': b'VTX1',
+        'normal_array': b'VTX1',
+        'color_arrays': b'VTX1',
+        'texcoord_arrays': b'VTX1',
+        'influence_groups': b'EVP1',
+        'inverse_bind_matrices': b'EVP1',
+        'matrix_definitions': b'DRW1',
+        'joints': b'JNT1',
+        'shapes': b'SHP1',
+        'materials': b'MAT3',
+        'textures': b'TEX1'
+    }
+
+    def __init__(self, stream, header, sections):
+        self.file_type = header.file_type
+        self.subversion = header.subversion
+        self.stream = stream
+        self.sections = {section.magic : section for section in sections}
+        self.section_data = {}
+        self.loaded_sections = set()
+
+    def __getattr__(self, name):
+        magic = self.attribute_sections.get(name)
+        if magic is None:
+            raise AttributeError(f'{type(self).__name__!r} object has no attribute {name!r}')
+        self.load_section(magic)
+        return self.__dict__[name]
+
+    def unpack_section(self, magic):
+        if magic not in self.section_data:
+            if self.stream is None:
+                raise ValueError('model stream has been released')
+            self.stream.seek(self.sections[magic].offset)
+            self.section_data[magic] = SECTION_UNPACKERS[magic](self.stream)
+        return self.section_data[magic]
+
+    def load_section(self, magic):
+        if magic in self.loaded_sections:
+            return
+
+        if magic == b'INF1':
+            inf1 = self.unpack_section(b'INF1')
+            self.scene_graph = inf1.scene_graph
+        elif magic == b'VTX1':
+            inf1 = self.unpack_section(b'INF1')
+            vtx1 = self.unpack_section(b'VTX1')
+            # The position array read from the VTX1 section might be longer
+            # than it should be, due to the way the VTX1 arrays are read
+            if inf1.vertex_position_count > len(vtx1.position_array):
+                logger.warning('unexpected vertex_position_count value: %s', inf1.vertex_position_count)
+            self.position_array = vtx1.position_array[:inf1.vertex_position_count]
+            self.normal_array = vtx1.normal_array
+            self.color_arrays = vtx1.color_arrays
+            self.texcoord_arrays = vtx1.texcoord_arrays
+        elif magic == b'EVP1':
+            evp1 = self.unpack_section(b'EVP1')
+            joints = self.unpack_section(b'JNT1')
+            if evp1.inverse_bind_matrices is not None:
+                if len(evp1.inverse_bind_matrices) != len(joints):
+                    raise FormatError('wrong number of inverse bind matrices')
+            self.influence_groups = evp1.influence_groups
+            self.inverse_bind_matrices = evp1.inverse_bind_matrices
+        elif magic == b'DRW1':
+            self.matrix_definitions = self.unpack_section(b'DRW1')
+        elif magic == b'JNT1':
+            self.joints = self.unpack_section(b'JNT1')
+        elif magic == b'SHP1':
+            inf1 = self.unpack_section(b'INF1')
+            shapes = self.unpack_section(b'SHP1')
+            shape_batch_count = sum(len(shape.batches) for shape in shapes)
+            if inf1.shape_batch_count != shape_batch_count:
+                logger.warning('unexpected shape_batch_count value: %s', inf1.shape_batch_count)
+            self.shapes = shapes
+        elif magic == b'MAT3':
+            materials = self.unpack_section(b'MAT3')
+            if b'MDL3' in self.sections:
+                j3d.mdl3.load_packed_packets(materials, self.unpack_section(b'MDL3'))
+            self.materials = materials
+        elif magic == b'MDL3':
+            self.load_section(b'MAT3')
+        elif magic == b'TEX1':
+            self.textures = self.unpack_section(b'TEX1')
+        else:
+            raise ValueError(f'invalid section: {magic}')
+
+        self.loaded_sections.add(magic)
+
+    def load_all_sections(self):
+        """Decode all remaining sections and release the stream."""
+        for magic in SECTION_UNPACKERS:
+            self.load_section(magic)
+        self.stream = None
+        self.section_data = {}
+
+
 def get_section_count(file_type):
     if file_type == b'bmd3':
         return 8
@@ -49,83 +176,177 @@ def get_section_count(file_type):
     raise ValueError(f'invalid file type: {file_type}')
 
 
-def skip_section(stream, magic):
-    if stream.read(4) != magic:
-        raise FormatError(f'invalid magic: {magic}')
-    section_size = uint32.unpack(stream)
-    stream.seek(section_size - 8, SEEK_CUR)
+def get_section_magics(file_type):
+    if file_type == b'bmd3':
+        return [b'INF1', b'VTX1', b'EVP1', b'DRW1', b'JNT1', b'SHP1', b'MAT3', b'TEX1']
+    if file_type == b'bdl4':
+        return [b'INF1', b'VTX1', b'EVP1', b'DRW1', b'JNT1', b'SHP1', b'MAT3', b'MDL3', b'TEX1']
+    raise ValueError(f'invalid file type: {file_type}')
+
+
+def unpack_section_directory(stream, header):
+    """Read the magic, offset and size of each section of a model, without
+    decoding the sections."""
+    if header.section_count != get_section_count(header.file_type):
+        raise FormatError(f'invalid section count: {header.section_count}')
+
+    sections = []
+    for magic in get_section_magics(header.file_type):
+        offset = stream.tell()
+        if stream.read(4) != magic:
+            raise FormatError(f'invalid magic: {magic}')
+        section_size = uint32.unpack(stream)
+        sections.append(Section(magic, offset, section_size))
+        stream.seek(offset + section_size)
+    return sections
 
 
-def pack(stream, model):
+def pack_section(pack_function, *args):
+    stream = BufferStream(bytearray())
+    pack_function(stream, *args)
+    return stream.buffer
+
+
+def pack_pickled_section(pickled_packer):
+    return pack_section(*pickle.loads(pickled_packer))
+
+
+def get_section_packer(model, magic):
+    if magic == b'INF1':
+        shape_batch_count = sum(len(shape.batches) for shape in model.shapes)
+        vertex_position_count = len(model.position_array)
+        return (j3d.inf1.pack, model.scene_graph, shape_batch_count, vertex_position_count)
+    if magic == b'VTX1':
+        return (j3d.vtx1.pack, model.position_array, model.normal_array, model.color_arrays, model.texcoord_arrays)
+    if magic == b'EVP1':
+        return (j3d.evp1.pack, model.influence_groups, model.inverse_bind_matrices)
+    if magic == b'DRW1':
+        return (j3d.drw1.pack, model.matrix_definitions)
+    if magic == b'JNT1':
+        return (j3d.jnt1.pack, model.joints)
+    if magic == b'SHP1':
+        return (j3d.shp1.pack, model.shapes)
+    if magic == b'MAT3':
+        return (j3d.mat3.pack, model.materials)
+    if magic == b'MDL3':
+        return (j3d.mdl3.pack, model.materials, model.textures)
+    if magic == b'TEX1':
+        return (j3d.tex1.pack, model.textures)
+    raise ValueError(f'invalid section: {magic}')
+
+
+def pack(stream, model, executor=None, reused_sections=None):
+    """Pack a model.
+
+    The model is packed into a single buffer, which is then written to the
+    stream with one write call, so the stream does not need to be seekable.
+    If an executor is given, the sections are packed concurrently into
+    separate buffers by tasks submitted to the executor, and then joined.
+
+    reused_sections can map section magics to the packed data of sections
+    that are known to be unchanged, for example slices of the file the model
+    was unpacked from. Those sections are written as given instead of being
+    packed again.
+    """
+    stream.write(pack_buffer(model, executor, reused_sections))
+
+
+def pack_buffer(model, executor=None, reused_sections=None):
+    """Pack a model into a bytearray, see pack."""
+    if reused_sections is None:
+        reused_sections = {}
+
     header = Header()
     header.file_type = model.file_type
     header.section_count = get_section_count(model.file_type)
     header.subversion = model.subversion
-    stream.write(b'\x00'*Header.sizeof())
 
-    shape_batch_count = sum(len(shape.batches) for shape in model.shapes)
-    vertex_position_count = len(model.position_array)
+    section_packers = [
+        reused_sections[magic] if magic in reused_sections else get_section_packer(model, magic)
+        for magic in get_section_magics(model.file_type)
+    ]
+
+    output = BufferStream(bytearray())
+    output.allocate(Header.sizeof())
 
-    j3d.inf1.pack(stream, model.scene_graph, shape_batch_count, vertex_position_count)
-    j3d.vtx1.pack(stream, model.position_array, model.normal_array, model.color_arrays, model.texcoord_arrays)
-    j3d.evp1.pack(stream, model.influence_groups, model.inverse_bind_matrices)
-    j3d.drw1.pack(stream, model.matrix_definitions)
-    j3d.jnt1.pack(stream, model.joints)
-    j3d.shp1.pack(stream, model.shapes)
-    j3d.mat3.pack(stream, model.materials)
-    if model.file_type == b'bdl4':
-        j3d.mdl3.pack(stream, model.materials, model.textures)
-    j3d.tex1.pack(stream, model.textures)
+    if executor is None:
+        for packer in section_packers:
+            if not isinstance(packer, tuple):
+                output.write(packer)
+                continue
+            pack_function, *args = packer
+            pack_function(output, *args)
+    else:
+        futures = []
+        for packer in section_packers:
+            if not isinstance(packer, tuple):
+                futures.append(None)
+            elif isinstance(executor, concurrent.futures.ProcessPoolExecutor):
+                # Pickle the section data explicitly, see unpack_section_file
+                pickled_packer = pickle.dumps(packer, pickle.HIGHEST_PROTOCOL)
+                futures.append(executor.submit(pack_pickled_section, pickled_packer))
+            else:
+                futures.append(executor.submit(pack_section, *packer))
+        for packer, future in zip(section_packers, futures):
+            output.write(packer if future is None else future.result())
 
-    header.file_size = stream.tell()
-    stream.seek(0)
-    Header.pack(stream, header)
+    header.file_size = output.tell()
+    Header.pack_into(output.buffer, 0, header)
+    return output.buffer
 
 
-def unpack(stream):
+def unpack(stream, lazy=False):
+    """Unpack a model.
+
+    If lazy is true, only the section directory is read, and each section is
+    decoded when the corresponding model attributes are first accessed.
+    """
     header = Header.unpack(stream)
-    if header.section_count != get_section_count(header.file_type):
-        raise FormatError(f'invalid section count: {header.section_count}')
+    sections = unpack_section_directory(stream, header)
+    end = stream.tell()
 
-    inf1 = j3d.inf1.unpack(stream)
-    vtx1 = j3d.vtx1.unpack(stream)
-    evp1 = j3d.evp1.unpack(stream)
-    matrix_definitions = j3d.drw1.unpack(stream)
-    joints = j3d.jnt1.unpack(stream)
-    shapes = j3d.shp1.unpack(stream)
-    materials = j3d.mat3.unpack(stream)
-    if header.file_type == b'bdl4':
-        skip_section(stream, b'MDL3')
-    textures = j3d.tex1.unpack(stream)
-
-    # The position array read from the VTX1 section might be longer than it
-    # should be, due to the way the VTX1 arrays are read
-    if inf1.vertex_position_count > len(vtx1.position_array):
-        logger.warning('unexpected vertex_position_count value: %s', inf1.vertex_position_count)
-    position_array = vtx1.position_array[:inf1.vertex_position_count]
-
-    shape_batch_count = sum(len(shape.batches) for shape in shapes)
-    if inf1.shape_batch_count != shape_batch_count:
-        logger.warning('unexpected shape_batch_count value: %s', inf1.shape_batch_count)
-
-    if evp1.inverse_bind_matrices is not None:
-        if len(evp1.inverse_bind_matrices) != len(joints):
-            raise FormatError('wrong number of inverse bind matrices')
-
-    model = Model()
-    model.file_type = header.file_type
-    model.subversion = header.subversion
-    model.scene_graph = inf1.scene_graph
-    model.position_array = position_array
-    model.normal_array = vtx1.normal_array
-    model.color_arrays = vtx1.color_arrays
-    model.texcoord_arrays = vtx1.texcoord_arrays
-    model.influence_groups = evp1.influence_groups
-    model.inverse_bind_matrices = evp1.inverse_bind_matrices
-    model.matrix_definitions = matrix_definitions
-    model.joints = joints
-    model.shapes = shapes
-    model.materials = materials
-    model.textures = textures
+    model = LazyModel(stream, header, sections)
+    if not lazy:
+        model.load_all_sections()
+        stream.seek(end)
     return model
 
+
+def unpack_section_file(file_path, magic, offset):
+    stream = BufferStream.from_file(file_path, use_mmap=True)
+    stream.seek(offset)
+    section_data = SECTION_UNPACKERS[magic](stream)
+    # With pickle protocols before 5, NumPy converts big endian arrays to
+    # native byte order, which the section packers do not expect
+    return pickle.dumps(section_data, pickle.HIGHEST_PROTOCOL)
+
+
+def unpack_parallel(file_path, executor=None):
+    """Unpack a model from a file, decoding the sections concurrently.
+
+    Each section is decoded by a task submitted to executor, which defaults to
+    a process pool. The tasks memory map the file themselves, so the file
+    contents are not sent to the workers, only the decoded sections are sent
+    back.
+    """
+    stream = BufferStream.from_file(file_path, use_mmap=True)
+    header = Header.unpack(stream)
+    sections = unpack_section_directory(stream, header)
+    model = LazyModel(stream, header, sections)
+
+    shutdown_executor = executor is None
+    if executor is None:
+        executor = concurrent.futures.ProcessPoolExecutor()
+    try:
+        futures = {
+            section.magic : executor.submit(unpack_section_file, file_path, section.magic, section.offset)
+            for section in sections if section.magic in SECTION_UNPACKERS
+        }
+        for magic, future in futures.items():
+            model.section_data[magic] = pickle.loads(future.result())
+    finally:
+        if shutdown_executor:
+            executor.shutdown()
+
+    model.load_all_sections()
+    return model
@@ -1,5 +1,5 @@
 from btypes.big_endian import *
-from j3d.animation import Animation,select_interpolater,IncompatibleAnimationError
+from j3d.animation import TrackAnimation,Tracks,IncompatibleAnimationError
 import j3d.string_table
 
 
@@ -29,26 +29,25 @@ class Selection(Struct):
     unknown0 = uint16
 
 
-class MaterialAnimation(Struct):
+class ColorSelection(Struct):
     r = Selection
     g = Selection
     b = Selection
     a = Selection
 
+
+class MaterialAnimation:
+
     def attach(self,material):
         self.material_color = material.gl_block['material_color0']
 
-    def update(self,time):
-        self.material_color[0] = self.r.interpolate(time)/255
-        self.material_color[1] = self.g.interpolate(time)/255
-        self.material_color[2] = self.b.interpolate(time)/255
-        self.material_color[3] = self.a.interpolate(time)/255
-
 
-class MaterialColorAnimation(Animation):
+class MaterialColorAnimation(TrackAnimation):
     
-    def __init__(self,duration,loop_mode,material_animations):
-        super().__init__(duration,loop_mode)
+    def __init__(self,duration,loop_mode,material_animations,tracks):
+        # The tracks are the red, green, blue and alpha tracks, in that order,
+        # each with a track for every material animation
+        super().__init__(duration,loop_mode,tracks)
         self.material_animations = material_animations
 
     def attach(self,model):
@@ -63,8 +62,9 @@ class MaterialColorAnimation(Animation):
         self.time = -1
 
     def update_model(self):
-        for material_animation in self.material_animations:
-            material_animation.update(self.time)
+        colors = self.evaluate_tracks().reshape(4,-1).T/255
+        for material_animation,color in zip(self.material_animations,colors):
+            material_animation.material_color[:] = color
 
 
 def unpack(stream):
@@ -74,35 +74,37 @@ def unpack(stream):
         raise FormatError('invalid magic')
 
     stream.seek(base + header.material_animation_offset)
-    material_animations = [MaterialAnimation.unpack(stream) for _ in range(header.material_animation_count)]
+    selections = read_array(stream, ColorSelection.numpy_dtype(), header.material_animation_count)
 
     stream.seek(base + header.r_offset)
-    r = [sint16.unpack(stream) for _ in range(header.r_count)]
+    r = read_array(stream, sint16.numpy_dtype(), header.r_count)
 
     stream.seek(base + header.g_offset)
-    g = [sint16.unpack(stream) for _ in range(header.g_count)]
+    g = read_array(stream, sint16.numpy_dtype(), header.g_count)
 
     stream.seek(base + header.b_offset)
-    b = [sint16.unpack(stream) for _ in range(header.b_count)]
+    b = read_array(stream, sint16.numpy_dtype(), header.b_count)
 
     stream.seek(base + header.a_offset)
-    a = [sint16.unpack(stream) for _ in range(header.a_count)]
+    a = read_array(stream, sint16.numpy_dtype(), header.a_count)
 
     stream.seek(base + header.index_offset)
-    for index in range(header.material_animation_count):
-        if index != uint16.unpack(stream):
-            raise FormatError('invalid index')
+    if uint16.unpack_array(stream, header.material_animation_count) != list(range(header.material_animation_count)):
+        raise FormatError('invalid index')
 
     stream.seek(base + header.name_offset)
     names = j3d.string_table.unpack(stream)
 
+    material_animations = [MaterialAnimation() for _ in range(header.material_animation_count)]
+
     for material_animation,name in zip(material_animations,names):
-        material_animation.r = select_interpolater(material_animation.r,r)
-        material_animation.g = select_interpolater(material_animation.g,g)
-        material_animation.b = select_interpolater(material_animation.b,b)
-        material_animation.a = select_interpolater(material_animation.a,a)
         material_animation.name = name
 
+    tracks = Tracks.concatenate([
+        Tracks.from_selections(selections[component],values)
+        for component,values in (('r',r),('g',g),('b',b),('a',a))
+    ])
+
     stream.seek(base + header.section_size)
-    return MaterialColorAnimation(header.duration,header.loop_mode,material_animations)
+    return MaterialColorAnimation(header.duration,header.loop_mode,material_animations,tracks)
 
@@ -64,6 +64,11 @@ class PacketLocation(Struct):
 
 
 class Primitive:
+    """Single primitive of a batch.
+
+    Primitives obtained from Batch.primitives are views, and their vertices
+    share memory with the vertex array of the batch.
+    """
 
     def __init__(self, primitive_type, vertices):
         self.primitive_type = primitive_type
@@ -71,12 +76,52 @@ class Primitive:
 
 
 class Batch:
+    """Display list and matrix table of a shape.
+
+    The vertices of all primitives are stored in a single record array.
+    Primitive i has type primitive_types[i] and consists of the vertices
+    vertices[primitive_offsets[i]:primitive_offsets[i + 1]].
+    """
 
     def __init__(self, primitives, matrix_table, unknown0):
         self.primitives = primitives
         self.matrix_table = matrix_table
         self.unknown0 = unknown0
 
+    @classmethod
+    def from_arrays(cls, vertices, primitive_types, primitive_offsets, matrix_table, unknown0):
+        batch = cls.__new__(cls)
+        batch.vertices = vertices
+        batch.primitive_types = primitive_types
+        batch.primitive_offsets = primitive_offsets
+        batch.matrix_table = matrix_table
+        batch.unknown0 = unknown0
+        return batch
+
+    @property
+    def primitive_count(self):
+        return len(self.primitive_types)
+
+    @property
+    def primitives(self):
+        offsets = self.primitive_offsets.tolist()
+        return [
+            Primitive(gx.PrimitiveType(primitive_type), self.vertices[start:end])
+            for primitive_type, start, end in zip(self.primitive_types.tolist(), offsets, offsets[1:])
+        ]
+
+    @primitives.setter
+    def primitives(self, primitives):
+        self.primitive_types = numpy.array([primitive.primitive_type.value for primitive in primitives], numpy.uint8)
+        self.primitive_offsets = numpy.zeros(len(primitives) + 1, numpy.uint32)
+        self.primitive_offsets[1:] = numpy.cumsum([len(primitive.vertices) for primitive in primitives])
+        # Allocate the array explicitly, as numpy.concatenate does not
+        # preserve the byte order of structured types
+        vertex_type = primitives[0].vertices.dtype if primitives else numpy.uint8
+        self.vertices = numpy.empty(self.primitive_offsets[-1], vertex_type)
+        for primitive, start, end in zip(primitives, self.primitive_offsets, self.primitive_offsets[1:]):
+            self.vertices[start:end] = primitive.vertices
+
     
 class Shape(Struct):
     transformation_type = uint8
@@ -124,56 +169,71 @@ def get_vertex_type(attribute_descriptors):
     ]).newbyteorder('>')
 
 
-def pack_packet(stream, primitives):
-    for primitive in primitives:
-        uint8.pack(stream, primitive.primitive_type)
-        uint16.pack(stream, len(primitive.vertices))
-        primitive.vertices.tofile(stream)
+def get_vertex_mask(vertex_starts, vertex_sizes, packet_size):
+    """Mask of the bytes in a packet that are part of a vertex record."""
+    edges = numpy.zeros(packet_size + 1, numpy.int32)
+    edges[vertex_starts] += 1
+    edges[vertex_starts + vertex_sizes] -= 1
+    return numpy.cumsum(edges[:-1]) > 0
+
+
+def pack_packet(stream, batch):
+    stride = batch.vertices.dtype.itemsize
+    vertex_counts = numpy.diff(batch.primitive_offsets).astype(numpy.intp)
+    primitive_sizes = 3 + vertex_counts*stride
+    primitive_starts = numpy.cumsum(primitive_sizes) - primitive_sizes
+
+    # Build the whole display list in memory and write it at once
+    packet = numpy.empty(primitive_sizes.sum(), numpy.uint8)
+    packet[primitive_starts] = batch.primitive_types
+    packet[primitive_starts + 1] = vertex_counts >> 8
+    packet[primitive_starts + 2] = vertex_counts & 0xFF
+    vertex_mask = get_vertex_mask(primitive_starts + 3, vertex_counts*stride, len(packet))
+    packet[vertex_mask] = numpy.ascontiguousarray(batch.vertices).view(numpy.uint8)
+    write_array(stream, packet)
     align(stream, 0x20, b'\x00')
 
 
+PRIMITIVE_TYPE_VALUES = frozenset(primitive_type.value for primitive_type in gx.PrimitiveType)
+
+
 def unpack_packet(stream, vertex_type, size):
     # The entire packet is read into memory at once to improve performance
-    packet = stream.read(size)
-    primitives = []
+    packet = read_array(stream, numpy.uint8, size)
+    data = memoryview(packet)
+    stride = vertex_type.itemsize
+
+    # Only the primitive headers are visited, the vertex records are skipped
+    primitive_types = []
+    vertex_starts = []
+    vertex_counts = []
     i = 0
     while i < size:
-        opcode = packet[i]
+        opcode = data[i]
         if opcode == 0x00:
             i += 1
             continue
-        primitive_type = gx.PrimitiveType(opcode)
-        vertex_count = uint16.unpack_from(packet, i + 1)
-        vertices = numpy.frombuffer(packet, vertex_type, vertex_count, i + 3)
-        primitives.append(Primitive(primitive_type, vertices))
-        i += 3 + vertex_count*vertex_type.itemsize
-    return primitives
-
-
-class Haystack:
-
-    def __init__(self):
-        self.keys = []
-        self.values = []
-
-    def __getitem__(self, key):
-        try:
-            index = self.keys.index(key)
-        except ValueError:
-            raise KeyError(key)
-        return self.values[index]
-
-    def __setitem__(self, key, value):
-        try:
-            index = self.keys.index(key)
-        except ValueError:
-            self.keys.append(key)
-            self.values.append(value)
-        else:
-            self.values[index] = value
-
-    def __contains__(self, key):
-        return key in self.keys
+        if opcode not in PRIMITIVE_TYPE_VALUES:
+            raise FormatError('invalid primitive type')
+        if i + 3 > size:
+            raise FormatError('primitive extends past end of packet')
+        vertex_count = uint16.unpack_from(data, i + 1)
+        primitive_types.append(opcode)
+        vertex_starts.append(i + 3)
+        vertex_counts.append(vertex_count)
+        i += 3 + vertex_count*stride
+    if i > size:
+        raise FormatError('primitive extends past end of packet')
+
+    # Gather the vertex records of all primitives into one contiguous array
+    vertex_starts = numpy.array(vertex_starts, numpy.intp)
+    vertex_counts = numpy.array(vertex_counts, numpy.intp)
+    vertex_mask = get_vertex_mask(vertex_starts, vertex_counts*stride, size)
+    vertices = packet[vertex_mask].view(vertex_type)
+
+    primitive_offsets = numpy.zeros(len(vertex_counts) + 1, numpy.uint32)
+    primitive_offsets[1:] = numpy.cumsum(vertex_counts)
+    return vertices, numpy.array(primitive_types, numpy.uint8), primitive_offsets
 
 
 def pack(stream, shapes):
@@ -186,58 +246,71 @@ def pack(stream, shapes):
     stream.write(b'\x00'*Shape.sizeof()*len(shapes))
 
     header.index_offset = stream.tell() - base
-    for index in range(len(shapes)):
-        uint16.pack(stream, index)
+    uint16.pack_array(stream, range(len(shapes)))
 
     align(stream, 4)
     header.unknown0_offset = 0
 
+    # Identical attribute descriptor lists, matrix tables and packets are only
+    # written once, and looked up by value
     align(stream, 0x20)
     header.attribute_descriptor_offset = stream.tell() - base
-    deduplicate_table = Haystack()
+    attribute_descriptor_offsets = {}
     for shape in shapes:
-        if shape.attribute_descriptors not in deduplicate_table:
-            offset = stream.tell() - base - header.attribute_descriptor_offset
-            deduplicate_table[shape.attribute_descriptors] = offset
+        key = tuple(
+            (descriptor.attribute, descriptor.input_type)
+            for descriptor in shape.attribute_descriptors
+        )
+        if key not in attribute_descriptor_offsets:
+            attribute_descriptor_offsets[key] = stream.tell() - base - header.attribute_descriptor_offset
             AttributeDescriptorList.pack(stream, shape.attribute_descriptors)
-        shape.attribute_descriptor_offset = deduplicate_table[shape.attribute_descriptors]
+        shape.attribute_descriptor_offset = attribute_descriptor_offsets[key]
 
-    matrix_indices = []
-    matrix_selections = []
+    first_batch = 0
     for shape in shapes:
-        shape.first_matrix_selection = len(matrix_selections)
-        for batch in shape.batches:
-            matrix_selection = MatrixSelection()
-            matrix_selection.unknown0 = batch.unknown0
-            matrix_selection.first = len(matrix_indices)
-            matrix_selection.count = len(batch.matrix_table)
-            matrix_indices.extend(batch.matrix_table)
-            matrix_selections.append(matrix_selection)
+        shape.first_matrix_selection = first_batch
+        shape.first_packet = first_batch
+        first_batch += len(shape.batches)
+    batches = [batch for shape in shapes for batch in shape.batches]
+
+    matrix_indices = []
+    matrix_index_firsts = {}
+    matrix_selections = numpy.zeros(len(batches), MatrixSelection.numpy_dtype())
+    for i, batch in enumerate(batches):
+        matrix_table = tuple(batch.matrix_table)
+        if matrix_table not in matrix_index_firsts:
+            matrix_index_firsts[matrix_table] = len(matrix_indices)
+            matrix_indices.extend(matrix_table)
+        matrix_selections[i] = (batch.unknown0, len(matrix_table), matrix_index_firsts[matrix_table])
 
     header.matrix_index_offset = stream.tell() - base
-    for matrix_index in matrix_indices:
-        uint16.pack(stream, matrix_index)
+    write_array(stream, numpy.array(matrix_indices, uint16.numpy_dtype()))
 
     align(stream, 0x20)
     header.packet_offset = stream.tell() - base
-    packet_locations = []
-    for shape in shapes:
-        shape.first_packet_location = len(packet_locations)
-        for batch in shape.batches:
+    packet_locations = numpy.zeros(len(batches), PacketLocation.numpy_dtype())
+    packet_location_table = {}
+    for i, batch in enumerate(batches):
+        # The packet is fully determined by the vertex stride and the raw
+        # bytes of the arrays, so the packets don't have to be built to find
+        # the duplicates
+        key = (
+            batch.vertices.dtype.itemsize,
+            batch.vertices.tobytes(),
+            batch.primitive_types.tobytes(),
+            batch.primitive_offsets.tobytes()
+        )
+        if key not in packet_location_table:
             offset = stream.tell()
-            pack_packet(stream, batch.primitives)
-            packet_location = PacketLocation()
-            packet_location.offset = offset - header.packet_offset - base
-            packet_location.size = stream.tell() - offset
-            packet_locations.append(packet_location)
+            pack_packet(stream, batch)
+            packet_location_table[key] = (stream.tell() - offset, offset - base - header.packet_offset)
+        packet_locations[i] = packet_location_table[key]
 
     header.matrix_selection_offset = stream.tell() - base
-    for matrix_selection in matrix_selections:
-        MatrixSelection.pack(stream, matrix_selection)
+    write_array(stream, matrix_selections)
 
     header.packet_location_offset = stream.tell() - base
-    for packet_location in packet_locations:
-        PacketLocation.pack(stream, packet_location)
+    write_array(stream, packet_locations)
 
     align(stream, 0x20)
     header.section_size = stream.tell() - base
@@ -246,8 +319,7 @@ def pack(stream, shapes):
     Header.pack(stream, header)
 
     stream.seek(base + header.shape_offset)
-    for shape in shapes:
-        Shape.pack(stream, shape)
+    Shape.pack_array(stream, shapes)
 
     stream.seek(base + header.section_size)
 
@@ -257,12 +329,11 @@ def unpack(stream):
     header = Header.unpack(stream)
 
     stream.seek(base + header.shape_offset)
-    shapes = [Shape.unpack(stream) for _ in range(header.shape_count)]
+    shapes = Shape.unpack_array(stream, header.shape_count)
 
     stream.seek(base + header.index_offset)
-    for index in range(header.shape_count):
-        if index != uint16.unpack(stream):
-            raise FormatError('invalid index')
+    if uint16.unpack_array(stream, header.shape_count) != list(range(header.shape_count)):
+        raise FormatError('invalid index')
 
     duplicate_table = {}
     for shape in shapes:
@@ -275,15 +346,15 @@ def unpack(stream):
 
     stream.seek(base + header.matrix_selection_offset)
     count = max(shape.first_matrix_selection + shape.batch_count for shape in shapes)
-    matrix_selections = [MatrixSelection.unpack(stream) for _ in range(count)]
+    matrix_selections = MatrixSelection.unpack_array(stream, count)
 
     stream.seek(base + header.matrix_index_offset)
     count = max(selection.first + selection.count for selection in matrix_selections)
-    matrix_indices = [uint16.unpack(stream) for _ in range(count)]
+    matrix_indices = uint16.unpack_array(stream, count)
 
     stream.seek(base + header.packet_location_offset)
     count = max(shape.first_packet + shape.batch_count for shape in shapes)
-    packet_locations = [PacketLocation.unpack(stream) for _ in range(count)]
+    packet_locations = PacketLocation.unpack_array(stream, count)
 
     for shape in shapes:
         vertex_type = get_vertex_type(shape.attribute_descriptors)
@@ -293,8 +364,14 @@ def unpack(stream):
             matrix_table = matrix_indices[matrix_selection.first : matrix_selection.first + matrix_selection.count]
             packet_location = packet_locations[shape.first_packet + i]
             stream.seek(base + header.packet_offset + packet_location.offset)
-            primitives = unpack_packet(stream, vertex_type, packet_location.size)
-            shape.batches[i] = Batch(primitives, matrix_table, matrix_selection.unknown0)
+            vertices, primitive_types, primitive_offsets = unpack_packet(stream, vertex_type, packet_location.size)
+            shape.batches[i] = Batch.from_arrays(
+                vertices,
+                primitive_types,
+                primitive_offsets,
+                matrix_table,
+                matrix_selection.unknown0
+            )
 
     stream.seek(base + header.section_size)
     return shapes
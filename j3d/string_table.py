@@ -32,13 +32,15 @@ def pack(stream, strings):
     header.string_count = len(strings)
     Header.pack(stream, header)
 
+    entries = []
     offset = Header.sizeof() + Entry.sizeof()*len(strings)
     for string in strings:
         entry = Entry()
         entry.string_hash = calculate_hash(string)
         entry.string_offset = offset
-        Entry.pack(stream, entry)
+        entries.append(entry)
         offset += len(string) + 1
+    Entry.pack_array(stream, entries)
 
     for string in strings:
         stream.write(string)
@@ -48,7 +50,7 @@ def pack(stream, strings):
 def unpack(stream):
     base = stream.tell()
     header = Header.unpack(stream)
-    entries = [Entry.unpack(stream) for _ in range(header.string_count)]
+    entries = Entry.unpack_array(stream, header.string_count)
     strings = []
     for entry in entries:
         stream.seek(base + entry.string_offset)
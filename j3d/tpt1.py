@@ -46,11 +46,12 @@ class TextureSwapAnimation(Animation):
         self.model = model
 
     def update_model(self):
+        frame = int(self.time)
         for material_animation in self.material_animations:
-            if self.time >= len(material_animation.texture_indices):
+            if frame >= len(material_animation.texture_indices):
                 texture_index = material_animation.texture_indices[-1]
             else:
-                texture_index = material_animation.texture_indices[self.time]
+                texture_index = material_animation.texture_indices[frame]
             self.model.materials[material_animation.material_index].gl_texture_indices[0] = texture_index
 
 
@@ -61,13 +62,13 @@ def unpack(stream):
         raise FormatError('invalid magic')
 
     stream.seek(base + header.texture_index_selection_offset)
-    texture_index_selections = [TextureIndexSelection.unpack(stream) for _ in range(header.material_animation_count)]
+    texture_index_selections = TextureIndexSelection.unpack_array(stream, header.material_animation_count)
 
     stream.seek(base + header.texture_index_offset)
-    texture_indices = [uint16.unpack(stream) for _ in range(header.texture_index_count)]
+    texture_indices = uint16.unpack_array(stream, header.texture_index_count)
 
     stream.seek(base + header.material_index_offset)
-    material_indices = [uint16.unpack(stream) for _ in range(header.material_animation_count)]
+    material_indices = uint16.unpack_array(stream, header.material_animation_count)
 
     stream.seek(base + header.name_offset)
     names = j3d.string_table.unpack(stream)
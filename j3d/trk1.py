@@ -1,5 +1,5 @@
 from btypes.big_endian import *
-from j3d.animation import Animation,select_interpolater,IncompatibleAnimationError
+from j3d.animation import TrackAnimation,Tracks,IncompatibleAnimationError
 import j3d.string_table
 
 
@@ -41,7 +41,7 @@ class Selection(Struct):
     unknown0 = uint16
 
 
-class ColorAnimation(Struct):
+class ColorSelection(Struct):
     r = Selection
     g = Selection
     b = Selection
@@ -49,20 +49,20 @@ class ColorAnimation(Struct):
     unknown0 = uint8
     __padding__ = Padding(3)
 
+
+class ColorAnimation:
+
     def attach(self,color):
         self.color = color
 
-    def update(self,time):
-        self.color[0] = self.r.interpolate(time)/255
-        self.color[1] = self.g.interpolate(time)/255
-        self.color[2] = self.b.interpolate(time)/255
-        self.color[3] = self.a.interpolate(time)/255
-
 
-class TevColorAnimation(Animation):
+class TevColorAnimation(TrackAnimation):
     
-    def __init__(self,duration,loop_mode,register_color_animations,constant_color_animations):
-        super().__init__(duration,loop_mode)
+    def __init__(self,duration,loop_mode,register_color_animations,constant_color_animations,tracks):
+        # The tracks are the red, green, blue and alpha tracks, in that order,
+        # each with a track for every register color animation followed by every
+        # constant color animation
+        super().__init__(duration,loop_mode,tracks)
         self.register_color_animations = register_color_animations
         self.constant_color_animations = constant_color_animations
 
@@ -86,11 +86,9 @@ class TevColorAnimation(Animation):
         self.time = -1
 
     def update_model(self):
-        for color_animation in self.register_color_animations:
-            color_animation.update(self.time)
-
-        for color_animation in self.constant_color_animations:
-            color_animation.update(self.time)
+        colors = self.evaluate_tracks().reshape(4,-1).T/255
+        for color_animation,color in zip(self.register_color_animations + self.constant_color_animations,colors):
+            color_animation.color[:] = color
 
 
 def unpack(stream):
@@ -100,44 +98,42 @@ def unpack(stream):
         raise FormatError('invalid magic')
 
     stream.seek(base + header.register_color_animation_offset)
-    register_color_animations = [ColorAnimation.unpack(stream) for _ in range(header.register_color_animation_count)]
+    register_selections = read_array(stream, ColorSelection.numpy_dtype(), header.register_color_animation_count)
 
     stream.seek(base + header.constant_color_animation_offset)
-    constant_color_animations = [ColorAnimation.unpack(stream) for _ in range(header.constant_color_animation_count)]
+    constant_selections = read_array(stream, ColorSelection.numpy_dtype(), header.constant_color_animation_count)
 
     stream.seek(base + header.register_r_offset)
-    register_r = [sint16.unpack(stream) for _ in range(header.register_r_count)]
+    register_r = read_array(stream, sint16.numpy_dtype(), header.register_r_count)
 
     stream.seek(base + header.register_g_offset)
-    register_g = [sint16.unpack(stream) for _ in range(header.register_g_count)]
+    register_g = read_array(stream, sint16.numpy_dtype(), header.register_g_count)
 
     stream.seek(base + header.register_b_offset)
-    register_b = [sint16.unpack(stream) for _ in range(header.register_b_count)]
+    register_b = read_array(stream, sint16.numpy_dtype(), header.register_b_count)
 
     stream.seek(base + header.register_a_offset)
-    register_a = [sint16.unpack(stream) for _ in range(header.register_a_count)]
+    register_a = read_array(stream, sint16.numpy_dtype(), header.register_a_count)
 
     stream.seek(base + header.constant_r_offset)
-    constant_r = [sint16.unpack(stream) for _ in range(header.constant_r_count)]
+    constant_r = read_array(stream, sint16.numpy_dtype(), header.constant_r_count)
 
     stream.seek(base + header.constant_g_offset)
-    constant_g = [sint16.unpack(stream) for _ in range(header.constant_g_count)]
+    constant_g = read_array(stream, sint16.numpy_dtype(), header.constant_g_count)
 
     stream.seek(base + header.constant_b_offset)
-    constant_b = [sint16.unpack(stream) for _ in range(header.constant_b_count)]
+    constant_b = read_array(stream, sint16.numpy_dtype(), header.constant_b_count)
 
     stream.seek(base + header.constant_a_offset)
-    constant_a = [sint16.unpack(stream) for _ in range(header.constant_a_count)]
+    constant_a = read_array(stream, sint16.numpy_dtype(), header.constant_a_count)
 
     stream.seek(base + header.register_index_offset)
-    for index in range(header.register_color_animation_count):
-        if index != uint16.unpack(stream):
-            raise FormatError('invalid index')
+    if uint16.unpack_array(stream, header.register_color_animation_count) != list(range(header.register_color_animation_count)):
+        raise FormatError('invalid index')
 
     stream.seek(base + header.constant_index_offset)
-    for index in range(header.constant_color_animation_count):
-        if index != uint16.unpack(stream):
-            raise FormatError('invalid index')
+    if uint16.unpack_array(stream, header.constant_color_animation_count) != list(range(header.constant_color_animation_count)):
+        raise FormatError('invalid index')
 
     stream.seek(base + header.register_name_offset)
     register_names = j3d.string_table.unpack(stream)
@@ -145,20 +141,31 @@ def unpack(stream):
     stream.seek(base + header.constant_name_offset)
     constant_names = j3d.string_table.unpack(stream)
 
-    for color_animation,name in zip(register_color_animations,register_names):
-        color_animation.r = select_interpolater(color_animation.r,register_r)
-        color_animation.g = select_interpolater(color_animation.g,register_g)
-        color_animation.b = select_interpolater(color_animation.b,register_b)
-        color_animation.a = select_interpolater(color_animation.a,register_a)
+    register_color_animations = [ColorAnimation() for _ in range(header.register_color_animation_count)]
+
+    for color_animation,selection,name in zip(register_color_animations,register_selections,register_names):
+        color_animation.unknown0 = int(selection['unknown0'])
         color_animation.name = name
 
-    for color_animation,name in zip(constant_color_animations,constant_names):
-        color_animation.r = select_interpolater(color_animation.r,constant_r)
-        color_animation.g = select_interpolater(color_animation.g,constant_g)
-        color_animation.b = select_interpolater(color_animation.b,constant_b)
-        color_animation.a = select_interpolater(color_animation.a,constant_a)
+    constant_color_animations = [ColorAnimation() for _ in range(header.constant_color_animation_count)]
+
+    for color_animation,selection,name in zip(constant_color_animations,constant_selections,constant_names):
+        color_animation.unknown0 = int(selection['unknown0'])
         color_animation.name = name
 
+    tracks = Tracks.concatenate([
+        Tracks.concatenate((
+            Tracks.from_selections(register_selections[component],register_values),
+            Tracks.from_selections(constant_selections[component],constant_values)
+        ))
+        for component,register_values,constant_values in (
+            ('r',register_r,constant_r),
+            ('g',register_g,constant_g),
+            ('b',register_b,constant_b),
+            ('a',register_a,constant_a)
+        )
+    ])
+
     stream.seek(base + header.section_size)
-    return TevColorAnimation(header.duration,header.loop_mode,register_color_animations,constant_color_animations)
+    return TevColorAnimation(header.duration,header.loop_mode,register_color_animations,constant_color_animations,tracks)
 
@@ -1,8 +1,7 @@
-from math import cos,sin,radians
 import numpy
 from btypes.big_endian import *
 import gx
-from j3d.animation import Animation,select_interpolater,IncompatibleAnimationError
+from j3d.animation import TrackAnimation,Tracks,IncompatibleAnimationError
 import j3d.string_table
 
 
@@ -53,47 +52,48 @@ class MatrixAnimation:
         else:
             raise ValueError('invalid texture matrix shape')
 
-    def update(self,time):
-        scale_x = self.scale_x.interpolate(time)
-        scale_y = self.scale_y.interpolate(time)
-        scale_z = self.scale_z.interpolate(time)
-        rotation_x = self.rotation_x.interpolate(time)
-        rotation_y = self.rotation_y.interpolate(time)
-        rotation_z = self.rotation_z.interpolate(time)
-        translation_x = self.translation_x.interpolate(time)
-        translation_y = self.translation_y.interpolate(time)
-        translation_z = self.translation_z.interpolate(time)
-
-        cx = cos(radians(rotation_x))
-        sx = sin(radians(rotation_x))
-        cy = cos(radians(rotation_y))
-        sy = sin(radians(rotation_y))
-        cz = cos(radians(rotation_z))
-        sz = sin(radians(rotation_z))
-
-        R = numpy.matrix([[0,0,0,0],[0,0,0,0],[0,0,0,0],[0,0,0,1.0]]) #<-?
-        R[0,0] = cy*cz
-        R[0,1] = (sx*sy*cz - cx*sz)
-        R[0,2] = (cx*sy*cz + sx*sz)
-        R[1,0] = cy*sz
-        R[1,1] = (sx*sy*sz + cx*cz)
-        R[1,2] = (cx*sy*sz - sx*cz)
-        R[2,0] = -sy
-        R[2,1] = sx*cy
-        R[2,2] = cx*cy
-
-        S = numpy.matrix([[scale_x,0,0,0],[0,scale_y,0,0],[0,0,scale_z,0],[0,0,0,1]])
-        C = numpy.matrix([[1,0,0,self.center_x],[0,1,0,self.center_y],[0,0,1,self.center_z],[0,0,0,1]])
-        T = numpy.matrix([[1,0,0,translation_x],[0,1,0,translation_y],[0,0,1,translation_z],[0,0,0,1]])
-
-        self.texture_matrix[:] = (T*C*S*R*C.I)[:self.row_count,:]
-
-
-class TextureMatrixAnimation(Animation):
+
+def create_texture_matrices(scales,rotations,translations,centers):
+    """Create the 4x4 matrices T*C*S*R*C^-1 for (n,3) arrays of scales,
+    rotations in degrees, translations and centers, where S, R and T is the
+    scale, rotation and translation matrix respectively and C is the
+    translation matrix of the center."""
+    cx,cy,cz = numpy.cos(numpy.radians(rotations)).T
+    sx,sy,sz = numpy.sin(numpy.radians(rotations)).T
+
+    R = numpy.zeros((len(rotations),4,4))
+    R[:,0,0] = cy*cz
+    R[:,0,1] = (sx*sy*cz - cx*sz)
+    R[:,0,2] = (cx*sy*cz + sx*sz)
+    R[:,1,0] = cy*sz
+    R[:,1,1] = (sx*sy*sz + cx*cz)
+    R[:,1,2] = (cx*sy*sz - sx*cz)
+    R[:,2,0] = -sy
+    R[:,2,1] = sx*cy
+    R[:,2,2] = cx*cy
+    R[:,3,3] = 1
+
+    S = numpy.zeros((len(scales),4,4))
+    S[:,[0,1,2],[0,1,2]] = scales
+    S[:,3,3] = 1
+
+    C = numpy.tile(numpy.identity(4),(len(centers),1,1))
+    C[:,0:3,3] = centers
+
+    T = numpy.tile(numpy.identity(4),(len(translations),1,1))
+    T[:,0:3,3] = translations
+
+    return T @ C @ S @ R @ numpy.linalg.inv(C)
+
+
+class TextureMatrixAnimation(TrackAnimation):
     
-    def __init__(self,duration,loop_mode,texture_matrix_animations):
-        super().__init__(duration,loop_mode)
+    def __init__(self,duration,loop_mode,texture_matrix_animations,centers,tracks):
+        # The tracks are the scale, rotation and translation tracks, in that
+        # order, each with x, y and z tracks for every texture matrix animation
+        super().__init__(duration,loop_mode,tracks)
         self.texture_matrix_animations = texture_matrix_animations
+        self.centers = centers
 
     def attach(self,model):
         for texture_matrix_animation in self.texture_matrix_animations:
@@ -107,8 +107,10 @@ class TextureMatrixAnimation(Animation):
         self.time = -1
 
     def update_model(self):
-        for texture_matrix_animation in self.texture_matrix_animations:
-            texture_matrix_animation.update(self.time)
+        scales,rotations,translations = self.evaluate_tracks().reshape(3,len(self.texture_matrix_animations),3)
+        matrices = create_texture_matrices(scales,rotations,translations,self.centers)
+        for texture_matrix_animation,matrix in zip(self.texture_matrix_animations,matrices):
+            texture_matrix_animation.texture_matrix[:] = matrix[:texture_matrix_animation.row_count,:]
 
 
 def unpack(stream):
@@ -118,56 +120,44 @@ def unpack(stream):
         raise FormatError('invalid magic')
 
     stream.seek(base + header.component_animation_offset)
-    component_animations = [ComponentAnimation.unpack(stream) for _ in range(header.component_animation_count)]
+    component_animations = read_array(stream, ComponentAnimation.numpy_dtype(), header.component_animation_count)
 
     stream.seek(base + header.index_offset)
-    for index in range(header.component_animation_count//3):
-        if index != uint16.unpack(stream):
-            raise FormatError('invalid index')
+    if uint16.unpack_array(stream, header.component_animation_count//3) != list(range(header.component_animation_count//3)):
+        raise FormatError('invalid index')
 
     stream.seek(base + header.name_offset)
     names = j3d.string_table.unpack(stream)
 
     stream.seek(base + header.texture_matrix_index_offset)
-    texture_matrix_indices = [uint8.unpack(stream) for _ in range(header.component_animation_count//3)]
+    texture_matrix_indices = uint8.unpack_array(stream, header.component_animation_count//3)
 
     stream.seek(base + header.center_offset)
-    centers = [float32.unpack(stream) for _ in range(header.component_animation_count)]
+    centers = read_array(stream, float32.numpy_dtype(), header.component_animation_count).reshape(-1,3)
 
     stream.seek(base + header.scale_offset)
-    scales = [float32.unpack(stream) for _ in range(header.scale_count)]
+    scales = read_array(stream, float32.numpy_dtype(), header.scale_count)
 
     stream.seek(base + header.rotation_offset)
-    rotations = [sint16.unpack(stream) for _ in range(header.rotation_count)]
+    rotations = read_array(stream, sint16.numpy_dtype(), header.rotation_count)
 
     stream.seek(base + header.translation_offset)
-    translations = [float32.unpack(stream) for _ in range(header.translation_count)]
+    translations = read_array(stream, float32.numpy_dtype(), header.translation_count)
 
     angle_scale = 180/32767*2**header.angle_scale_exponent
 
-    for component_animation in component_animations:
-        component_animation.scale = select_interpolater(component_animation.scale_selection,scales)
-        component_animation.rotation = select_interpolater(component_animation.rotation_selection,rotations,angle_scale)
-        component_animation.translation = select_interpolater(component_animation.translation_selection,translations)
+    tracks = Tracks.concatenate((
+        Tracks.from_selections(component_animations['scale_selection'],scales,default_value=1),
+        Tracks.from_selections(component_animations['rotation_selection'],rotations,angle_scale),
+        Tracks.from_selections(component_animations['translation_selection'],translations)
+    ))
 
     texture_matrix_animations = [MatrixAnimation() for _ in range(header.component_animation_count//3)]
 
     for i,texture_matrix_animation in enumerate(texture_matrix_animations):
         texture_matrix_animation.material_name = names[i]
         texture_matrix_animation.texture_matrix_index = texture_matrix_indices[i]
-        texture_matrix_animation.center_x = centers[3*i]
-        texture_matrix_animation.center_y = centers[3*i + 1]
-        texture_matrix_animation.center_z = centers[3*i + 2]
-        texture_matrix_animation.scale_x = component_animations[3*i].scale
-        texture_matrix_animation.scale_y = component_animations[3*i + 1].scale
-        texture_matrix_animation.scale_z = component_animations[3*i + 2].scale
-        texture_matrix_animation.rotation_x = component_animations[3*i].rotation
-        texture_matrix_animation.rotation_y = component_animations[3*i + 1].rotation
-        texture_matrix_animation.rotation_z = component_animations[3*i + 2].rotation
-        texture_matrix_animation.translation_x = component_animations[3*i].translation
-        texture_matrix_animation.translation_y = component_animations[3*i + 1].translation
-        texture_matrix_animation.translation_z = component_animations[3*i + 2].translation
 
     stream.seek(base + header.section_size)
-    return TextureMatrixAnimation(header.duration,header.loop_mode,texture_matrix_animations)
+    return TextureMatrixAnimation(header.duration,header.loop_mode,texture_matrix_animations,centers,tracks)
 
@@ -35,11 +35,12 @@ class ShapeVisibilityAnimation(Animation):
         self.model = model
 
     def update_model(self):
+        frame = int(self.time)
         for shape,shape_animation in zip(self.model.shapes,self.shape_animations):
-            if self.time >= len(shape_animation.shows):
+            if frame >= len(shape_animation.shows):
                 show = shape_animation.shows[-1]
             else:
-                show = shape_animation.shows[self.time]
+                show = shape_animation.shows[frame]
             shape.hide = not show
 
 
@@ -50,10 +51,10 @@ def unpack(stream):
         raise FormatError('invalid magic')
 
     stream.seek(base + header.show_selection_offset)
-    show_selections = [ShowSelection.unpack(stream) for _ in range(header.shape_animation_count)]
+    show_selections = ShowSelection.unpack_array(stream, header.shape_animation_count)
 
     stream.seek(base + header.show_offset)
-    shows = [bool8.unpack(stream) for _ in range(header.show_count)]
+    shows = bool8.unpack_array(stream, header.show_count)
 
     shape_animations = [ShapeAnimation() for _ in range(header.shape_animation_count)]
 
@@ -155,15 +155,25 @@ class Array(numpy.ndarray):
         self.component_count = obj.component_count
         self.scale_exponent = obj.scale_exponent
 
+    def __reduce__(self):
+        attributes = (self.attribute, self.component_type, self.component_count, self.scale_exponent)
+        return self.unpickle, (self.view(numpy.ndarray), attributes)
+
+    @classmethod
+    def unpickle(cls, array, attributes):
+        array = array.view(cls)
+        array.attribute, array.component_type, array.component_count, array.scale_exponent = attributes
+        return array
+
     @staticmethod
     def pack(stream, array):
-        array.tofile(stream)
+        write_array(stream, array)
 
     @classmethod
     def unpack(cls, stream, attribute_format, size):
         element_type = get_element_type(attribute_format)
         element_count = size//element_type.itemsize
-        array = numpy.fromfile(stream, element_type, element_count).view(cls)
+        array = read_array(stream, element_type, element_count).view(cls)
         array.attribute = attribute_format.attribute
         array.component_type = attribute_format.component_type
         array.component_count = attribute_format.component_count
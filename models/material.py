@@ -2,6 +2,7 @@ from collections import OrderedDict
 import logging
 import numpy
 from OpenGL.GL import *
+from btypes import BufferStream
 import gl
 import gx
 import j3d.material_archive
@@ -431,6 +432,9 @@ class Material(WrapperModel):
             yield self.indirect_stages[i]
 
     def handle_event(self, event, path):
+        # Any change to the material or its textures invalidates the cached
+        # MDL3 packet
+        self.wrapped_object.mdl3_packet = None
         if isinstance(event, ValueChangedEvent):
             if path in self.block_info.trigger_table:
                 block_property = self.block_info.trigger_table[path]
@@ -667,8 +671,7 @@ class MaterialArchive:
 
     @staticmethod
     def load(file_path):
-        with open(file_path, 'rb') as stream:
-            material_archive = j3d.material_archive.unpack(stream)
+        material_archive = j3d.material_archive.unpack(BufferStream.from_file(file_path))
         materials = list(map(Material, material_archive.materials))
         textures = list(map(models.texture.Texture, material_archive.textures))
         material_archive = MaterialArchive(materials, textures)
@@ -1,11 +1,15 @@
-import copy
+import os
+import shutil
 import numpy
 from OpenGL.GL import *
+from btypes import BufferStream
 import gl
 import gx
-from j3d.inf1 import NodeType
+from j3d.inf1 import NodeType, NodeArrays
+import j3d.jnt1
 from j3d.drw1 import MatrixType
 import j3d.model
+from modelview.path import AttributePathFragment
 from modelview.object_model import ReferenceAttribute, ReferenceList
 from modelview.wrapper_model import (
     WrapperModel,
@@ -18,12 +22,27 @@ import models.texture
 import models.vertex_shader
 
 
-def matrix3x4_array_multiply(a,b):
-    c = numpy.empty(a.shape,numpy.float32)
-    numpy.einsum('ijk,ikl->ijl',a[:,:,:3],b[:,:,:3],out=c[:,:,:3])
-    numpy.einsum('ijk,ik->ij',a[:,:,:3],b[:,:,3],out=c[:,:,3])
-    c[:,:,3] += a[:,:,3]
-    return c
+def get_range_positions(starts,sizes):
+    """Return the positions of the elements of the ranges
+    [start, start + size), laid out range after range."""
+    ends = numpy.cumsum(sizes)
+    return numpy.arange(ends[-1] if len(ends) else 0) - numpy.repeat(ends - sizes - starts,sizes)
+
+
+def create_reverse_index(keys,values,key_count):
+    """Group values by key, as a pair of an offset array and a value array."""
+    offsets = numpy.zeros(key_count + 1,numpy.intp)
+    numpy.cumsum(numpy.bincount(keys,minlength=key_count),out=offsets[1:])
+    return offsets,values[numpy.argsort(keys,kind='stable')]
+
+
+def lookup_reverse_index(reverse_index,selection):
+    """Return the sorted unique values of the keys selected by a boolean
+    array."""
+    offsets,values = reverse_index
+    keys = numpy.flatnonzero(selection)
+    positions = get_range_positions(offsets[keys],offsets[keys + 1] - offsets[keys])
+    return numpy.unique(values[positions])
 
 
 class GLMatrixIndexArray:
@@ -39,14 +58,13 @@ class GLMatrixIndexArray:
         matrix_table = numpy.zeros(10,numpy.uint32)
 
         for batch in shape.batches:
-            source = numpy.concatenate([primitive.vertices[gx.VA_PTNMTXIDX.name] for primitive in batch.primitives])
-            source //= 3
+            source = batch.vertices[gx.VA_PTNMTXIDX.name]//3
 
             for i,index in enumerate(batch.matrix_table):
                 if index == 0xFFFF: continue
                 matrix_table[i] = index
 
-            length = sum(len(primitive.vertices) for primitive in batch.primitives)
+            length = len(batch.vertices)
             numpy.take(matrix_table,source,0,destination[vertex_index:vertex_index + length])
             vertex_index += length
 
@@ -66,7 +84,7 @@ class GLDirectArray:
         return (self.attribute.name, numpy.uint32)
 
     def load(self, shape, vertex_array):
-        vertex_array[self.attribute.name] = numpy.concatenate([primitive.vertices[self.attribute.name] for primitive in shape.primitives])
+        vertex_array[self.attribute.name] = numpy.concatenate([batch.vertices[self.attribute.name] for batch in shape.batches])
 
 
 class GLArray(numpy.ndarray):
@@ -75,7 +93,7 @@ class GLArray(numpy.ndarray):
         return (self.attribute.name,self.dtype,self.shape[1])
 
     def load(self,shape,vertex_array):
-        index_array = numpy.concatenate([primitive.vertices[self.attribute.name] for primitive in shape.primitives])
+        index_array = numpy.concatenate([batch.vertices[self.attribute.name] for batch in shape.batches])
         numpy.take(self,index_array,0,vertex_array[self.attribute.name])
         location = models.vertex_shader.ATTRIBUTE_LOCATION_TABLE[self.attribute]
         glEnableVertexAttribArray(location)
@@ -140,6 +158,56 @@ def gl_convert_color_array(source):
     return destination
 
 
+# Sections that have to be packed again when a model attribute changes. The
+# INF1 section also stores the vertex position count and the shape batch
+# count, and the MDL3 section is generated from the materials and textures.
+ATTRIBUTE_SECTIONS = {
+    'file_type': set(),
+    'subversion': set(),
+    'scene_graph': {b'INF1'},
+    'position_array': {b'VTX1', b'INF1'},
+    'normal_array': {b'VTX1'},
+    'color_arrays': {b'VTX1'},
+    'texcoord_arrays': {b'VTX1'},
+    'influence_groups': {b'EVP1'},
+    'inverse_bind_matrices': {b'EVP1'},
+    'matrix_definitions': {b'DRW1'},
+    'joints': {b'JNT1'},
+    'shapes': {b'SHP1', b'INF1'},
+    'materials': {b'MAT3', b'MDL3'},
+    'textures': {b'TEX1'}
+}
+
+
+def get_changed_sections(path):
+    """Get the sections that have to be packed again after an event.
+
+    :param path: Path of the event, relative to the model.
+    :return: Set of section magics.
+    """
+    name = path[0].name
+    if name == 'scene_graph':
+        # Material nodes listen to the material they reference, so events
+        # from inside the materials also arrive through the scene graph
+        if AttributePathFragment('material') in path[:-1]:
+            return set()
+    elif name == 'materials':
+        # Inserting or removing materials changes the material indices in
+        # the scene graph
+        if len(path) == 1:
+            return {b'MAT3', b'MDL3', b'INF1'}
+        # Events from inside the textures referenced by a material only
+        # affect the MDL3 packet of the material
+        if len(path) > 4 and path[2] == AttributePathFragment('textures'):
+            return {b'MDL3'}
+    elif name == 'textures':
+        # Inserting or removing textures changes the texture indices in the
+        # materials
+        if len(path) == 1:
+            return {b'TEX1', b'MAT3', b'MDL3'}
+    return ATTRIBUTE_SECTIONS[name]
+
+
 class SceneGraphNode(WrapperModel):
 
     @staticmethod
@@ -191,7 +259,18 @@ class Model(WrapperModel):
     def __init__(self, wrapped_object):
         super().__init__(wrapped_object)
         self.file_path = None
+        self.original_buffer = None
+        self.original_sections = {}
+        self.changed_sections = set()
+        self.node_arrays = None
+        self.draw_list = None
+        # Initializing the references emits events, which should neither
+        # count as changes nor invalidate the cached MDL3 packets
+        mdl3_packets = [material.wrapped_object.mdl3_packet for material in self.materials]
         self.init_references()
+        for material, mdl3_packet in zip(self.materials, mdl3_packets):
+            material.wrapped_object.mdl3_packet = mdl3_packet
+        self.changed_sections.clear()
 
     file_type = _attribute()
     subversion = _attribute()
@@ -220,35 +299,170 @@ class Model(WrapperModel):
         for shape in self.shapes:
             shape.gl_init(array_table)
 
-        self.gl_joints = [copy.copy(joint) for joint in self.joints]
+        self.gl_joint_scales = numpy.array([(joint.scale_x,joint.scale_y,joint.scale_z) for joint in self.joints],numpy.float64).reshape(-1,3)
+        self.gl_joint_rotations = numpy.array([(joint.rotation_x,joint.rotation_y,joint.rotation_z) for joint in self.joints],numpy.float64).reshape(-1,3)
+        self.gl_joint_translations = numpy.array([(joint.translation_x,joint.translation_y,joint.translation_z) for joint in self.joints],numpy.float64).reshape(-1,3)
         self.gl_joint_matrices = numpy.empty((len(self.joints),3,4),numpy.float32)
+        self.gl_joint_dirty = numpy.ones(len(self.joints),bool)
+        self.gl_init_joint_hierarchy()
         self.gl_matrix_table = self.gl_create_resource(gl.TextureBuffer, GL_DYNAMIC_DRAW,GL_RGBA32F,(len(self.matrix_definitions),3,4),numpy.float32)
+        self.gl_init_matrix_table_indices()
         self.gl_update_matrix_table()
 
-    def gl_update_joint_matrices(self,node,parent_joint=None,parent_joint_matrix=numpy.eye(3,4,dtype=numpy.float32)):
-        for child in node.children:
-            if child.node_type == NodeType.JOINT:
-                joint = self.gl_joints[child.index]
-                joint_matrix = self.gl_joint_matrices[child.index]
-                joint_matrix[:] = joint.create_matrix(parent_joint,parent_joint_matrix)
-                self.gl_update_joint_matrices(child,joint,joint_matrix)
+    def gl_init_joint_hierarchy(self):
+        """Flatten the joint hierarchy of the scene graph.
+
+        The joints are grouped by depth into levels, each level holding the
+        indices of its joints and of their parent joints, so that the joint
+        matrices can be computed one level at a time. Root joints have parent
+        index -1.
+        """
+        node_arrays = self.get_node_arrays()
+        positions = node_arrays.find(NodeType.JOINT)
+        parent_positions = node_arrays.get_nearest_ancestors(NodeType.JOINT)[positions]
+        joint_indices = node_arrays.indices[positions]
+        joint_parent_indices = numpy.where(parent_positions != -1,node_arrays.indices[parent_positions],-1)
+        joint_depths = node_arrays.count_ancestors(NodeType.JOINT)[positions]
+
+        parent_indices = numpy.full(len(self.joints),-1,numpy.intp)
+        parent_indices[joint_indices] = joint_parent_indices
+
+        self.gl_joint_levels = []
+        for depth in range(joint_depths.max() + 1 if len(joint_depths) else 0):
+            selection = joint_depths == depth
+            self.gl_joint_levels.append((joint_indices[selection],joint_parent_indices[selection]))
+
+        ignore_parent_scale = numpy.array([joint.ignore_parent_scale for joint in self.joints],bool).reshape(-1)
+        ignore_parent_scale &= parent_indices != -1
+        self.gl_ips_joint_indices = numpy.flatnonzero(ignore_parent_scale)
+        self.gl_ips_parent_indices = parent_indices[self.gl_ips_joint_indices]
+
+    def gl_set_joint_transforms(self,scales,rotations,translations):
+        """Set the scales, rotations and translations of the joints.
+
+        Joints whose values change are marked as dirty, so that only their
+        subtrees are recomputed by the next matrix table update.
+        """
+        self.gl_joint_dirty |= (scales != self.gl_joint_scales).any(axis=1)
+        self.gl_joint_dirty |= (rotations != self.gl_joint_rotations).any(axis=1)
+        self.gl_joint_dirty |= (translations != self.gl_joint_translations).any(axis=1)
+        self.gl_joint_scales[:] = scales
+        self.gl_joint_rotations[:] = rotations
+        self.gl_joint_translations[:] = translations
+
+    def gl_update_joint_matrices(self):
+        """Recompute the matrices of the dirty joints and their descendants.
+
+        Returns a boolean array marking the joints whose matrices were
+        recomputed.
+        """
+        updated = self.gl_joint_dirty.copy()
+        for joint_indices,parent_indices in self.gl_joint_levels[1:]:
+            updated[joint_indices] |= updated[parent_indices]
+        self.gl_joint_dirty[:] = False
+        if not updated.any():
+            return updated
+
+        inverse_parent_scales = numpy.ones((len(self.joints),3),numpy.float64)
+        inverse_parent_scales[self.gl_ips_joint_indices] = 1/self.gl_joint_scales[self.gl_ips_parent_indices]
+        local_matrices = numpy.empty((len(self.joints),3,4),numpy.float32)
+        local_matrices[updated] = j3d.jnt1.create_local_matrices(
+                self.gl_joint_scales[updated],
+                self.gl_joint_rotations[updated],
+                self.gl_joint_translations[updated],
+                inverse_parent_scales[updated])
+
+        for depth,(joint_indices,parent_indices) in enumerate(self.gl_joint_levels):
+            selection = updated[joint_indices]
+            if not selection.any():
+                continue
+            joint_indices = joint_indices[selection]
+            if depth == 0:
+                self.gl_joint_matrices[joint_indices] = local_matrices[joint_indices]
             else:
-                self.gl_update_joint_matrices(child,parent_joint,parent_joint_matrix)
+                parent_indices = parent_indices[selection]
+                self.gl_joint_matrices[joint_indices] = j3d.jnt1.matrix3x4_array_multiply(self.gl_joint_matrices[parent_indices],local_matrices[joint_indices])
 
-    def gl_update_matrix_table(self):
-        self.gl_update_joint_matrices(self.scene_graph)
+        return updated
+
+    def gl_init_matrix_table_indices(self):
+        """Precompute the index arrays used to fill the matrix table.
 
-        if self.inverse_bind_matrices is not None:
-            influence_matrices = matrix3x4_array_multiply(self.gl_joint_matrices,self.inverse_bind_matrices)
+        Rows of joint matrices are gathered directly from the joint matrices.
+        Rows of influence groups are weighted sums of influence matrices, with
+        the influences of each row stored contiguously, so that the sums can
+        be computed with numpy.add.reduceat.
 
-        for matrix,matrix_definition in zip(self.gl_matrix_table,self.matrix_definitions):
+        Reverse indices from joints to the joint rows and influence rows that
+        depend on them are used to only update the rows of changed joints.
+        """
+        influence_groups = self.influence_groups
+
+        joint_rows = []
+        joint_indices = []
+        influence_rows = []
+        group_indices = []
+        for i, matrix_definition in enumerate(self.matrix_definitions):
             if matrix_definition.matrix_type == MatrixType.JOINT:
-                matrix[:] = self.gl_joint_matrices[matrix_definition.index]
+                joint_rows.append(i)
+                joint_indices.append(matrix_definition.index)
             elif matrix_definition.matrix_type == MatrixType.INFLUENCE_GROUP:
-                influence_group = self.influence_groups[matrix_definition.index]
-                matrix[:] = sum(influence.weight*influence_matrices[influence.index] for influence in influence_group)
+                influence_rows.append(i)
+                group_indices.append(matrix_definition.index)
             else:
-                ValueError('invalid matrix type')
+                raise ValueError('invalid matrix type')
+
+        self.gl_joint_rows = numpy.array(joint_rows, numpy.intp)
+        self.gl_joint_indices = numpy.array(joint_indices, numpy.intp)
+
+        group_indices = numpy.array(group_indices, numpy.intp)
+        group_sizes = influence_groups.group_sizes[group_indices].astype(numpy.intp)
+        group_starts = influence_groups.group_offsets[group_indices].astype(numpy.intp)
+        influence_rows = numpy.array(influence_rows, numpy.intp)
+
+        # Rows of empty influence groups are zero, and never change
+        self.gl_matrix_table[influence_rows[group_sizes == 0]] = 0
+        nonempty = group_sizes > 0
+        self.gl_influence_rows = influence_rows[nonempty]
+
+        # Positions of the influences of each row in the CSR arrays, laid out
+        # row after row
+        positions = get_range_positions(group_starts, group_sizes)
+        self.gl_influence_sizes = group_sizes[nonempty]
+        self.gl_influence_starts = numpy.cumsum(self.gl_influence_sizes) - self.gl_influence_sizes
+        self.gl_influence_joint_indices = influence_groups.joint_indices[positions].astype(numpy.intp)
+        self.gl_influence_weights = influence_groups.weights[positions].astype(numpy.float32).reshape(-1, 1, 1)
+
+        joint_count = len(self.joints)
+        self.gl_joint_row_index = create_reverse_index(
+                self.gl_joint_indices,
+                numpy.arange(len(self.gl_joint_rows)),
+                joint_count)
+        self.gl_joint_influence_row_index = create_reverse_index(
+                self.gl_influence_joint_indices,
+                numpy.repeat(numpy.arange(len(self.gl_influence_rows)), self.gl_influence_sizes),
+                joint_count)
+
+    def gl_update_matrix_table(self):
+        updated = self.gl_update_joint_matrices()
+        if not updated.any():
+            return
+
+        # Indices into the joint rows and influence rows that depend on the
+        # updated joints
+        joint_rows = lookup_reverse_index(self.gl_joint_row_index, updated)
+        influence_rows = lookup_reverse_index(self.gl_joint_influence_row_index, updated)
+
+        if len(joint_rows) > 0:
+            self.gl_matrix_table[self.gl_joint_rows[joint_rows]] = self.gl_joint_matrices[self.gl_joint_indices[joint_rows]]
+
+        if len(influence_rows) > 0:
+            sizes = self.gl_influence_sizes[influence_rows]
+            positions = get_range_positions(self.gl_influence_starts[influence_rows], sizes)
+            joint_indices = self.gl_influence_joint_indices[positions]
+            weighted_matrices = j3d.jnt1.matrix3x4_array_multiply(self.gl_joint_matrices[joint_indices], self.inverse_bind_matrices[joint_indices])
+            weighted_matrices *= self.gl_influence_weights[positions]
+            self.gl_matrix_table[self.gl_influence_rows[influence_rows]] = numpy.add.reduceat(weighted_matrices, numpy.cumsum(sizes) - sizes)
 
     def gl_draw_shape(self, material, shape):
         if shape.gl_hide: return
@@ -256,45 +470,159 @@ class Model(WrapperModel):
         shape.gl_bind()
         shape.gl_draw()
 
-    def gl_draw_node(self, node, parent_material=None):
-        for child in node.children:
-            if child.node_type == NodeType.SHAPE:
-                if parent_material.unknown0 == 1:
-                    self.gl_draw_shape(parent_material, self.shapes[child.index])
-                self.gl_draw_node(child, parent_material)
-                if parent_material.unknown0 == 4:
-                    self.gl_draw_shape(parent_material, self.shapes[child.index])
-            elif child.node_type == NodeType.MATERIAL:
-                self.gl_draw_node(child, child.material)
-            else:
-                self.gl_draw_node(child, parent_material)
-
     def gl_draw(self):
         self.gl_matrix_table.bind_texture(models.material.MATRIX_TABLE_TEXTURE_UNIT)
-        self.gl_draw_node(self.scene_graph)
+        for material, shape in self.get_draw_list():
+            self.gl_draw_shape(material, shape)
+
+    def handle_event(self, event, path):
+        if path:
+            self.changed_sections.update(get_changed_sections(path))
+            if path[0].name in {'scene_graph', 'materials', 'shapes'}:
+                self.node_arrays = None
+                self.draw_list = None
+        super().handle_event(event, path)
+
+    def get_node_arrays(self):
+        """Get the flattened scene graph.
+
+        The arrays are cached, and rebuilt after the scene graph, materials or
+        shapes change. The indices of material nodes are the indices of the
+        referenced materials, or -1 if they are not in the material list.
+        """
+        if self.node_arrays is None:
+            material_indices = {id(material) : i for i, material in enumerate(self.materials)}
+
+            def get_index(node):
+                if node.node_type != NodeType.MATERIAL:
+                    return node.index
+                material = getattr(node, 'material', None)
+                if material is None:
+                    return node.wrapped_object.index
+                return material_indices.get(id(material), -1)
+
+            self.node_arrays = NodeArrays.from_nodes(self.scene_graph.children, get_index)
+        return self.node_arrays
+
+    def get_draw_list(self):
+        """Get the material and shape pairs in the order they are drawn.
+
+        Shapes are drawn with the material of their nearest material ancestor.
+        If the unknown0 field of the material is 1, the shape is drawn before
+        its descendants, and if it is 4, after them.
+        """
+        if self.draw_list is None:
+            node_arrays = self.get_node_arrays()
+            shape_positions = node_arrays.find(NodeType.SHAPE)
+            material_positions = node_arrays.get_nearest_ancestors(NodeType.MATERIAL)[shape_positions]
+            subtree_ends = node_arrays.get_subtree_ends()[shape_positions]
+            draw_modes = numpy.array([
+                node_arrays.nodes[position].material.unknown0 if position != -1 else 0
+                for position in material_positions.tolist()
+            ], numpy.intp)
+            before = numpy.flatnonzero(draw_modes == 1)
+            after = numpy.flatnonzero(draw_modes == 4)
+
+            # Shapes drawn after their descendants are drawn when the traversal
+            # leaves their subtree, before the next node is entered. Subtrees
+            # left at the same time are left innermost first.
+            times = numpy.concatenate((shape_positions[before], subtree_ends[after]))
+            phases = numpy.concatenate((numpy.ones(len(before), numpy.intp), numpy.zeros(len(after), numpy.intp)))
+            depths = numpy.concatenate((numpy.zeros(len(before), numpy.intp), -node_arrays.depths[shape_positions[after]]))
+            order = numpy.concatenate((before, after))[numpy.lexsort((depths, phases, times))]
+
+            self.draw_list = [
+                (node_arrays.nodes[material_position].material, self.shapes[shape_index])
+                for material_position, shape_index in zip(
+                    material_positions[order].tolist(),
+                    node_arrays.indices[shape_positions[order]].tolist()
+                )
+            ]
+        return self.draw_list
+
+    def set_original(self, buffer, sections):
+        """Set the file data the model was loaded from or last saved to.
+
+        Sections that have not changed since are copied from this data when
+        the model is saved, instead of being packed again. The data is kept
+        for as long as the model is in use. If the model was loaded with mmap,
+        it is the mapping of the file, which only takes memory for the pages
+        that have been read. Otherwise, and after the model has been saved, it
+        is a copy of the whole file in memory.
+        """
+        self.original_buffer = buffer
+        self.original_sections = {section.magic : section for section in sections}
+        self.changed_sections.clear()
+
+    def get_reused_sections(self):
+        if self.original_buffer is None:
+            return {}
+        buffer = memoryview(self.original_buffer)
+        return {
+            magic : buffer[section.offset : section.offset + section.size]
+            for magic, section in self.original_sections.items()
+            if magic not in self.changed_sections
+        }
 
     @staticmethod
-    def load(file_path):
-        with open(file_path, 'rb') as stream:
-            model = j3d.model.unpack(stream)
-        model = Model(model)
+    def load(file_path, mmap=False):
+        """Load a model from a file.
+
+        If mmap is true, the file is memory mapped and vertex arrays, images,
+        palettes and inverse bind matrices are copy-on-write views on the
+        mapping, for as long as the model is in use. The file must then not be
+        truncated or written to in place by other programs. Saving the model,
+        also to the same path, is safe, as save replaces the file instead of
+        writing to it.
+        """
+        stream = BufferStream.from_file(file_path, mmap)
+        model = Model(j3d.model.unpack(stream))
         model.file_path = file_path
+        model.set_original(stream.buffer, model.wrapped_object.sections.values())
         return model
 
     def save(self, file_path):
+        """Save the model to a file.
+
+        Only the sections that have changed since the model was loaded or last
+        saved are packed, the others are copied from the original file data.
+        """
         self.file_path = file_path
         self.sync_reference_indices()
-        with open(file_path, 'wb') as stream:
-            j3d.model.pack(stream, self.wrapped_object)
+        buffer = j3d.model.pack_buffer(self.wrapped_object, reused_sections=self.get_reused_sections())
+
+        # The model may have been loaded memory mapped from the same file, in
+        # which case arrays of the model are views on the mapping. Truncating
+        # and rewriting the file would change those arrays, so the file is
+        # written to a temporary file that then replaces it. The mapping keeps
+        # referring to the replaced file. Symbolic links are resolved, so that
+        # the file they point to is replaced instead of the link, and the
+        # permissions of the replaced file are kept.
+        file_path = os.path.realpath(file_path)
+        temporary_path = '{}.{}.tmp'.format(file_path, os.getpid())
+        try:
+            with open(temporary_path, 'wb') as stream:
+                stream.write(buffer)
+            if os.path.exists(file_path):
+                shutil.copymode(file_path, temporary_path)
+            os.replace(temporary_path, file_path)
+        except BaseException:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+
+        stream = BufferStream(buffer)
+        header = j3d.model.Header.unpack(stream)
+        self.set_original(buffer, j3d.model.unpack_section_directory(stream, header))
 
     def init_references(self):
         """Initialize references.
 
         Initialize references into the material and texture lists.
         """
-        for node in self.scene_graph.all_nodes():
-            if node.node_type == NodeType.MATERIAL:
-                node.material = self.materials[node.wrapped_object.index]
+        node_arrays = self.get_node_arrays()
+        for position in node_arrays.find(NodeType.MATERIAL).tolist():
+            node_arrays.nodes[position].material = self.materials[node_arrays.indices[position]]
 
         for material in self.materials:
             material.textures = ReferenceList(
@@ -309,9 +637,12 @@ class Model(WrapperModel):
         automatically kept in sync. This method needs to be manually called to
         synchronize the reference indices.
         """
-        for node in self.scene_graph.all_nodes():
-            if node.node_type == NodeType.MATERIAL:
-                node.wrapped_object.index = self.materials.index(node.material)
+        node_arrays = self.get_node_arrays()
+        for position in node_arrays.find(NodeType.MATERIAL).tolist():
+            material_index = int(node_arrays.indices[position])
+            if material_index == -1:
+                raise ValueError('material is not in the material list')
+            node_arrays.nodes[position].wrapped_object.index = material_index
 
         for material in self.materials:
             for i, texture in enumerate(material.textures):
@@ -326,12 +657,10 @@ class Model(WrapperModel):
         :param material_index: Index of the material in the material list.
         :return: List of the scene graph nodes that use the material.
         """
-        material = self.materials[material_index]
-        nodes = []
-        for node in self.scene_graph.all_nodes():
-            if node.node_type == NodeType.MATERIAL and node.material == material:
-                nodes.append(node)
-        return nodes
+        node_arrays = self.get_node_arrays()
+        material_index = range(len(self.materials))[material_index]
+        positions = node_arrays.find(NodeType.MATERIAL, material_index)
+        return [node_arrays.nodes[position] for position in positions.tolist()]
 
     def get_materials_using_texture(self, texture_index):
         """Get materials that use a given texture.
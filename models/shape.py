@@ -102,7 +102,7 @@ class Shape(WrapperModel):
         glBindBuffer(GL_ELEMENT_ARRAY_BUFFER,self.gl_element_buffer)
 
         vertex_type =  numpy.dtype([array_table[attribute].field() for attribute in self.attributes])
-        vertex_count = sum(len(primitive.vertices) for primitive in self.primitives)
+        vertex_count = sum(len(batch.vertices) for batch in self.batches)
         vertex_array = numpy.empty(vertex_count,vertex_type)
 
         for attribute in self.attributes:
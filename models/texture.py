@@ -1,6 +1,7 @@
 import os
 import numpy
 from OpenGL.GL import *
+from btypes import BufferStream
 import gl
 import gx
 import gx.bti
@@ -217,8 +218,7 @@ class Texture(WrapperModel):
 
     @staticmethod
     def load(file_path):
-        with open(file_path, 'rb') as stream:
-            texture = gx.bti.unpack(stream)
+        texture = gx.bti.unpack(BufferStream.from_file(file_path))
         texture.name = os.path.splitext(os.path.basename(file_path))[0]
         return Texture(texture)
 
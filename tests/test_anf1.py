@@ -0,0 +1,52 @@
+import unittest
+import numpy
+from btypes import BufferStream
+import j3d.anf1
+
+
+def create_animation(counts):
+    counts = numpy.array(counts, numpy.intp).reshape(3, 3)
+    firsts = numpy.zeros((3, 3), numpy.intp)
+    scales = numpy.array([2], numpy.float32)
+    rotations = numpy.array([100], numpy.int16)
+    translations = numpy.array([5], numpy.float32)
+    return j3d.anf1.FullSkeletalAnimation(0, 0, counts, firsts, scales, rotations, translations)
+
+
+class TestCreateTable(unittest.TestCase):
+
+    def test_too_many_frames(self):
+        values = numpy.arange(0x10000, dtype=numpy.float32).reshape(1, -1)
+        with self.assertRaises(ValueError):
+            j3d.anf1.create_table(values, numpy.float32)
+
+    def test_constant_components(self):
+        values = numpy.array([[1, 1, 1], [0, 1, 2], [1, 1, 1]])
+        counts, firsts, table = j3d.anf1.create_table(values, numpy.float32)
+        self.assertEqual(counts.tolist(), [1, 3, 1])
+        self.assertEqual(firsts[0], firsts[2])
+        self.assertEqual(table[firsts[0]], 1)
+        numpy.testing.assert_array_equal(table[firsts[1]:firsts[1] + counts[1]], [0, 1, 2])
+
+
+class TestUnpack(unittest.TestCase):
+
+    def roundtrip(self, animation):
+        stream = BufferStream(bytearray())
+        j3d.anf1.pack(stream, animation)
+        stream.seek(0)
+        return j3d.anf1.unpack(stream)
+
+    def test_empty_selections_take_default_values(self):
+        animation = create_animation([0, 1, 1, 1, 0, 1, 1, 1, 0])
+        with self.assertLogs('j3d.anf1', 'WARNING'):
+            animation = self.roundtrip(animation)
+        self.assertEqual((animation.counts == 0).sum(), 0)
+        positions = animation.firsts
+        self.assertEqual(animation.scales[positions[0]].tolist(), [1, 2, 2])
+        self.assertEqual(animation.rotations[positions[1]].tolist(), [100, 0, 100])
+        self.assertEqual(animation.translations[positions[2]].tolist(), [5, 5, 0])
+
+
+if __name__ == '__main__':
+    unittest.main()
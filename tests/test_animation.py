@@ -0,0 +1,40 @@
+import unittest
+import unittest.mock
+import numpy
+import j3d.animation
+from j3d.animation import Tracks, TrackAnimation
+
+
+SELECTION_DTYPE = [('count', '>u2'), ('first', '>u2'), ('unknown0', '>u2')]
+
+
+class TestTracks(unittest.TestCase):
+
+    def test_empty_selections_take_default_value(self):
+        selections = numpy.array([(0, 0, 0), (1, 1, 0), (2, 2, 0), (0, 0, 0)], SELECTION_DTYPE)
+        array = [9, 7, 0, 1, 0, 10, 3, 0]
+        with self.assertLogs('j3d.animation', 'WARNING'):
+            tracks = Tracks.from_selections(selections, array, 2, default_value=1)
+        numpy.testing.assert_allclose(tracks.evaluate(0), [1, 14, 2, 1])
+        numpy.testing.assert_allclose(tracks.evaluate(10), [1, 14, 6, 1])
+
+
+class TestCacheName(unittest.TestCase):
+
+    def create_animation(self, duration, track_count):
+        selections = numpy.array([(1, 0, 0)]*track_count, SELECTION_DTYPE)
+        return TrackAnimation(duration, 0, Tracks.from_selections(selections, [0]))
+
+    def test_cache_name(self):
+        animation = self.create_animation(10, 3)
+        name = j3d.animation.get_cache_name(b'data', animation)
+        self.assertEqual(j3d.animation.get_cache_name(b'data', self.create_animation(10, 3)), name)
+        self.assertNotEqual(j3d.animation.get_cache_name(b'other data', animation), name)
+        self.assertNotEqual(j3d.animation.get_cache_name(b'data', self.create_animation(11, 3)), name)
+        self.assertNotEqual(j3d.animation.get_cache_name(b'data', self.create_animation(10, 4)), name)
+        with unittest.mock.patch.object(j3d.animation, 'CACHE_FORMAT_VERSION', j3d.animation.CACHE_FORMAT_VERSION + 1):
+            self.assertNotEqual(j3d.animation.get_cache_name(b'data', animation), name)
+
+
+if __name__ == '__main__':
+    unittest.main()
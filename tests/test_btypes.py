@@ -0,0 +1,137 @@
+import enum
+import io
+import unittest
+from btypes.big_endian import *
+from btypes import BufferStream
+
+
+class Color(enum.IntEnum):
+    RED = 0
+    GREEN = 1
+    BLUE = 2
+
+
+class Inner(Struct):
+    a = uint16
+    b = sint8
+
+
+class Record(Struct):
+    magic = ByteString(4)
+    count = uint8
+    color = EnumConverter(uint8, Color)
+    __padding__ = Padding(2)
+    offset = sint32
+    scale = FixedPointConverter(sint16, 1/4096)
+    value = float32
+    index = NoneableConverter(uint16, 0xFFFF)
+    matrix = Array(float32, 3)
+    inner = Inner
+    inners = Array(Inner, 2)
+
+
+class Named(Struct):
+    count = uint8
+    name = cstring
+
+
+def is_struct_field(field):
+    return isinstance(field, Field) and isinstance(field.field_type, type) and issubclass(field.field_type, Struct)
+
+
+def pack_fields(stream, struct_class, struct):
+    """Pack a struct one field at a time, without the compiled codec."""
+    for field in struct_class.struct_fields:
+        if is_struct_field(field):
+            pack_fields(stream, field.field_type, getattr(struct, field.name))
+        else:
+            field.pack(stream, struct)
+
+
+def unpack_fields(stream, struct_class):
+    """Unpack a struct one field at a time, without the compiled codec."""
+    struct = struct_class.__new__(struct_class)
+    for field in struct_class.struct_fields:
+        if is_struct_field(field):
+            setattr(struct, field.name, unpack_fields(stream, field.field_type))
+        else:
+            field.unpack(stream, struct)
+    return struct
+
+
+def create_inner(a, b):
+    inner = Inner()
+    inner.a = a
+    inner.b = b
+    return inner
+
+
+def create_record(i):
+    record = Record()
+    record.magic = b'TEST'
+    record.count = i
+    record.color = Color(i % 3)
+    record.offset = -1000*i
+    record.scale = 0.5 + i/4096
+    record.value = 1.5*i
+    record.index = None if i % 2 else i
+    record.matrix = [1.0, -2.0, 0.25*i]
+    record.inner = create_inner(i, -i)
+    record.inners = [create_inner(2*i, 1), create_inner(3*i, -1)]
+    return record
+
+
+class TestCompiledStruct(unittest.TestCase):
+
+    def test_compiled(self):
+        self.assertIsNotNone(Record._struct)
+        self.assertEqual(Record._struct.size, Record.sizeof())
+        self.assertIsNone(Named._struct)
+
+    def test_pack_matches_field_by_field(self):
+        for i in range(4):
+            record = create_record(i)
+            expected = io.BytesIO()
+            pack_fields(expected, Record, record)
+            stream = io.BytesIO()
+            Record.pack(stream, record)
+            self.assertEqual(stream.getvalue(), expected.getvalue())
+            buffer_stream = BufferStream(bytearray())
+            Record.pack(buffer_stream, record)
+            self.assertEqual(bytes(buffer_stream.buffer), expected.getvalue())
+
+    def test_unpack_matches_field_by_field(self):
+        for i in range(4):
+            stream = io.BytesIO()
+            pack_fields(stream, Record, create_record(i))
+            data = stream.getvalue()
+            expected = unpack_fields(io.BytesIO(data), Record)
+            self.assertEqual(Record.unpack(io.BytesIO(data)), expected)
+            self.assertEqual(Record.unpack(BufferStream(data)), expected)
+            self.assertEqual(Record.unpack_from(data), expected)
+            self.assertEqual(Record.unpack_from(data).index, None if i % 2 else i)
+
+    def test_array_round_trip(self):
+        records = [create_record(i) for i in range(4)]
+        expected = io.BytesIO()
+        for record in records:
+            pack_fields(expected, Record, record)
+        for stream in (io.BytesIO(), BufferStream(bytearray())):
+            Record.pack_array(stream, records)
+            data = stream.getvalue() if isinstance(stream, io.BytesIO) else bytes(stream.buffer)
+            self.assertEqual(data, expected.getvalue())
+        self.assertEqual(Record.unpack_array(io.BytesIO(expected.getvalue()), 4), records)
+        self.assertEqual(Record.unpack_array(BufferStream(expected.getvalue()), 4), records)
+
+    def test_uncompiled_struct(self):
+        named = Named()
+        named.count = 3
+        named.name = 'name'
+        stream = io.BytesIO()
+        Named.pack(stream, named)
+        self.assertEqual(stream.getvalue(), b'\x03name\x00')
+        self.assertEqual(Named.unpack(io.BytesIO(stream.getvalue())), named)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+from btypes import BufferStream
+import j3d.evp1
+from j3d.evp1 import Influence, InfluenceGroups
+
+
+class TestInfluenceGroups(unittest.TestCase):
+
+    def setUp(self):
+        self.influence_groups = InfluenceGroups.from_groups([
+            [Influence(0, 0.25), Influence(1, 0.75)],
+            [],
+            [Influence(2, 1)]
+        ])
+
+    def test_groups_are_read_only_views(self):
+        influence_group = self.influence_groups[0]
+        self.assertEqual([influence.index for influence in influence_group], [0, 1])
+        self.assertEqual([influence.weight for influence in influence_group], [0.25, 0.75])
+        with self.assertRaises(AttributeError):
+            influence_group[0].weight = 0.5
+        self.influence_groups.weights[0] = 0.5
+        self.assertEqual(influence_group[0].weight, 0.5)
+        self.assertEqual(len(self.influence_groups[1]), 0)
+        self.assertEqual(self.influence_groups[-1][-1].index, 2)
+        self.assertEqual(len(self.influence_groups[1:]), 2)
+
+    def test_pack_lists_of_influences(self):
+        stream = BufferStream(bytearray())
+        j3d.evp1.pack(stream, [[Influence(3, 1)]], None)
+        stream.seek(0)
+        influence_groups = j3d.evp1.unpack(stream).influence_groups
+        self.assertEqual(influence_groups.joint_indices.tolist(), [3])
+
+    def test_pack_unpack(self):
+        stream = BufferStream(bytearray())
+        j3d.evp1.pack(stream, self.influence_groups, None)
+        stream.seek(0)
+        influence_groups = j3d.evp1.unpack(stream).influence_groups
+        self.assertEqual(influence_groups.group_offsets.tolist(), [0, 2, 2, 3])
+        self.assertEqual(influence_groups.joint_indices.tolist(), [0, 1, 2])
+        self.assertEqual(influence_groups.weights.tolist(), [0.25, 0.75, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
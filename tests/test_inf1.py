@@ -0,0 +1,111 @@
+import unittest
+import numpy
+from btypes import BufferStream, FormatError
+import j3d.inf1
+from j3d.inf1 import NodeType, Node, NodeArrays, SceneGraph
+
+
+def create_node(node_type, index, children=()):
+    node = Node(node_type, index)
+    node.children = list(children)
+    return node
+
+
+def create_scene_graph():
+    return [
+        create_node(NodeType.JOINT, 0, [
+            create_node(NodeType.MATERIAL, 0, [
+                create_node(NodeType.SHAPE, 0, [
+                    create_node(NodeType.JOINT, 1, [
+                        create_node(NodeType.MATERIAL, 1, [
+                            create_node(NodeType.SHAPE, 1)
+                        ])
+                    ])
+                ]),
+                create_node(NodeType.SHAPE, 2)
+            ]),
+            create_node(NodeType.JOINT, 2)
+        ])
+    ]
+
+
+def get_records(nodes):
+    """Encode nodes as INF1 records one node at a time."""
+    records = []
+    for node in nodes:
+        records.append((node.node_type.value, node.index))
+        if node.children:
+            records.append((NodeType.BEGIN_CHILDREN.value, 0))
+            records.extend(get_records(node.children))
+            records.append((NodeType.END_CHILDREN.value, 0))
+    return records
+
+
+def get_tree(nodes):
+    return [(node.node_type, node.index, get_tree(node.children)) for node in nodes]
+
+
+class TestNodeArrays(unittest.TestCase):
+
+    def setUp(self):
+        self.nodes = create_scene_graph()
+        self.records = numpy.array(get_records(self.nodes) + [(NodeType.END_GRAPH.value, 0)], numpy.dtype('>u2'))
+
+    def test_from_nodes(self):
+        node_arrays = NodeArrays.from_nodes(self.nodes)
+        self.assertEqual(node_arrays.indices.tolist(), [0, 0, 0, 1, 1, 1, 2, 2])
+        self.assertEqual(node_arrays.parents.tolist(), [-1, 0, 1, 2, 3, 4, 1, 0])
+        self.assertEqual(node_arrays.depths.tolist(), [0, 1, 2, 3, 4, 5, 2, 1])
+        self.assertEqual(node_arrays.get_subtree_ends().tolist(), [8, 7, 6, 6, 6, 6, 7, 8])
+        self.assertEqual(node_arrays.get_nearest_ancestors(NodeType.MATERIAL).tolist(), [-1, -1, 1, 1, 1, 4, 1, -1])
+        self.assertEqual(node_arrays.count_ancestors(NodeType.JOINT).tolist(), [0, 1, 1, 1, 2, 2, 1, 1])
+
+    def test_pack_records(self):
+        node_arrays = NodeArrays.from_nodes(self.nodes)
+        self.assertEqual(node_arrays.pack_records().tolist(), self.records.tolist())
+
+    def test_from_records(self):
+        node_arrays = NodeArrays.from_records(self.records)
+        expected = NodeArrays.from_nodes(self.nodes)
+        self.assertEqual(node_arrays.node_types.tolist(), expected.node_types.tolist())
+        self.assertEqual(node_arrays.indices.tolist(), expected.indices.tolist())
+        self.assertEqual(node_arrays.parents.tolist(), expected.parents.tolist())
+        self.assertEqual(node_arrays.depths.tolist(), expected.depths.tolist())
+        self.assertEqual(get_tree(node_arrays.create_nodes()), get_tree(self.nodes))
+
+    def test_records_after_end_of_graph_are_ignored(self):
+        records = numpy.concatenate((self.records, [(NodeType.JOINT.value, 5), (0xFFFF, 0xFFFF)]))
+        self.assertEqual(len(NodeArrays.from_records(records)), 8)
+
+    def test_invalid_records(self):
+        joint = (NodeType.JOINT.value, 0)
+        begin = (NodeType.BEGIN_CHILDREN.value, 0)
+        end = (NodeType.END_CHILDREN.value, 0)
+        end_graph = (NodeType.END_GRAPH.value, 0)
+        for records in [
+            [joint],
+            [joint, begin, joint, end_graph],
+            [joint, end, end_graph],
+            [begin, joint, end, end_graph],
+            [joint, begin, begin, joint, end, end, end_graph],
+            [(0x13, 0), end_graph]
+        ]:
+            with self.subTest(records=records), self.assertRaises(FormatError):
+                NodeArrays.from_records(numpy.array(records, numpy.dtype('>u2')))
+
+    def test_section_round_trip(self):
+        scene_graph = SceneGraph()
+        scene_graph.unknown0 = 1
+        scene_graph.children = self.nodes
+        stream = BufferStream(bytearray())
+        j3d.inf1.pack(stream, scene_graph, 3, 9)
+        stream.seek(0)
+        section = j3d.inf1.unpack(stream)
+        self.assertEqual(section.scene_graph.unknown0, 1)
+        self.assertEqual(section.shape_batch_count, 3)
+        self.assertEqual(section.vertex_position_count, 9)
+        self.assertEqual(get_tree(section.scene_graph.children), get_tree(self.nodes))
+
+
+if __name__ == '__main__':
+    unittest.main()
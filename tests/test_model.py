@@ -0,0 +1,238 @@
+import copy
+import os
+import tempfile
+import unittest
+import numpy
+import gx
+import gx.bti
+import gx.texture
+from btypes import BufferStream
+import j3d.model
+import j3d.inf1
+import j3d.vtx1
+import j3d.evp1
+import j3d.drw1
+import j3d.jnt1
+import j3d.shp1
+import j3d.mat3
+import models.model
+
+
+def create_array(attribute, component_count, values):
+    array_format = j3d.vtx1.AttributeFormat(attribute, component_count, gx.F32, 0)
+    element_type = j3d.vtx1.get_element_type(array_format)
+    array = numpy.array(values, element_type.base.newbyteorder('>'))
+    array = array.reshape((-1,) + element_type.shape).view(j3d.vtx1.Array)
+    array.attribute = attribute
+    array.component_type = gx.F32
+    array.component_count = component_count
+    array.scale_exponent = 0
+    return array
+
+
+def create_model():
+    scene_graph = j3d.inf1.SceneGraph()
+    scene_graph.unknown0 = 1
+    joint_node = j3d.inf1.Node(j3d.inf1.NodeType.JOINT, 0)
+    material_node = j3d.inf1.Node(j3d.inf1.NodeType.MATERIAL, 0)
+    material_node.children.append(j3d.inf1.Node(j3d.inf1.NodeType.SHAPE, 0))
+    joint_node.children.append(material_node)
+    scene_graph.children = [joint_node]
+
+    joint = j3d.jnt1.Joint()
+    joint.name = 'joint'
+    joint.bounding_radius = 1
+    joint.min_x = joint.min_y = joint.min_z = -1
+    joint.max_x = joint.max_y = joint.max_z = 1
+
+    descriptors = [j3d.shp1.AttributeDescriptor(gx.VA_POS, gx.INDEX16)]
+    vertices = numpy.zeros(3, j3d.shp1.get_vertex_type(descriptors))
+    vertices[gx.VA_POS.name] = [0, 1, 2]
+    shape = j3d.shp1.Shape()
+    shape.transformation_type = 0
+    shape.attribute_descriptors = descriptors
+    shape.batches = [j3d.shp1.Batch([j3d.shp1.Primitive(gx.TRIANGLES, vertices)], [0], 0)]
+    shape.first_packet = 0
+    shape.bounding_radius = 1
+    shape.min_x = shape.min_y = shape.min_z = -1
+    shape.max_x = shape.max_y = shape.max_z = 1
+
+    material = j3d.mat3.Material()
+    material.name = 'material'
+    material.texture_indices[0] = 0
+
+    with tempfile.TemporaryFile() as stream:
+        stream.write(bytes(range(256)))
+        stream.seek(0)
+        images = gx.texture.unpack_images(stream, gx.TF_I8, 16, 16, 1)
+    texture = gx.bti.Texture()
+    texture.name = 'texture'
+    texture.image_format = gx.TF_I8
+    texture.width = 16
+    texture.height = 16
+    texture.wrap_s = gx.REPEAT
+    texture.wrap_t = gx.REPEAT
+    texture.palette_format = gx.TL_IA8
+    texture.palette_entry_count = 0
+    texture.minification_filter = gx.LINEAR
+    texture.magnification_filter = gx.LINEAR
+    texture.minimum_lod = 0
+    texture.maximum_lod = 0
+    texture.lod_bias = 0
+    texture.palette = None
+    texture.images = images
+
+    model = j3d.model.Model()
+    model.file_type = b'bdl4'
+    model.subversion = b'SVR3'
+    model.scene_graph = scene_graph
+    model.position_array = create_array(gx.VA_POS, gx.POS_XYZ, numpy.arange(9))
+    model.normal_array = None
+    model.color_arrays = [None]*2
+    model.texcoord_arrays = [None]*8
+    model.influence_groups = j3d.evp1.InfluenceGroups.from_groups([])
+    model.inverse_bind_matrices = None
+    model.matrix_definitions = [j3d.drw1.MatrixDefinition(j3d.drw1.MatrixType.JOINT, 0)]
+    model.joints = [joint]
+    model.shapes = [shape]
+    model.materials = [material]
+    model.textures = [texture]
+    return model
+
+
+class TestModelSave(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.file_path = os.path.join(directory.name, 'model.bdl')
+        with open(self.file_path, 'wb') as stream:
+            j3d.model.pack(stream, create_model())
+
+    def test_save_memory_mapped_model_to_source_path(self):
+        model = models.model.Model.load(self.file_path, mmap=True)
+        images = [image.copy() for image in model.textures[0].images]
+        positions = numpy.array(model.position_array)
+
+        model.materials[0].name = 'material with a longer name'
+        model.save(self.file_path)
+
+        for image, original_image in zip(model.textures[0].images, images):
+            self.assertTrue(numpy.array_equal(image, original_image))
+        self.assertTrue(numpy.array_equal(model.position_array, positions))
+
+        with open(self.file_path, 'rb') as stream:
+            saved_model = j3d.model.unpack(BufferStream(stream.read()))
+        self.assertEqual(saved_model.materials[0].name, 'material with a longer name')
+        for image, original_image in zip(saved_model.textures[0].images, images):
+            self.assertTrue(numpy.array_equal(image, original_image))
+        self.assertEqual(os.listdir(os.path.dirname(self.file_path)), ['model.bdl'])
+
+    def test_save_keeps_permissions(self):
+        os.chmod(self.file_path, 0o640)
+        model = models.model.Model.load(self.file_path)
+        model.materials[0].name = 'renamed material'
+        model.save(self.file_path)
+        self.assertEqual(os.stat(self.file_path).st_mode & 0o777, 0o640)
+
+    def test_save_through_symbolic_link(self):
+        link_path = os.path.join(os.path.dirname(self.file_path), 'link.bdl')
+        os.symlink(self.file_path, link_path)
+        model = models.model.Model.load(link_path)
+        model.materials[0].name = 'renamed material'
+        model.save(link_path)
+        self.assertTrue(os.path.islink(link_path))
+        self.assertEqual(model.file_path, link_path)
+        with open(self.file_path, 'rb') as stream:
+            saved_model = j3d.model.unpack(BufferStream(stream.read()))
+        self.assertEqual(saved_model.materials[0].name, 'renamed material')
+
+
+def get_reference_draw_list(model):
+    """Draw list in the order of a recursive traversal of the scene graph."""
+    draw_list = []
+
+    def visit(node, material):
+        for child in node.children:
+            if child.node_type == j3d.inf1.NodeType.SHAPE:
+                if material.unknown0 == 1:
+                    draw_list.append((material, model.shapes[child.index]))
+                visit(child, material)
+                if material.unknown0 == 4:
+                    draw_list.append((material, model.shapes[child.index]))
+            elif child.node_type == j3d.inf1.NodeType.MATERIAL:
+                visit(child, child.material)
+            else:
+                visit(child, material)
+
+    visit(model.scene_graph, None)
+    return draw_list
+
+
+class TestModelDrawList(unittest.TestCase):
+
+    def setUp(self):
+        def create_node(node_type, index, children=()):
+            node = j3d.inf1.Node(node_type, index)
+            node.children = list(children)
+            return node
+
+        JOINT = j3d.inf1.NodeType.JOINT
+        MATERIAL = j3d.inf1.NodeType.MATERIAL
+        SHAPE = j3d.inf1.NodeType.SHAPE
+        model = create_model()
+        model.scene_graph.children = [
+            create_node(JOINT, 0, [
+                create_node(MATERIAL, 0, [
+                    create_node(SHAPE, 0, [
+                        create_node(MATERIAL, 1, [
+                            create_node(SHAPE, 1, [
+                                create_node(SHAPE, 2)
+                            ]),
+                            create_node(SHAPE, 3)
+                        ])
+                    ]),
+                    create_node(SHAPE, 4, [
+                        create_node(MATERIAL, 2, [
+                            create_node(SHAPE, 5)
+                        ])
+                    ])
+                ]),
+                create_node(MATERIAL, 1, [
+                    create_node(SHAPE, 6)
+                ])
+            ])
+        ]
+        model.shapes = [copy.deepcopy(model.shapes[0]) for _ in range(7)]
+        model.materials = [copy.deepcopy(model.materials[0]) for _ in range(3)]
+        for i, (material, unknown0) in enumerate(zip(model.materials, [1, 4, 4])):
+            material.name = f'material{i}'
+            material.unknown0 = unknown0
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        file_path = os.path.join(directory.name, 'model.bdl')
+        with open(file_path, 'wb') as stream:
+            j3d.model.pack(stream, model)
+        self.model = models.model.Model.load(file_path)
+        self.addCleanup(self.model.gl_delete)
+
+    def assertDrawListEqual(self, draw_list, expected):
+        self.assertEqual(
+            [(id(material), id(shape)) for material, shape in draw_list],
+            [(id(material), id(shape)) for material, shape in expected]
+        )
+
+    def test_draw_list_order(self):
+        self.assertDrawListEqual(self.model.get_draw_list(), get_reference_draw_list(self.model))
+        shape_order = [self.model.shapes.index(shape) for material, shape in self.model.get_draw_list()]
+        self.assertEqual(shape_order, [0, 2, 1, 3, 4, 5, 6])
+
+    def test_draw_list_after_material_change(self):
+        self.model.get_draw_list()
+        self.model.materials[0].unknown0 = 4
+        self.assertDrawListEqual(self.model.get_draw_list(), get_reference_draw_list(self.model))
+
+
+if __name__ == '__main__':
+    unittest.main()
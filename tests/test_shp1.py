@@ -0,0 +1,119 @@
+import unittest
+import numpy
+import gx
+from btypes import BufferStream, FormatError
+import j3d.shp1
+from j3d.shp1 import AttributeDescriptor, Batch
+
+
+ATTRIBUTE_DESCRIPTORS = [
+    AttributeDescriptor(gx.VA_PTNMTXIDX, gx.DIRECT),
+    AttributeDescriptor(gx.VA_POS, gx.INDEX16),
+    AttributeDescriptor(gx.VA_TEX0, gx.INDEX8)
+]
+
+
+def create_batch(vertex_type, primitive_types, vertex_counts, matrix_table):
+    vertex_count = sum(vertex_counts)
+    vertices = numpy.zeros(vertex_count, vertex_type)
+    vertices['VA_PTNMTXIDX'] = 3*numpy.arange(vertex_count)
+    vertices['VA_POS'] = 1000 + numpy.arange(vertex_count)
+    vertices['VA_TEX0'] = numpy.arange(vertex_count)[::-1]
+    primitive_offsets = numpy.zeros(len(vertex_counts) + 1, numpy.uint32)
+    primitive_offsets[1:] = numpy.cumsum(vertex_counts)
+    primitive_types = numpy.array([primitive_type.value for primitive_type in primitive_types], numpy.uint8)
+    return Batch.from_arrays(vertices, primitive_types, primitive_offsets, matrix_table, 0xFFFF)
+
+
+def create_shape(batches):
+    shape = j3d.shp1.Shape()
+    shape.attribute_descriptors = list(ATTRIBUTE_DESCRIPTORS)
+    shape.batches = batches
+    shape.bounding_radius = 1
+    shape.min_x = shape.min_y = shape.min_z = -1
+    shape.max_x = shape.max_y = shape.max_z = 1
+    return shape
+
+
+class TestPacket(unittest.TestCase):
+
+    def setUp(self):
+        self.vertex_type = j3d.shp1.get_vertex_type(ATTRIBUTE_DESCRIPTORS)
+
+    def test_round_trip(self):
+        batch = create_batch(self.vertex_type, [gx.TRIANGLES, gx.TRIANGLESTRIP, gx.QUADS], [3, 5, 4], [0, 1])
+        stream = BufferStream(bytearray())
+        j3d.shp1.pack_packet(stream, batch)
+        size = len(stream.buffer)
+        self.assertEqual(size % 0x20, 0)
+        stream.seek(0)
+        vertices, primitive_types, primitive_offsets = j3d.shp1.unpack_packet(stream, self.vertex_type, size)
+        self.assertEqual(vertices.tobytes(), batch.vertices.tobytes())
+        self.assertEqual(primitive_types.tolist(), batch.primitive_types.tolist())
+        self.assertEqual(primitive_offsets.tolist(), [0, 3, 8, 12])
+
+        primitives = Batch.from_arrays(vertices, primitive_types, primitive_offsets, [0, 1], 0xFFFF).primitives
+        self.assertEqual([primitive.primitive_type for primitive in primitives], [gx.TRIANGLES, gx.TRIANGLESTRIP, gx.QUADS])
+        self.assertEqual(primitives[1].vertices['VA_POS'].tolist(), [1003, 1004, 1005, 1006, 1007])
+
+    def unpack_packet(self, packet):
+        stream = BufferStream(bytearray(packet))
+        return j3d.shp1.unpack_packet(stream, self.vertex_type, len(packet))
+
+    def test_invalid_primitive_type(self):
+        with self.assertRaises(FormatError):
+            self.unpack_packet(b'\x90\x00\x01' + bytes(4) + b'\x42\x00\x00' + bytes(6))
+
+    def test_primitive_past_end_of_packet(self):
+        with self.assertRaises(FormatError):
+            self.unpack_packet(b'\x90\x00\x02' + bytes(4))
+        with self.assertRaises(FormatError):
+            self.unpack_packet(bytes(6) + b'\x90\x00')
+
+
+class TestSection(unittest.TestCase):
+
+    def test_duplicates_are_stored_once(self):
+        vertex_type = j3d.shp1.get_vertex_type(ATTRIBUTE_DESCRIPTORS)
+        shapes = [
+            create_shape([
+                create_batch(vertex_type, [gx.TRIANGLES], [3], [0, 1]),
+                create_batch(vertex_type, [gx.QUADS], [4], [2])
+            ]),
+            create_shape([
+                create_batch(vertex_type, [gx.TRIANGLES], [3], [0, 1]),
+                create_batch(vertex_type, [gx.TRIANGLES], [3], [2])
+            ])
+        ]
+        stream = BufferStream(bytearray())
+        j3d.shp1.pack(stream, shapes)
+        stream.seek(0)
+        header = j3d.shp1.Header.unpack(stream)
+
+        self.assertEqual(shapes[0].attribute_descriptor_offset, shapes[1].attribute_descriptor_offset)
+        stream.seek(header.matrix_selection_offset)
+        matrix_selections = j3d.shp1.MatrixSelection.unpack_array(stream, 4)
+        self.assertEqual([selection.first for selection in matrix_selections], [0, 2, 0, 2])
+        stream.seek(header.matrix_index_offset)
+        self.assertEqual(j3d.shp1.uint16.unpack_array(stream, 3), [0, 1, 2])
+        stream.seek(header.packet_location_offset)
+        packet_locations = j3d.shp1.PacketLocation.unpack_array(stream, 4)
+        offsets = [packet_location.offset for packet_location in packet_locations]
+        # Packets don't include the matrix table, so the last batch shares
+        # the packet of the first
+        self.assertEqual(offsets[0], offsets[2])
+        self.assertEqual(offsets[0], offsets[3])
+        self.assertNotEqual(offsets[0], offsets[1])
+        self.assertEqual(len(set(offsets)), 2)
+
+        stream.seek(0)
+        unpacked_shapes = j3d.shp1.unpack(stream)
+        for shape, unpacked_shape in zip(shapes, unpacked_shapes):
+            for batch, unpacked_batch in zip(shape.batches, unpacked_shape.batches):
+                self.assertEqual(list(unpacked_batch.matrix_table), list(batch.matrix_table))
+                self.assertEqual(unpacked_batch.vertices.tobytes(), batch.vertices.tobytes())
+                self.assertEqual(unpacked_batch.primitive_types.tolist(), batch.primitive_types.tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,6 +4,8 @@ import os.path
 from PyQt5.QtCore import Qt
 from PyQt5 import QtCore, QtWidgets, QtGui, uic
 import j3d.animation
+import j3d.ank1
+import j3d.anf1
 import models.model
 from widgets.modelview import UndoStack
 from widgets.info_dialog import InfoDialog
@@ -53,7 +55,9 @@ class Editor(QtWidgets.QMainWindow):
         self.addAction(self.action_redo)
 
         self.action_open_animation.setEnabled(False)
+        self.action_export_animation.setEnabled(False)
         self.action_save_model.setEnabled(False)
+        self.animation_timeline.setEnabled(False)
         self.action_save_model_as.setEnabled(False)
 
         self.view_settings.setViewer(self.viewer)
@@ -72,6 +76,11 @@ class Editor(QtWidgets.QMainWindow):
         self.advanced_material_dialog = None
         self.material_form.advanced_button.clicked.connect(self.on_material_form_advanced_button_clicked)
 
+        self.animation_memory_budget = 64*2**20
+        self.animation_cache_directory = os.path.join(
+                QtCore.QStandardPaths.writableLocation(QtCore.QStandardPaths.CacheLocation),
+                'animations')
+
         self.setWindowFilePath('')
 
         self.adjustSize()
@@ -107,6 +116,10 @@ class Editor(QtWidgets.QMainWindow):
         settings.setValue('rotation_speed', self.viewer.rotation_speed)
         settings.endGroup()
 
+        settings.beginGroup('animation')
+        settings.setValue('memory_budget', self.animation_memory_budget)
+        settings.endGroup()
+
     def readSettings(self):
         settings = QtCore.QSettings()
         
@@ -126,6 +139,10 @@ class Editor(QtWidgets.QMainWindow):
         self.viewer.rotation_speed = settings.value('rotation_speed', 1, float)
         settings.endGroup()
 
+        settings.beginGroup('animation')
+        self.animation_memory_budget = settings.value('memory_budget', 64*2**20, int)
+        settings.endGroup()
+
     def warning(self, message):
         QtWidgets.QMessageBox.warning(self, QtWidgets.qApp.applicationName(), message)
 
@@ -163,8 +180,10 @@ class Editor(QtWidgets.QMainWindow):
             self.scene_graph_dialog.setModel(model)
 
         self.action_open_animation.setEnabled(True)
+        self.action_export_animation.setEnabled(False)
         self.action_save_model.setEnabled(True)
         self.action_save_model_as.setEnabled(True)
+        self.animation_timeline.setEnabled(False)
 
         self.setWindowFilePath(file_path)
 
@@ -174,11 +193,33 @@ class Editor(QtWidgets.QMainWindow):
         self.setWindowFilePath(file_path)
 
     def loadAnimation(self, file_name):
-        with open(file_name, 'rb') as stream:
-            animation = j3d.animation.unpack(stream)
+        animation = j3d.animation.load(
+                file_name,
+                self.animation_memory_budget,
+                self.animation_cache_directory)
 
         self.viewer.setAnimation(animation)
 
+        # Looping animations wrap around to frame 0 at the duration, so the
+        # last frame that can be seeked to is the one before it
+        last_frame = animation.duration
+        if animation.loop_mode == 2 and animation.duration > 0:
+            last_frame -= 1
+
+        self.animation_slider.blockSignals(True)
+        self.animation_slider.setRange(0, last_frame)
+        self.animation_slider.setValue(0)
+        self.animation_slider.blockSignals(False)
+        self.animation_play_button.setChecked(True)
+        self.animation_timeline.setEnabled(True)
+
+        self.action_export_animation.setEnabled(isinstance(animation, j3d.ank1.SkeletalAnimation))
+
+    def exportAnimation(self, file_name):
+        animation = j3d.anf1.bake(self.viewer.animation)
+        with open(file_name, 'wb') as stream:
+            j3d.animation.pack(stream, animation)
+
     def openFile(self, file_name):
         try:
             self.loadModel(file_name)
@@ -193,6 +234,23 @@ class Editor(QtWidgets.QMainWindow):
     def on_undo_stack_cleanChanged(self, clean):
         self.setWindowModified(not clean)
 
+    @QtCore.pyqtSlot(float)
+    def on_viewer_animationTimeChanged(self, time):
+        self.animation_slider.blockSignals(True)
+        self.animation_slider.setValue(int(time))
+        self.animation_slider.blockSignals(False)
+        self.animation_time_label.setText('{:g} / {}'.format(time, self.viewer.animation.duration))
+        if self.viewer.animation.is_finished:
+            self.animation_play_button.setChecked(False)
+
+    @QtCore.pyqtSlot(bool)
+    def on_animation_play_button_toggled(self, checked):
+        self.viewer.setAnimationPlaying(checked)
+
+    @QtCore.pyqtSlot(int)
+    def on_animation_slider_valueChanged(self, value):
+        self.viewer.seekAnimation(value)
+
     def on_explorer_currentMaterialChanged(self, material):
         self.material_form.setMaterial(material)
         self.dock_material_form.raise_()
@@ -224,7 +282,7 @@ class Editor(QtWidgets.QMainWindow):
                 self,
                 'Open Animation',
                 os.path.dirname(self.windowFilePath()),
-                'Nintendo J3D animation (*.bck *.btk *.btp *.bva *.brk *.bpk);;All files (*)')
+                'Nintendo J3D animation (*.bck *.bca *.btk *.btp *.bva *.brk *.bpk);;All files (*)')
         if not file_name: return
 
         try:
@@ -234,6 +292,22 @@ class Editor(QtWidgets.QMainWindow):
         except j3d.animation.IncompatibleAnimationError:
             self.warning('Incompatible animation')
 
+    @QtCore.pyqtSlot()
+    def on_action_export_animation_triggered(self):
+        file_name, _ = QtWidgets.QFileDialog.getSaveFileName(
+                self,
+                'Export Animation',
+                os.path.dirname(self.windowFilePath()),
+                'Nintendo J3D full frame animation (*.bca);;All files (*)')
+        if not file_name: return
+
+        try:
+            self.exportAnimation(file_name)
+        except FILE_OPEN_ERRORS as error:
+            self.warning_file_open_failed(error)
+        except ValueError as error:
+            self.warning('Could not export animation: {}'.format(error))
+
     @QtCore.pyqtSlot()
     def on_action_save_model_triggered(self):
         try:
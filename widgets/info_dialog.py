@@ -62,9 +62,9 @@ class InfoDialog(QtWidgets.QDialog):
 
         for i, shape in enumerate(model.shapes):
             batch_count = len(shape.batches)
-            primitive_count = sum(len(batch.primitives) for batch in shape.batches)
-            vertex_count = sum(len(primitive.vertices) for primitive in shape.primitives)
-            byte_count = sum(3 + primitive.vertices.nbytes for primitive in shape.primitives)
+            primitive_count = sum(batch.primitive_count for batch in shape.batches)
+            vertex_count = sum(len(batch.vertices) for batch in shape.batches)
+            byte_count = sum(3*batch.primitive_count + batch.vertices.nbytes for batch in shape.batches)
 
             stream.write(f'Shape {i}\n')
             for descriptor in shape.attribute_descriptors:
@@ -54,6 +54,8 @@ def create_frustum_matrix(left,right,bottom,top,near,far):
 
 class ViewerWidget(gl.ResourceManagerMixin, QtWidgets.QOpenGLWidget):
 
+    animationTimeChanged = QtCore.pyqtSignal(float)
+
     @property
     def projection_matrix(self):
         return self.matrix_block['projection_matrix']
@@ -77,6 +79,7 @@ class ViewerWidget(gl.ResourceManagerMixin, QtWidgets.QOpenGLWidget):
 
         self.model = None
         self.animation = None
+        self.animation_playing = False
 
         self.z_near = 25
         self.z_far = 12800
@@ -190,18 +193,34 @@ class ViewerWidget(gl.ResourceManagerMixin, QtWidgets.QOpenGLWidget):
         if self.view_matrix_need_update:
             self.update_view_matrix()
 
-        if self.animation is not None and not self.animation.is_finished:
-            self.animation.advance_frame()
+        if self.animation is not None and self.animation_playing:
+            if self.animation.is_finished:
+                self.animation_playing = False
+            else:
+                self.animation.advance_frame()
+                self.animationTimeChanged.emit(self.animation.time)
 
         self.update()
 
     def setModel(self, model):
         self.model = model
         self.animation = None
+        self.animation_playing = False
 
     def setAnimation(self, animation):
         animation.attach(self.model)
         self.animation = animation
+        self.animation_playing = True
+
+    def setAnimationPlaying(self, playing):
+        if playing and self.animation.is_finished:
+            self.animation.attach(self.model)
+        self.animation_playing = playing
+
+    def seekAnimation(self, time):
+        self.animation.seek(time)
+        self.animationTimeChanged.emit(self.animation.time)
+        self.update()
 
     def keyPressEvent(self, event):
         self.pressed_keys.add(event.key())